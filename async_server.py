@@ -0,0 +1,261 @@
+import asyncio
+import collections
+import functools
+import threading
+
+import log_pipeline
+import outbound
+import protocol
+from server import Server
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+class AsyncConnection:
+    """Socket-like wrapper around an asyncio StreamWriter so the shared Server routing code can use it.
+
+    sendall() only enqueues; a per-connection writer task drains the bounded queue. on_written
+    works as for outbound.ClientConnection.
+    """
+
+    def __init__(self, writer, addr, max_queue, policy, congested, on_error):
+        self.writer = writer
+        self.addr = addr
+        self.max_queue = max_queue
+        self.policy = policy
+        self.congested = congested
+        self.on_error = on_error
+
+        self.encoding = protocol.ENCODING_JSON
+        self.queue = collections.deque()
+        self.wakeup = asyncio.Event()
+        self.space = asyncio.Event()
+        self.space.set()
+        self.closed = False
+        self.dropped_messages = 0
+
+        self.writer_task = asyncio.ensure_future(self._writer_loop())
+
+    def sendall(self, data, on_written=None):
+        if self.closed:
+            raise outbound.SlowConsumerError(f"Connection to {self.addr[0]} is closed.")
+
+        if len(self.queue) >= self.max_queue:
+            if self.policy == outbound.POLICY_DROP_OLDEST:
+                if outbound.drop_oldest_unconfirmed(self.queue):
+                    self.dropped_messages += 1
+            elif self.policy == outbound.POLICY_BLOCK:
+                # The loop can't block here; the sender's handler waits for space before reading more.
+                self.space.clear()
+                self.congested.add(self)
+            else:
+                raise outbound.SlowConsumerError(f"Outbound queue for {self.addr[0]} is full ({self.max_queue} messages).")
+
+        self.queue.append((data, on_written))
+        self.wakeup.set()
+
+    def queue_depth(self):
+        return len(self.queue)
+
+    async def _writer_loop(self):
+        try:
+            while not self.closed:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+
+                while self.queue and not self.closed:
+                    batch = []
+                    batch_size = 0
+                    while self.queue and batch_size < outbound.MAX_WRITE_BATCH_BYTES:
+                        entry = self.queue.popleft()
+                        batch.append(entry)
+                        batch_size += len(entry[0])
+                    if len(self.queue) < self.max_queue:
+                        self.space.set()
+
+                    try:
+                        self.writer.write(b"".join(data for data, _ in batch))
+                        await self.writer.drain()
+                    except BaseException:
+                        outbound.notify_written(batch, False)
+                        raise
+                    outbound.notify_written(batch, True)
+        except (ConnectionError, OSError) as e:
+            if not self.closed:
+                self.on_error(self, e)
+        except asyncio.CancelledError:
+            pass
+
+    def shutdown(self, how):
+        self.closed = True
+        outbound.notify_written(self.queue, False)
+        self.queue.clear()
+        self.space.set()
+        self.wakeup.set()
+        self.writer_task.cancel()
+        self.writer.close()
+
+    def close(self):
+        self.shutdown(None)
+
+
+class AsyncServer(Server):
+    """Server engine that serves every client from a single asyncio event loop instead of one thread per client."""
+
+    def __init__(self, gui):
+        self.loop = None
+        self.loop_thread_id = None
+        self.stop_event = None
+        self.listener = None
+        self.client_tasks = {}
+        self.congested = set()
+        super().__init__(gui)
+
+    def _server_listener_thread(self):
+        self._raise_open_file_limit()
+        if self.cluster is not None:
+            self.cluster.wait_for_peers()
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread_id = threading.get_ident()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._serve())
+        except OSError as e:
+            self.gui.log_output(f"Server setup error: {e}", log_pipeline.ERROR)
+            self.running = False
+        except Exception as e:
+            self.gui.log_output(f"General Server Error: {e}", log_pipeline.ERROR)
+            self.running = False
+        finally:
+            self._cancel_remaining_tasks()
+            self.loop.close()
+            self.gui.log_output("Server listener stopped.")
+
+    def _cancel_remaining_tasks(self):
+        remaining = asyncio.all_tasks(self.loop)
+        for task in remaining:
+            task.cancel()
+        if remaining:
+            self.loop.run_until_complete(asyncio.gather(*remaining, return_exceptions=True))
+
+    async def _serve(self):
+        self.stop_event = asyncio.Event()
+        self.listener = await asyncio.start_server(
+            self._handle_client,
+            self.gui.config.SERVER_HOST,
+            self.gui.config.SERVER_PORT,
+            reuse_address=True,
+            reuse_port=self.gui.config.SERVER_REUSE_PORT or None,
+            backlog=self.gui.config.SERVER_BACKLOG,
+        )
+        self.gui.log_output(f"Server listening on {self.gui.config.SERVER_HOST}:{self.gui.config.SERVER_PORT} (asyncio)")
+
+        try:
+            await self.stop_event.wait()
+        finally:
+            self.listener.close()
+            client_tasks = list(self.client_tasks.values())
+            client_tasks += [conn.writer_task for conn in self.connections.values()]
+            for addr in list(self.connections.keys()):
+                self._cleanup_disconnected_client(addr)
+            for task in client_tasks:
+                task.cancel()
+            await asyncio.gather(*client_tasks, return_exceptions=True)
+            await self.listener.wait_closed()
+            self.gui.log_output("Server socket closed.")
+
+    async def _handle_client(self, reader, writer):
+        addr = writer.get_extra_info('peername')[:2]
+        client_id = self.next_client_id
+        self.next_client_id += 1
+        client_info = f"Client {client_id} ({addr[0]}:{addr[1]})"
+
+        conn = AsyncConnection(writer, addr, self.outbound_queue_size, self.slow_consumer_policy,
+                               self.congested, self._on_outbound_error)
+        self._register_connection(addr, conn)
+        self.metrics.count_accept()
+        self.client_messages[addr] = []
+        self.client_tasks[addr] = asyncio.current_task()
+        self.gui.log_output(f"{client_info} connected.")
+
+        decoder = protocol.FrameDecoder()
+        try:
+            while self.running and addr in self.connections:
+                data = await reader.read(8192)
+                if not data:
+                    self.gui.log_output(f"{client_info} disconnected.")
+                    break
+
+                for frame in decoder.feed(data):
+                    if self.profiler.active:
+                        self.profiler.runcall(self._process_frame, conn, addr, client_info, frame)
+                    else:
+                        self._process_frame(conn, addr, client_info, frame)
+
+                if self.congested:
+                    await self._wait_for_congested_clients()
+
+        except protocol.ProtocolError as e:
+            self.gui.log_output(f"Protocol error from {client_info}: {e}", log_pipeline.WARNING)
+        except (ConnectionError, OSError) as e:
+            self.gui.log_output(f"Client handler error for {client_info}: {e}", log_pipeline.ERROR)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            self.gui.log_output(f"Unexpected client handler error for {client_info}: {e}", log_pipeline.ERROR)
+        finally:
+            if self.connections.get(addr) is conn:
+                self._cleanup_disconnected_client(addr)
+            self.gui.log_output(f"Handler for {client_info} terminated.")
+
+    async def _wait_for_congested_clients(self):
+        # 'block' policy: stop reading from the sender until slow recipients have room again.
+        congested = list(self.congested)
+        self.congested.clear()
+        waiters = [asyncio.ensure_future(conn.space.wait()) for conn in congested]
+        done, pending = await asyncio.wait(waiters, timeout=self.slow_consumer_block_timeout)
+        for conn, waiter in zip(congested, waiters):
+            if waiter in pending:
+                waiter.cancel()
+                self.gui.log_output(f"Outbound queue for {conn.addr[0]} stayed full for {self.slow_consumer_block_timeout}s, disconnecting.", log_pipeline.WARNING)
+                self._cleanup_disconnected_client(conn.addr)
+
+    def _cleanup_disconnected_client(self, addr):
+        # Admin commands run on the GUI thread; transports may only be touched from the loop thread.
+        if self.loop is not None and threading.get_ident() != self.loop_thread_id:
+            if not self.loop.is_closed():
+                self.loop.call_soon_threadsafe(functools.partial(self._cleanup_disconnected_client, addr))
+            return
+        if addr in self.client_tasks:
+            del self.client_tasks[addr]
+        super()._cleanup_disconnected_client(addr)
+
+    def run_in_server_context(self, callback, *args):
+        if self.loop is not None and threading.get_ident() != self.loop_thread_id:
+            if not self.loop.is_closed():
+                self.loop.call_soon_threadsafe(functools.partial(callback, *args))
+            return
+        callback(*args)
+
+    def stop_server(self):
+        self.running = False
+        if self.loop is not None and not self.loop.is_closed() and self.stop_event is not None:
+            self.loop.call_soon_threadsafe(self.stop_event.set)
+            self.server_thread.join(timeout=5)
+        self._stop_metrics_endpoint()
+        self._close_offline_queue()
+        self.gui.log_output("Server stopped.")
+
+    def _raise_open_file_limit(self):
+        # Every idle client holds a file descriptor, so lift the soft limit to the hard limit.
+        if resource is None:
+            return
+        try:
+            soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+            if hard != resource.RLIM_INFINITY and soft < hard:
+                resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError) as e:
+            self.gui.log_output(f"Could not raise open file limit: {e}", log_pipeline.WARNING)
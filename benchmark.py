@@ -0,0 +1,304 @@
+import argparse
+import asyncio
+import ipaddress
+import json
+import math
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import time
+
+import chat_client
+import config
+import protocol
+
+BENCH_PREFIX = "BENCH"
+FIRST_CLIENT_IP = ipaddress.IPv4Address("127.1.0.1")
+MESSAGE_TYPES = ("DM", "BROADCAST")
+CONNECT_TIMEOUT = 10.0
+
+
+def client_ip(index):
+    # The server routes DMs by IP, so every synthetic client gets its own loopback address.
+    return str(FIRST_CLIENT_IP + index)
+
+
+def percentile(sorted_samples, fraction):
+    if not sorted_samples:
+        return None
+    # Nearest-rank percentile.
+    rank = max(1, math.ceil(fraction * len(sorted_samples)))
+    return sorted_samples[rank - 1]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def raise_file_limit():
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+class TypeStats:
+    def __init__(self):
+        self.sent = 0
+        self.sent_bytes = 0
+        self.expected = 0
+        self.received = 0
+        self.received_bytes = 0
+        self.latencies = []
+
+    def summary(self, duration):
+        latencies = sorted(self.latencies)
+        summary = {
+            "sent": self.sent,
+            "expected_deliveries": self.expected,
+            "delivered": self.received,
+            "lost": max(0, self.expected - self.received),
+            "sent_per_second": self.sent / duration,
+            "delivered_per_second": self.received / duration,
+            "delivered_bytes_per_second": self.received_bytes / duration,
+            "latency_ms": None,
+        }
+        if latencies:
+            summary["latency_ms"] = {
+                "min": latencies[0] * 1000,
+                "mean": sum(latencies) / len(latencies) * 1000,
+                "p50": percentile(latencies, 0.50) * 1000,
+                "p95": percentile(latencies, 0.95) * 1000,
+                "p99": percentile(latencies, 0.99) * 1000,
+                "max": latencies[-1] * 1000,
+            }
+        return summary
+
+
+class Benchmark:
+    """Drives N AsyncChatClients against one server and collects end-to-end latencies.
+
+    Each message carries the perf_counter() reading taken right before it was written; all
+    clients live in this process, so the receiver subtracts it from its own clock. Only
+    messages sent inside the measurement window (after the warmup) are counted.
+    """
+
+    def __init__(self, host, port, args):
+        self.host = host
+        self.port = port
+        self.args = args
+        self.stats = {msg_type: TypeStats() for msg_type in MESSAGE_TYPES}
+        self.server_errors = 0
+        self.clients = []
+        self.measure_start = None
+        self.measure_end = None
+
+    async def run(self):
+        args = self.args
+        connect_started = time.perf_counter()
+        for start in range(0, args.clients, args.connect_batch):
+            batch = [self._connect(index) for index in range(start, min(args.clients, start + args.connect_batch))]
+            self.clients.extend(await asyncio.gather(*batch))
+        connect_seconds = time.perf_counter() - connect_started
+
+        receivers = [asyncio.ensure_future(self._receive(client)) for client in self.clients]
+        # Let every HELLO round trip finish so the run measures the negotiated encoding.
+        await asyncio.sleep(0.2)
+
+        now = time.perf_counter()
+        self.measure_start = now + args.warmup
+        self.measure_end = self.measure_start + args.duration
+        senders = [asyncio.ensure_future(self._send(index, client)) for index, client in enumerate(self.clients)]
+        await asyncio.gather(*senders)
+        await asyncio.sleep(args.drain)
+
+        for receiver in receivers:
+            receiver.cancel()
+        await asyncio.gather(*receivers, return_exceptions=True)
+        for client in self.clients:
+            await client.close()
+        return connect_seconds
+
+    async def _connect(self, index):
+        client = chat_client.AsyncChatClient(encodings=self.args.encodings)
+        await client.connect(self.host, self.port, timeout=CONNECT_TIMEOUT, local_addr=(client_ip(index), 0))
+        return client
+
+    async def _send(self, index, client):
+        args = self.args
+        rng = random.Random(args.seed + index)
+        interval = 1.0 / args.rate
+        # Spread the clients' first sends over one interval so they do not fire in lockstep.
+        next_send = time.perf_counter() + rng.uniform(0, interval)
+        while True:
+            now = time.perf_counter()
+            if now >= self.measure_end:
+                return
+            if next_send > now:
+                await asyncio.sleep(next_send - now)
+            next_send += interval
+
+            size = rng.choice(args.sizes)
+            broadcast = rng.random() < args.broadcast_ratio
+            sent_at = time.perf_counter()
+            header = f"{BENCH_PREFIX} {sent_at!r} "
+            message = header + "x" * max(0, size - len(header))
+            if broadcast:
+                await client.send_broadcast(message)
+            else:
+                recipient = rng.randrange(args.clients - 1)
+                if recipient >= index:
+                    recipient += 1
+                await client.send_dm(client_ip(recipient), message)
+
+            if self.measure_start <= sent_at < self.measure_end:
+                stats = self.stats["BROADCAST" if broadcast else "DM"]
+                stats.sent += 1
+                stats.sent_bytes += len(message)
+                stats.expected += args.clients - 1 if broadcast else 1
+
+    async def _receive(self, client):
+        async for message in client:
+            received_at = time.perf_counter()
+            msg_type = message.get("type")
+            text = message.get("message") or ""
+            if msg_type not in self.stats or not text.startswith(BENCH_PREFIX):
+                if msg_type == "ERROR":
+                    self.server_errors += 1
+                continue
+            sent_at = float(text.split(" ", 2)[1])
+            if self.measure_start <= sent_at < self.measure_end:
+                stats = self.stats[msg_type]
+                stats.received += 1
+                stats.received_bytes += len(text)
+                stats.latencies.append(received_at - sent_at)
+
+    def results(self, connect_seconds):
+        duration = self.args.duration
+        return {
+            "connect_seconds": connect_seconds,
+            "server_errors": self.server_errors,
+            "types": {msg_type: stats.summary(duration) for msg_type, stats in self.stats.items()},
+        }
+
+
+def start_server(args, port):
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py"),
+               "--headless", "--no-stdin", "--engine", args.engine, "--workers", str(args.workers), "--port", str(port)]
+    log_file = open(args.server_log, "ab") if args.server_log else subprocess.DEVNULL
+    process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=log_file, stderr=log_file)
+
+    deadline = time.monotonic() + args.server_start_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited during startup with code {process.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    stop_server(process)
+    raise RuntimeError(f"server did not accept connections within {args.server_start_timeout} s")
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def parse_sizes(value):
+    try:
+        sizes = [int(size) for size in value.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected a comma separated list of byte counts")
+    if not sizes or min(sizes) < 1:
+        raise argparse.ArgumentTypeError("message sizes must be positive")
+    return sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=f"{config.APP_NAME} server load and latency benchmark")
+    parser.add_argument("--clients", type=int, default=100, help="Synthetic clients (default: %(default)s)")
+    parser.add_argument("--rate", type=float, default=10.0, help="Messages per second per client (default: %(default)s)")
+    parser.add_argument("--broadcast-ratio", type=float, default=0.05,
+                        help="Fraction of messages sent as BROADCAST, the rest are DMs (default: %(default)s)")
+    parser.add_argument("--sizes", type=parse_sizes, default=[64, 512],
+                        help="Comma separated message sizes in bytes, picked at random (default: 64,512)")
+    parser.add_argument("--duration", type=float, default=10.0, help="Measured seconds (default: %(default)s)")
+    parser.add_argument("--warmup", type=float, default=1.0, help="Unmeasured seconds before the run (default: %(default)s)")
+    parser.add_argument("--drain", type=float, default=2.0,
+                        help="Seconds to wait for in-flight messages after sending stops (default: %(default)s)")
+    parser.add_argument("--encoding", dest="encodings", action="append", choices=["binary", "json"],
+                        help="Wire encoding(s) offered in HELLO, in order of preference (default: binary, json)")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed for the message mix (default: %(default)s)")
+    parser.add_argument("--connect-batch", type=int, default=100, help="Clients connected concurrently (default: %(default)s)")
+    parser.add_argument("--engine", choices=["threaded", "asyncio"], default=config.SERVER_ENGINE,
+                        help="Engine of the spawned server (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes of the spawned server (default: %(default)s)")
+    parser.add_argument("--server", metavar="HOST:PORT", help="Benchmark a running server instead of spawning one")
+    parser.add_argument("--server-log", metavar="FILE", help="Append the spawned server's output to FILE")
+    parser.add_argument("--server-start-timeout", type=float, default=15.0, help=argparse.SUPPRESS)
+    parser.add_argument("--output", metavar="FILE", help="Also write the JSON results to FILE")
+    args = parser.parse_args()
+    if args.clients < 2:
+        parser.error("--clients must be at least 2")
+    if args.rate <= 0 or args.duration <= 0:
+        parser.error("--rate and --duration must be positive")
+    args.encodings = args.encodings or list(protocol.SUPPORTED_ENCODINGS)
+
+    raise_file_limit()
+    process = None
+    if args.server:
+        host, _, port = args.server.rpartition(":")
+        port = int(port)
+    else:
+        host, port = "127.0.0.1", free_port()
+        process = start_server(args, port)
+
+    try:
+        benchmark = Benchmark(host, port, args)
+        connect_seconds = asyncio.run(benchmark.run())
+    finally:
+        if process is not None:
+            stop_server(process)
+
+    settings = {key: value for key, value in vars(args).items() if key not in ("output", "server_log", "server_start_timeout")}
+    if args.server:
+        settings["engine"] = settings["workers"] = None
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "settings": settings,
+        "results": benchmark.results(connect_seconds),
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
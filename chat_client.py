@@ -0,0 +1,282 @@
+import asyncio
+import queue
+import socket
+import threading
+
+import protocol
+
+MAX_SEND_BATCH_BYTES = 64 * 1024
+RECV_BUFFER_SIZE = 8192
+
+
+def make_dm(recipient, message):
+    return {"type": "DM", "recipient": recipient, "message": message}
+
+
+def make_broadcast(message):
+    return {"type": "BROADCAST", "recipient": "ALL", "message": message}
+
+
+def _hello_frame(encodings):
+    return protocol.encode_json_frame({"type": "HELLO", "encodings": list(encodings)})
+
+
+class ChatClient:
+    """One connection to a chat server, without any GUI.
+
+    connect() (or connect_in_background()) opens the socket, offers the wire encodings with a
+    HELLO and starts a receiver thread and a sender thread. send() only enqueues; the sender
+    writes everything queued so far in one sendall. Events arrive through callbacks, called
+    on the client's own threads:
+
+        on_connected()                  connect_in_background() succeeded
+        on_connect_failed(error)        connect_in_background() failed
+        on_message(message)             a decoded DM/BROADCAST/SERVER_*/ERROR message dict
+        on_invalid_frame(frame, error)  a frame that could not be decoded
+        on_sent(count)                  count queued messages were written to the socket
+        on_send_failed(message, error)  a queued message could not be encoded (e.g. it exceeds
+                                        MAX_FRAME_SIZE) and was skipped; it is not counted in on_sent
+        on_disconnected(error)          the connection was lost (error is None on a clean EOF);
+                                        not called after close()
+    """
+
+    def __init__(self, on_message=None, on_invalid_frame=None, on_sent=None, on_disconnected=None,
+                 on_connected=None, on_connect_failed=None, encodings=protocol.SUPPORTED_ENCODINGS,
+                 max_send_batch_bytes=MAX_SEND_BATCH_BYTES, on_send_failed=None):
+        self.on_message = on_message
+        self.on_invalid_frame = on_invalid_frame
+        self.on_sent = on_sent
+        self.on_send_failed = on_send_failed
+        self.on_disconnected = on_disconnected
+        self.on_connected = on_connected
+        self.on_connect_failed = on_connect_failed
+        self.encodings = encodings
+        self.max_send_batch_bytes = max_send_batch_bytes
+
+        self.sock = None
+        self.wire_encoding = protocol.ENCODING_JSON
+        self.send_queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.connected = False
+        self.closed = False
+
+    def connect(self, host, port, timeout=None, source_address=None):
+        """Connects and starts the I/O threads. Raises OSError if the server cannot be reached.
+
+        The server identifies clients by IP, so simulated clients on one machine pass distinct
+        loopback addresses as source_address, e.g. ("127.0.0.2", 0).
+        """
+        sock = socket.create_connection((host, port), timeout=timeout, source_address=source_address)
+        sock.settimeout(None)
+        with self.lock:
+            if self.closed:
+                sock.close()
+                return
+            self.sock = sock
+            self.connected = True
+
+        for target in (self._receiver_thread, self._sender_thread):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+
+    def connect_in_background(self, host, port, timeout=None, source_address=None):
+        thread = threading.Thread(target=self._connect_thread, args=(host, port, timeout, source_address))
+        thread.daemon = True
+        thread.start()
+
+    def send(self, message_data):
+        self.send_queue.put(message_data)
+
+    def send_dm(self, recipient, message):
+        self.send(make_dm(recipient, message))
+
+    def send_broadcast(self, message):
+        self.send(make_broadcast(message))
+
+    def local_address(self):
+        return self.sock.getsockname() if self.sock else None
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.connected = False
+            sock = self.sock
+        self.send_queue.put(None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+
+    def _connect_thread(self, host, port, timeout, source_address):
+        try:
+            self.connect(host, port, timeout, source_address)
+        except Exception as e:
+            self._emit(self.on_connect_failed, e)
+            return
+        self._emit(self.on_connected)
+
+    def _connection_lost(self, error):
+        # Only the first failure counts, and none after close().
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.connected = False
+            sock = self.sock
+        self.send_queue.put(None)
+        try:
+            sock.close()
+        except OSError:
+            pass
+        self._emit(self.on_disconnected, error)
+
+    def _receiver_thread(self):
+        decoder = protocol.FrameDecoder()
+        error = None
+        try:
+            while True:
+                data = self.sock.recv(RECV_BUFFER_SIZE)
+                if not data:
+                    break
+                for frame in decoder.feed(data):
+                    self._process_frame(frame)
+        except (OSError, protocol.ProtocolError) as e:
+            error = e
+        self._connection_lost(error)
+
+    def _process_frame(self, frame):
+        try:
+            message = protocol.decode_message(frame)
+        except (ValueError, protocol.ProtocolError) as e:
+            self._emit(self.on_invalid_frame, frame, e)
+            return
+
+        if isinstance(message, dict) and message.get("type") == "HELLO":
+            self.wire_encoding = message.get("encoding", protocol.ENCODING_JSON)
+            return
+        self._emit(self.on_message, message)
+
+    def _sender_thread(self):
+        # Until the server answers the HELLO everything is sent as JSON.
+        pending = bytearray(_hello_frame(self.encodings))
+        batch_count = 0
+        while True:
+            if not pending:
+                message_data = self.send_queue.get()
+                if message_data is None:
+                    return
+                frame = self._encode(message_data)
+                if frame is None:
+                    continue
+                pending += frame
+                batch_count = 1
+            # Whatever else is already queued goes out in the same send call.
+            while len(pending) < self.max_send_batch_bytes:
+                try:
+                    message_data = self.send_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if message_data is None:
+                    self.send_queue.put(None)
+                    break
+                frame = self._encode(message_data)
+                if frame is not None:
+                    pending += frame
+                    batch_count += 1
+
+            try:
+                self.sock.sendall(pending)
+            except OSError as e:
+                self._connection_lost(e)
+                return
+            pending.clear()
+            if batch_count:
+                self._emit(self.on_sent, batch_count)
+                batch_count = 0
+
+    def _encode(self, message_data):
+        # One bad message must not take the sender thread, and everything queued after it, down.
+        try:
+            return protocol.encode_message_frame(message_data, self.wire_encoding)
+        except (protocol.ProtocolError, TypeError, ValueError, AttributeError) as e:
+            self._emit(self.on_send_failed, message_data, e)
+            return None
+
+    def _emit(self, callback, *args):
+        if callback is not None:
+            callback(*args)
+
+
+class AsyncChatClient:
+    """asyncio counterpart of ChatClient, for running many simulated clients in one event loop.
+
+        client = AsyncChatClient()
+        await client.connect(host, port)
+        await client.send_dm("10.0.0.2", "hi")
+        async for message in client:
+            ...
+    """
+
+    def __init__(self, encodings=protocol.SUPPORTED_ENCODINGS):
+        self.encodings = encodings
+        self.reader = None
+        self.writer = None
+        self.decoder = protocol.FrameDecoder()
+        self.received = []
+        self.wire_encoding = protocol.ENCODING_JSON
+
+    async def connect(self, host, port, timeout=None, local_addr=None):
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, local_addr=local_addr), timeout)
+        self.writer.write(_hello_frame(self.encodings))
+        await self.writer.drain()
+
+    async def send(self, message_data):
+        """Raises ProtocolError, without sending anything, if message_data cannot be encoded."""
+        self.writer.write(protocol.encode_message_frame(message_data, self.wire_encoding))
+        await self.writer.drain()
+
+    async def send_dm(self, recipient, message):
+        await self.send(make_dm(recipient, message))
+
+    async def send_broadcast(self, message):
+        await self.send(make_broadcast(message))
+
+    async def receive(self):
+        """Returns the next message dict, or None once the server closed the connection.
+
+        Raises ProtocolError (or ValueError) for frames that cannot be decoded.
+        """
+        while not self.received:
+            data = await self.reader.read(RECV_BUFFER_SIZE)
+            if not data:
+                return None
+            for frame in self.decoder.feed(data):
+                message = protocol.decode_message(frame)
+                if isinstance(message, dict) and message.get("type") == "HELLO":
+                    self.wire_encoding = message.get("encoding", protocol.ENCODING_JSON)
+                else:
+                    self.received.append(message)
+        return self.received.pop(0)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        message = await self.receive()
+        if message is None:
+            raise StopAsyncIteration
+        return message
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
@@ -1,3 +1,4 @@
+import collections
 import socket
 import threading
 import time
@@ -6,34 +7,94 @@ import tkinter as tk
 from tkinter import scrolledtext, messagebox, simpledialog
 import json
 import os
+import random
+import chat_client
+import conversation_cache
+import history_store
+import outbox
+import persistence
+import protocol
 
 class Client:
     FIXED_SERVER_CONTACT_NAME = "Server Messages"
     FIXED_SERVER_CONTACT_IP = "127.0.0.1" 
+    HISTORY_PAGE_SIZE = 200
+    CONVERSATION_CACHE_BYTES = 8 * 1024 * 1024
+    # Default of File > "Show Cache Statistics", which appends ConversationCache.status() to history status messages.
+    DEBUG_STATUS = False
+    # "Manage Contacts..." and a separator come before the contact entries in the Contacts menu.
+    CONTACT_MENU_OFFSET = 2
+    # Buffered chat lines are flushed to text_area at most GUI_FRAME_BUDGET_MS per callback.
+    GUI_FLUSH_INTERVAL_MS = 10
+    GUI_FRAME_BUDGET_MS = 8
+    SCROLLBACK_LINES = 5000
+    # Seconds; a server entry in client_servers.json may override it with "connect_timeout".
+    CONNECT_TIMEOUT = 5.0
+    # Probe every configured server at startup and connect to the one that answers first.
+    CONNECT_FASTEST_ON_STARTUP = False
+    # Lost connections are retried after a jittered delay that doubles up to RECONNECT_MAX_DELAY seconds.
+    RECONNECT_BASE_DELAY = 1.0
+    RECONNECT_MAX_DELAY = 60.0
+    OUTBOX_MAX_MESSAGES = 500
+    # Queued messages are written to the socket in batches of up to this many bytes.
+    MAX_SEND_BATCH_BYTES = 64 * 1024
 
     def __init__(self) -> None:
         self.host = None
         self.port = None
         self.connected = False
-        self.client_socket = None
-        self.receiver_thread = None
+        self.connecting = False
+        self.auto_reconnect = False
+        self.reconnect_attempts = 0
+        self.reconnect_after_id = None
+        # The ChatClient of the current (or in-flight) connection; its callbacks are ignored once replaced.
+        self.chat = None
         self.servers_file = "client_servers.json"
         self.servers = []
         self.current_server_index = -1
+        self.server_rtts = {}
+        # Results of an older "Connect to Fastest Server" run are ignored once a new one starts.
+        self.probe_generation = 0
+        self.probe_servers_left = 0
+        self.probe_chose_server = False
 
         self.contacts_file = "client_contacts.json"
         self.contacts = []
+        self.contacts_by_ip = {}
         self.current_contact_index = -1
+        # Number of self.contacts shown in the contact widgets; contacts past it are added on the next UI tick.
+        self.contact_entry_count = 0
+        self.contact_entries_update_scheduled = False
+        self.shown_contact_ip = None
 
         self.blocked_ips_file = "blocked_ips.json"
         self.blocked_ips = set()
+        self.local_ip = None
 
         self.chat_history_dir = "chat_histories"
-        os.makedirs(self.chat_history_dir, exist_ok=True)
-
-        self.gui_message_buffer = []
+        self.history = history_store.HistoryStore(self.chat_history_dir)
+        self.conversation_cache = conversation_cache.ConversationCache(self.CONVERSATION_CACHE_BYTES)
+        # All disk writes go through this worker so the receiver and Tk threads never wait on the disk.
+        # It also keeps the conversation cache in step with what is written.
+        self.persistence = persistence.PersistenceWorker(
+            self.history, on_error=self._on_persistence_error,
+            on_history_appended=self._on_history_appended,
+            on_history_removed=self.conversation_cache.discard)
+
+        # Messages typed while offline wait here and are sent in order after reconnecting.
+        self.outbox_file = "client_outbox.json"
+        self.outbox = outbox.Outbox(self.outbox_file, self.persistence, self.OUTBOX_MAX_MESSAGES)
+
+        self.gui_message_buffer = collections.deque()
         self.gui_update_scheduled = False
 
+        # Byte offset of the oldest history record shown; 0 once the whole history is loaded.
+        self.history_contact_ip = None
+        self.history_cursor = 0
+        # Cached messages older than the shown page; scrolling up shows these before reading the disk.
+        self.history_unshown = []
+        self.history_page_scheduled = False
+
         self.manage_contacts_window = None
         self.manage_contacts_listbox = None
         self.add_contact_button = None
@@ -44,16 +105,22 @@ class Client:
         self.manage_window_selected_contact_label = None
 
         self._setup_gui()
+        self._migrate_chat_histories()
         self._load_servers_automatically()
         self._load_contacts_automatically()
         self._load_blocked_ips()
+        self._load_outbox()
 
-        if self.servers:
+        if self.servers and self.CONNECT_FASTEST_ON_STARTUP:
+            self._probe_servers()
+        elif self.servers:
             self.current_server_index = 0
             self.server_names.set(self.servers[self.current_server_index]['name'])
             self._connect()
         else:
             self._update_status("No servers configured. Please add a server to connect.")
+        # Registered only now: filling the server menu at startup must not connect to a server by itself.
+        self.server_names.trace("w", self._on_server_selected)
 
         self._load_chat_history_for_selected_contact()
         self._update_title_bar()
@@ -96,6 +163,9 @@ class Client:
         )
         self.text_area.grid(row=2, column=0, sticky="nsew", padx=5, pady=5)
         self.text_area.config(state=tk.DISABLED)
+        self.text_area.config(yscrollcommand=self._on_text_area_scrolled)
+        self.text_area.bind("<MouseWheel>", self._on_text_area_wheel, add="+")
+        self.text_area.bind("<Button-4>", self._on_text_area_wheel, add="+")
 
         self.text_area.tag_configure('white', foreground='white')
 
@@ -134,6 +204,8 @@ class Client:
         file_menu = tk.Menu(menubar, tearoff=0, bg="gray25", fg="white")
         menubar.add_cascade(label="File", menu=file_menu)
         file_menu.add_command(label="Clear Chat History (Current Contact)", command=self._delete_chat_history)
+        self.debug_status = tk.BooleanVar(self.root, value=self.DEBUG_STATUS)
+        file_menu.add_checkbutton(label="Show Cache Statistics", variable=self.debug_status)
         file_menu.add_separator()
         file_menu.add_command(label="Exit", command=self._on_closing)
 
@@ -144,11 +216,11 @@ class Client:
         self.server_management_menu.add_command(label="Delete Server", command=self._remove_server)
         self.server_management_menu.add_separator()
         self.server_management_menu.add_command(label="Disconnect", command=self._disconnect)
+        self.server_management_menu.add_command(label="Connect to Fastest Server", command=self._probe_servers)
         self.server_management_menu.add_separator()
         
         self.server_names = tk.StringVar(self.root)
         self.server_names.set("No servers loaded")
-        self.server_names.trace("w", self._on_server_selected)
         
         self.select_server_submenu = tk.Menu(self.server_management_menu, tearoff=0, bg="gray25", fg="white")
         self.server_management_menu.add_cascade(label="Select Server", menu=self.select_server_submenu)
@@ -181,26 +253,42 @@ class Client:
         pass
 
     def _update_server_dropdown(self):
-        self.select_server_submenu.delete(0, "end")
+        self._update_server_menu()
         if not self.servers:
             self.server_names.set("No servers loaded")
             self.current_server_index = -1
-            self.select_server_submenu.add_command(label="No servers loaded", state=tk.DISABLED)
             return
 
-        for i, server in enumerate(self.servers):
-            self.select_server_submenu.add_command(label=server['name'], command=lambda value=server['name'], index=i: self._select_server_by_name(value, index))
-        
         if self.current_server_index == -1 or self.current_server_index >= len(self.servers):
             self.current_server_index = 0
         self.server_names.set(self.servers[self.current_server_index]['name'])
 
+    def _update_server_menu(self):
+        # Only rebuilds the menu entries; setting server_names would fire _on_server_selected.
+        self.select_server_submenu.delete(0, "end")
+        if not self.servers:
+            self.select_server_submenu.add_command(label="No servers loaded", state=tk.DISABLED)
+            return
+
+        for i, server in enumerate(self.servers):
+            label = server['name']
+            if server['name'] in self.server_rtts:
+                rtt = self.server_rtts[server['name']]
+                label += " (unreachable)" if rtt is None else f" ({rtt * 1000:.0f} ms)"
+            self.select_server_submenu.add_command(label=label, command=lambda value=server['name'], index=i: self._select_server_by_name(value, index))
+
     def _on_server_selected(self, *args):
         selected_name = self.server_names.get()
         for i, server in enumerate(self.servers):
             if server['name'] == selected_name:
                 self.current_server_index = i
                 break
+        # Tk write traces fire even when the value is unchanged; keep a live connection to the same server.
+        if (self.connected or self.connecting) and 0 <= self.current_server_index < len(self.servers):
+            selected_server = self.servers[self.current_server_index]
+            if (selected_server['host'], selected_server['port']) == (self.host, self.port):
+                self._update_title_bar()
+                return
         self._disconnect()
         self._connect()
         self._update_title_bar()
@@ -281,12 +369,7 @@ class Client:
             self._update_status(f"No {self.servers_file} found. Start by adding a server.")
 
     def _save_servers_automatically(self):
-        try:
-            with open(self.servers_file, "w") as f:
-                json.dump(self.servers, f, indent=4)
-        except Exception as e:
-            messagebox.showerror("Error", f"An error occurred while saving servers: {e}")
-            self._update_status(f"Error saving servers: {e}", "red")
+        self.persistence.save_json(self.servers_file, [dict(server) for server in self.servers])
 
     def _load_contacts_automatically(self):
         if os.path.exists(self.contacts_file):
@@ -319,19 +402,40 @@ class Client:
             self.contacts.insert(0, {'name': self.FIXED_SERVER_CONTACT_NAME, 'ip': self.FIXED_SERVER_CONTACT_IP})
             self._save_contacts_automatically()
 
+        self._rebuild_contact_index()
         self._populate_contacts_listbox()
         self._update_status(f"Contacts loaded. Fixed contact '{self.FIXED_SERVER_CONTACT_NAME}' ensured.")
 
     def _save_contacts_automatically(self):
-        try:
-            with open(self.contacts_file, "w") as f:
-                json.dump(self.contacts, f, indent=4)
-        except Exception as e:
-            messagebox.showerror("Error", f"An error occurred while saving contacts: {e}")
-            self._update_status(f"Error saving contacts: {e}", "red")
+        self.persistence.save_json(self.contacts_file, [dict(contact) for contact in self.contacts])
+
+    # self.contacts_by_ip mirrors self.contacts; every change to the list goes through these helpers.
+    def _rebuild_contact_index(self):
+        self.contacts_by_ip = {contact['ip']: contact for contact in self.contacts}
+
+    def _add_contact(self, contact):
+        self.contacts.append(contact)
+        self.contacts_by_ip[contact['ip']] = contact
+
+    def _replace_contact(self, index, contact):
+        old_contact = self.contacts[index]
+        if self.contacts_by_ip.get(old_contact['ip']) is old_contact:
+            del self.contacts_by_ip[old_contact['ip']]
+        self.contacts[index] = contact
+        self.contacts_by_ip[contact['ip']] = contact
+
+    def _remove_contact_at(self, index):
+        removed_contact = self.contacts.pop(index)
+        if self.contacts_by_ip.get(removed_contact['ip']) is removed_contact:
+            del self.contacts_by_ip[removed_contact['ip']]
+        return removed_contact
 
     def _populate_contacts_listbox(self):
-        self.contacts_menu.delete(2, tk.END) 
+        """Rebuilds both contact widgets. Later changes are applied entry by entry."""
+        self.contacts_menu.delete(self.CONTACT_MENU_OFFSET, tk.END) 
+        if self._manage_window_open():
+            self.manage_contacts_listbox.delete(0, tk.END)
+        self.contact_entry_count = 0
 
         if not self.contacts:
             self.contacts_menu.add_command(label="No contacts loaded", state=tk.DISABLED)
@@ -340,40 +444,81 @@ class Client:
             return
 
         for i, contact in enumerate(self.contacts):
-            display_name = contact['name']
-            if contact['ip'] in self.blocked_ips:
-                display_name = "🚫 " + display_name
-            elif contact['name'].startswith("Unknown User"):
-                display_name = "❓ " + display_name
-            
-            self.contacts_menu.add_command(label=display_name, command=lambda idx=i: self._select_contact_from_menu(idx))
+            self._insert_contact_entry(i, contact)
         
-        if self.manage_contacts_window and self.manage_contacts_window.winfo_exists():
-            self.manage_contacts_listbox.delete(0, tk.END)
-            for i, contact in enumerate(self.contacts):
-                display_name = contact['name']
-                fg_color = 'white'
-
-                if contact['ip'] in self.blocked_ips:
-                    display_name = "🚫 " + display_name
-                    fg_color = 'red'
-                elif contact['name'].startswith("Unknown User"):
-                    display_name = "❓ " + display_name
-                    fg_color = 'orange'
-                
-                self.manage_contacts_listbox.insert(tk.END, display_name)
-                self.manage_contacts_listbox.itemconfig(tk.END, fg=fg_color)
-            
-            if self.current_contact_index != -1 and self.current_contact_index < len(self.contacts):
-                self.manage_contacts_listbox.selection_set(self.current_contact_index)
-                self.manage_contacts_listbox.activate(self.current_contact_index)
-
         if self.current_contact_index == -1 or self.current_contact_index >= len(self.contacts):
             self.current_contact_index = 0
-        
+        self._select_manage_listbox_entry()
+
         self._update_selected_contact_label()
         self._update_contact_button_states()
-        self._load_chat_history_for_selected_contact()
+        if self.contacts[self.current_contact_index]['ip'] != self.shown_contact_ip:
+            self._load_chat_history_for_selected_contact()
+
+    def _contact_display(self, contact):
+        if contact['ip'] in self.blocked_ips:
+            return "🚫 " + contact['name'], 'red'
+        if contact['name'].startswith("Unknown User"):
+            return "❓ " + contact['name'], 'orange'
+        return contact['name'], 'white'
+
+    def _manage_window_open(self):
+        return self.manage_contacts_window and self.manage_contacts_window.winfo_exists()
+
+    def _select_manage_listbox_entry(self):
+        if self._manage_window_open() and 0 <= self.current_contact_index < len(self.contacts):
+            self.manage_contacts_listbox.selection_clear(0, tk.END)
+            self.manage_contacts_listbox.selection_set(self.current_contact_index)
+            self.manage_contacts_listbox.activate(self.current_contact_index)
+
+    def _insert_contact_entry(self, index, contact):
+        if self.contact_entry_count == 0:
+            # Drop the "No contacts loaded" placeholder.
+            self.contacts_menu.delete(self.CONTACT_MENU_OFFSET, tk.END)
+        display_name, fg_color = self._contact_display(contact)
+        self.contacts_menu.insert_command(self.CONTACT_MENU_OFFSET + index, label=display_name,
+                                          command=lambda ip=contact['ip']: self._select_contact_by_ip(ip))
+        if self._manage_window_open():
+            self.manage_contacts_listbox.insert(index, display_name)
+            self.manage_contacts_listbox.itemconfig(index, fg=fg_color)
+        self.contact_entry_count += 1
+
+    def _update_contact_entry(self, index):
+        contact = self.contacts[index]
+        display_name, fg_color = self._contact_display(contact)
+        self.contacts_menu.entryconfigure(self.CONTACT_MENU_OFFSET + index, label=display_name,
+                                          command=lambda ip=contact['ip']: self._select_contact_by_ip(ip))
+        if self._manage_window_open():
+            self.manage_contacts_listbox.delete(index)
+            self.manage_contacts_listbox.insert(index, display_name)
+            self.manage_contacts_listbox.itemconfig(index, fg=fg_color)
+            if index == self.current_contact_index:
+                self._select_manage_listbox_entry()
+
+    def _delete_contact_entry(self, index):
+        self.contacts_menu.delete(self.CONTACT_MENU_OFFSET + index)
+        if self._manage_window_open():
+            self.manage_contacts_listbox.delete(index)
+        self.contact_entry_count -= 1
+        if self.contact_entry_count == 0:
+            self.contacts_menu.add_command(label="No contacts loaded", state=tk.DISABLED)
+
+    def _schedule_contact_entries_update(self):
+        # Called from the receiver thread; any number of new contacts is shown in one UI tick.
+        if not self.contact_entries_update_scheduled:
+            self.contact_entries_update_scheduled = True
+            self.root.after(0, self._apply_contact_entries_update)
+
+    def _apply_contact_entries_update(self):
+        self.contact_entries_update_scheduled = False
+        # New contacts are only ever appended, so everything past contact_entry_count is new.
+        for index in range(self.contact_entry_count, len(self.contacts)):
+            self._insert_contact_entry(index, self.contacts[index])
+
+    def _select_contact_by_ip(self, contact_ip):
+        contact = self.contacts_by_ip.get(contact_ip)
+        if contact is not None:
+            self._select_contact_from_menu(self.contacts.index(contact))
 
     def _select_contact_from_menu(self, index):
         self.current_contact_index = index
@@ -381,10 +526,7 @@ class Client:
         self._load_chat_history_for_selected_contact()
         self._update_title_bar()
         self.chat_title_label.config(text=self._get_current_contact_display_name())
-        if self.manage_contacts_window and self.manage_contacts_window.winfo_exists():
-            self.manage_contacts_listbox.selection_clear(0, tk.END)
-            self.manage_contacts_listbox.selection_set(self.current_contact_index)
-            self.manage_contacts_listbox.activate(self.current_contact_index)
+        self._select_manage_listbox_entry()
 
     def _on_contact_selected(self, event):
         selected_indices = self.manage_contacts_listbox.curselection()
@@ -525,9 +667,9 @@ class Client:
         if dialog.result:
             name, ip = dialog.result
             new_contact = {'name': name, 'ip': ip}
-            self.contacts.append(new_contact)
+            self._add_contact(new_contact)
             self._save_contacts_automatically()
-            self._populate_contacts_listbox()
+            self._apply_contact_entries_update()
             self.current_contact_index = len(self.contacts) - 1
             self._select_contact_from_menu(self.current_contact_index)
             self._update_status(f"Contact '{name}' added. (Automatically saved)")
@@ -551,21 +693,14 @@ class Client:
         if dialog.result:
             name, ip = dialog.result
             old_ip = self.contacts[self.current_contact_index]['ip']
-            self.contacts[self.current_contact_index] = {'name': name, 'ip': ip}
+            self._replace_contact(self.current_contact_index, {'name': name, 'ip': ip})
             
             if old_ip != ip:
-                old_path = self._get_chat_history_file_path(old_ip)
-                new_path = self._get_chat_history_file_path(ip)
-                if os.path.exists(old_path):
-                    try:
-                        os.rename(old_path, new_path)
-                        self._update_status(f"Renamed chat history from {old_ip} to {ip}.", "blue")
-                    except Exception as e:
-                        messagebox.showerror("Error", f"Failed to rename chat history file: {e}")
-                        self._update_status(f"Error renaming history file: {e}", "red")
+                self.persistence.rename_history(old_ip, ip)
+                self._update_status(f"Renamed chat history from {old_ip} to {ip}.", "blue")
 
             self._save_contacts_automatically()
-            self._populate_contacts_listbox()
+            self._update_contact_entry(self.current_contact_index)
             self._select_contact_from_menu(self.current_contact_index)
             self._update_status(f"Contact '{name}' updated. (Automatically saved)")
             self._update_contact_button_states()
@@ -582,15 +717,26 @@ class Client:
         removed_name = self.contacts[self.current_contact_index]['name']
         removed_ip = self.contacts[self.current_contact_index]['ip']
         if messagebox.askyesno("Confirm Removal", f"Are you sure you want to remove contact '{removed_name}'?"):
-            del self.contacts[self.current_contact_index]
-            self.current_contact_index = -1
+            removed_index = self.current_contact_index
+            self._remove_contact_at(removed_index)
+            self._delete_contact_entry(removed_index)
             self._save_contacts_automatically()
-            self._populate_contacts_listbox()
+            self._select_contact_from_menu(0 if self.contacts else -1)
             self._update_status(f"Contact '{removed_name}' removed. (Automatically saved)")
             self._update_selected_contact_label()
             self._delete_chat_history_file(removed_ip)
             self._update_contact_button_states()
 
+    def _load_outbox(self):
+        try:
+            self.outbox.load()
+        except json.JSONDecodeError:
+            messagebox.showerror("File Error", f"Error reading {self.outbox_file}. File might be corrupted.")
+        except Exception as e:
+            messagebox.showerror("Error", f"An unexpected error occurred while loading the outbox: {e}")
+        if len(self.outbox):
+            self._update_status(f"{len(self.outbox)} unsent message(s) will be sent once connected.")
+
     def _load_blocked_ips(self):
         if os.path.exists(self.blocked_ips_file):
             try:
@@ -607,12 +753,7 @@ class Client:
             self._update_status(f"No {self.blocked_ips_file} found.")
 
     def _save_blocked_ips(self):
-        try:
-            with open(self.blocked_ips_file, "w") as f:
-                json.dump(list(self.blocked_ips), f, indent=4)
-        except Exception as e:
-            messagebox.showerror("Error", f"An error occurred while saving blocked IPs: {e}")
-            self._update_status(f"Error saving blocked IPs: {e}", "red")
+        self.persistence.save_json(self.blocked_ips_file, list(self.blocked_ips))
 
     def _toggle_block_contact(self):
         if self.current_contact_index == -1 or not self.contacts:
@@ -635,43 +776,42 @@ class Client:
             self._update_status(f"Blocked contact: {contact_name} ({contact_ip})", "red")
         
         self._save_blocked_ips()
-        self._populate_contacts_listbox()
+        self._update_contact_entry(self.current_contact_index)
         self._update_contact_button_states()
 
-    def _get_chat_history_file_path(self, contact_ip):
-        safe_ip = contact_ip.replace('.', '_').replace(':', '-')
-        return os.path.join(self.chat_history_dir, f"chat_history_{safe_ip}.json")
+    def _migrate_chat_histories(self):
+        try:
+            migrated, failed = self.history.migrate_legacy_files()
+        except Exception as e:
+            self._update_status(f"Error migrating chat histories: {e}", "red")
+            return
+        if failed:
+            self._update_status(f"Could not migrate {len(failed)} corrupted chat history file(s).", "orange")
+        elif migrated:
+            self._update_status(f"Migrated {migrated} chat history file(s) to the append-only format.")
 
     def _save_message_to_contact_history(self, contact_ip, message):
         if not contact_ip:
             return
+        self.persistence.append_history(contact_ip, message)
 
-        file_path = self._get_chat_history_file_path(contact_ip)
-        history = []
-        if os.path.exists(file_path):
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    history = json.load(f)
-            except json.JSONDecodeError:
-                self._update_status(f"Corrupted chat history for {contact_ip}. Starting new.", "orange")
-                history = []
-            except Exception as e:
-                self._update_status(f"Error loading chat history for {contact_ip}: {e}", "red")
-                history = []
-
-        history.append(message)
+    def _on_history_appended(self, contact_ip, messages):
+        for message in messages:
+            self.conversation_cache.append(contact_ip, message)
 
-        try:
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(history, f, indent=4)
-        except Exception as e:
-            messagebox.showerror("Error", f"An error occurred while saving chat history for {contact_ip}: {e}")
-            self._update_status(f"Error saving chat history for {contact_ip}: {e}", "red")
+    def _on_persistence_error(self, message):
+        # Called on the persistence thread; report on the Tk thread.
+        self.root.after(0, self._update_status, message, "red")
 
     def _load_chat_history_for_selected_contact(self):
         self.text_area.config(state=tk.NORMAL)
         self.text_area.delete(1.0, tk.END)
         self.text_area.config(state=tk.DISABLED)
+        self.gui_message_buffer.clear()
+        self.history_contact_ip = None
+        self.history_cursor = 0
+        self.history_unshown = []
+        self.shown_contact_ip = None
 
         if self.current_contact_index == -1 or not self.contacts:
             self._add_message_to_gui("No contact selected. Start a conversation by selecting one.", tag='white')
@@ -680,26 +820,101 @@ class Client:
 
         selected_contact = self.contacts[self.current_contact_index]
         contact_ip = selected_contact['ip']
-        file_path = self._get_chat_history_file_path(contact_ip)
+        self.shown_contact_ip = contact_ip
 
         self.chat_title_label.config(text=self._get_current_contact_display_name())
 
-        if os.path.exists(file_path):
+        if self.persistence.has_pending_change(contact_ip):
+            # The file is about to be deleted or renamed; render once the worker has done that.
+            self._add_message_to_gui(f"Loading chat history for {selected_contact['name']}...", tag='white')
+            self.persistence.call_when_written(
+                lambda: self.root.after(0, self._reload_chat_history_if_shown, contact_ip))
+            return
+
+        try:
+            with self.persistence.history_lock:
+                cached = self.conversation_cache.get(contact_ip)
+                if cached is None and self.history.exists(contact_ip):
+                    # Only the newest page is read now; older pages follow when scrolling to the top.
+                    cached = self.history.read_page(contact_ip, limit=self.HISTORY_PAGE_SIZE)
+                    self.conversation_cache.put(contact_ip, *cached)
+                # Messages still queued for the disk are not in the file or the cache yet.
+                pending = self.persistence.pending_messages(contact_ip)
+            if pending:
+                messages, cursor = cached if cached is not None else ([], 0)
+                cached = messages + pending, cursor
+        except Exception as e:
+            self._add_message_to_gui(f"Error loading chat history for {selected_contact['name']}: {e}", tag='white')
+            self._update_status(f"Error loading chat history for {selected_contact['name']}: {e}", "red")
+            return
+
+        if cached is not None and (cached[0] or cached[1] > 0):
+            messages, self.history_cursor = cached
+            self.history_contact_ip = contact_ip
+            # A cached conversation may hold many pages; render only the newest like a disk read.
+            self.history_unshown = messages[:-self.HISTORY_PAGE_SIZE]
+            messages = messages[-self.HISTORY_PAGE_SIZE:]
+            for msg in messages:
+                self._add_message_to_gui(msg, tag='white') 
+            self._update_status(self._with_debug_status(f"Loaded chat history for {selected_contact['name']}."))
+        else:
+            self._add_message_to_gui(f"No chat history found for {selected_contact['name']}. Start typing!", tag='white')
+            self._update_status(self._with_debug_status(f"No chat history for {selected_contact['name']}."), "blue")
+
+    def _reload_chat_history_if_shown(self, contact_ip):
+        if self.shown_contact_ip == contact_ip:
+            self._load_chat_history_for_selected_contact()
+
+    def _with_debug_status(self, message):
+        if self.debug_status.get():
+            return f"{message} [{self.conversation_cache.status()}]"
+        return message
+
+    def _on_text_area_scrolled(self, first, last):
+        self.text_area.vbar.set(first, last)
+        if float(first) <= 0.0:
+            self._schedule_older_history_page()
+
+    def _on_text_area_wheel(self, event):
+        if getattr(event, "delta", 1) > 0 and self.text_area.yview()[0] <= 0.0:
+            self._schedule_older_history_page()
+
+    def _schedule_older_history_page(self):
+        if (self.history_cursor > 0 or self.history_unshown) and not self.history_page_scheduled:
+            self.history_page_scheduled = True
+            self.root.after_idle(self._load_older_history_page)
+
+    def _load_older_history_page(self):
+        self.history_page_scheduled = False
+        if self.history_contact_ip is None:
+            return
+
+        if self.history_unshown:
+            messages = self.history_unshown[-self.HISTORY_PAGE_SIZE:]
+            del self.history_unshown[-self.HISTORY_PAGE_SIZE:]
+        elif self.history_cursor > 0:
             try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    history = json.load(f)
-                for msg in history:
-                    self._add_message_to_gui(msg, tag='white') 
-                self._update_status(f"Loaded chat history for {selected_contact['name']}.")
-            except json.JSONDecodeError:
-                self._add_message_to_gui(f"Corrupted chat history for {selected_contact['name']}. Starting fresh.", tag='white')
-                self._update_status(f"Corrupted chat history for {selected_contact['name']}.", "orange")
+                with self.persistence.history_lock:
+                    messages, self.history_cursor = self.history.read_page(
+                        self.history_contact_ip, before=self.history_cursor, limit=self.HISTORY_PAGE_SIZE)
+                    self.conversation_cache.prepend(self.history_contact_ip, messages, self.history_cursor)
             except Exception as e:
-                self._add_message_to_gui(f"Error loading chat history for {selected_contact['name']}: {e}", tag='white')
-                self._update_status(f"Error loading chat history for {selected_contact['name']}: {e}", "red")
+                self.history_cursor = 0
+                self._update_status(f"Error loading older chat history: {e}", "red")
+                return
         else:
-            self._add_message_to_gui(f"No chat history found for {selected_contact['name']}. Start typing!", tag='white')
-            self._update_status(f"No chat history for {selected_contact['name']}.", "blue")
+            return
+        if not messages:
+            return
+
+        # Prepend the page and keep the line that was at the top of the view in place.
+        top_line = int(self.text_area.index("@0,0").split(".")[0])
+        page_text = "".join(msg + "\n" for msg in messages)
+        self.text_area.config(state=tk.NORMAL)
+        self.text_area.insert("1.0", page_text, 'white')
+        self.text_area.config(state=tk.DISABLED)
+        added_lines = page_text.count("\n")
+        self.text_area.yview(f"{top_line + added_lines}.0")
 
     def _delete_chat_history(self):
         if self.current_contact_index == -1 or not self.contacts:
@@ -713,6 +928,8 @@ class Client:
         if messagebox.askyesno("Confirm Delete History", 
                                f"Are you sure you want to delete all chat history for '{contact_name}'? This cannot be undone."):
             self._delete_chat_history_file(contact_ip)
+            self.history_cursor = 0
+            self.history_unshown = []
             self._update_status(f"Chat history for '{contact_name}' deleted.", "green")
             self.text_area.config(state=tk.NORMAL)
             self.text_area.delete(1.0, tk.END)
@@ -720,13 +937,7 @@ class Client:
             self._add_message_to_gui(f"Chat history for '{contact_name}' deleted.", tag='white')
 
     def _delete_chat_history_file(self, contact_ip):
-        file_path = self._get_chat_history_file_path(contact_ip)
-        if os.path.exists(file_path):
-            try:
-                os.remove(file_path)
-            except Exception as e:
-                messagebox.showerror("Error", f"Failed to delete chat history file: {e}")
-                self._update_status(f"Error deleting history file for {contact_ip}: {e}", "red")
+        self.persistence.delete_history(contact_ip)
 
     def _toggle_connection(self):
         if self.connected:
@@ -738,6 +949,9 @@ class Client:
         if self.connected:
             self._update_status("Already connected.")
             return 
+        if self.connecting:
+            self._update_status(f"Already connecting to {self.host}:{self.port}...", "yellow")
+            return
 
         if self.current_server_index == -1 or not self.servers:
             self._update_status("No server selected. Please select or add a server to connect to.", "orange")
@@ -746,52 +960,171 @@ class Client:
         selected_server = self.servers[self.current_server_index]
         self.host = selected_server['host']
         self.port = selected_server['port']
+        timeout = selected_server.get('connect_timeout', self.CONNECT_TIMEOUT)
 
         self._update_status(f"Connecting to {self.host}:{self.port}...", "yellow")
 
+        # The TCP handshake runs in the background so an unreachable server never blocks the UI.
+        self.auto_reconnect = True
+        self.connecting = True
+        self.chat = self._create_chat_client()
+        self.chat.connect_in_background(self.host, self.port, timeout)
+
+    def _create_chat_client(self):
+        # ChatClient calls back on its own threads; everything but message handling is moved to Tk.
+        chat = chat_client.ChatClient(max_send_batch_bytes=self.MAX_SEND_BATCH_BYTES)
+        chat.on_connected = lambda: self.root.after(0, self._on_connected, chat)
+        chat.on_connect_failed = lambda error: self.root.after(0, self._on_connect_failed, chat, error)
+        chat.on_message = self._process_message
+        chat.on_invalid_frame = self._process_invalid_frame
+        chat.on_sent = lambda count: self.root.after(0, self._on_messages_sent, chat, count)
+        chat.on_send_failed = lambda message_data, error: self.root.after(0, self._on_send_failed, chat, message_data, error)
+        chat.on_disconnected = lambda error: self.root.after(0, self._on_connection_lost, chat, error)
+        return chat
+
+    def _on_connected(self, chat):
+        if chat is not self.chat or not self.connecting:
+            # Superseded by a newer connect or cancelled by _disconnect while in flight.
+            chat.close()
+            return
+        self.connecting = False
+        self.connected = True
+        self.get_my_ip(refresh=True)
+        self._update_status(f"Connected to {self.host}:{self.port}", "green")
+
+        # The outbox holds what the sender has not confirmed yet, so resend that first.
+        for message_data in self.outbox.messages:
+            chat.send(message_data)
+        if len(self.outbox):
+            self._update_status(f"Connected to {self.host}:{self.port}. Sending {len(self.outbox)} queued message(s)...", "green")
+
+        self.reconnect_attempts = 0
+        self._update_title_bar()
+
+    def _on_connect_failed(self, chat, error):
+        if chat is not self.chat or not self.connecting:
+            return
+        self.connecting = False
+        self.chat = None
+        self._add_message_to_gui(f"Connection error: {error}", tag='white')
+        self._update_status(f"Connection failed: {error}", "red")
+        self._schedule_reconnect()
+
+    def _schedule_reconnect(self):
+        if not self.auto_reconnect or self.reconnect_after_id is not None:
+            return
+        # Exponential backoff with jitter, so clients dropped together do not reconnect in lockstep.
+        ceiling = min(self.RECONNECT_MAX_DELAY, self.RECONNECT_BASE_DELAY * 2 ** self.reconnect_attempts)
+        delay = ceiling / 2 + random.uniform(0, ceiling / 2)
+        self.reconnect_attempts += 1
+        self.reconnect_after_id = self.root.after(int(delay * 1000), self._reconnect)
+        self._update_status(f"Connection lost. Reconnecting in {delay:.1f} s (attempt {self.reconnect_attempts})...", "orange")
+
+    def _cancel_reconnect(self):
+        self.auto_reconnect = False
+        self.reconnect_attempts = 0
+        if self.reconnect_after_id is not None:
+            self.root.after_cancel(self.reconnect_after_id)
+            self.reconnect_after_id = None
+
+    def _reconnect(self):
+        self.reconnect_after_id = None
+        if self.auto_reconnect and not self.connected:
+            self._connect()
+
+    def _on_connection_lost(self, chat, error):
+        # Runs on the Tk thread after the receiver or the sender found the socket dead.
+        if chat is not self.chat or not self.connected:
+            return
+        if error is None:
+            self._add_message_to_gui("SERVER: Disconnected.", tag='white')
+        else:
+            self._add_message_to_gui(f"CONNECTION ERROR: {error}", tag='white')
+            self._update_status("CONNECTION ERROR, DISCONNECTED.", "red")
+        self.connected = False
+        self.chat = None
+        self._update_title_bar()
+        self._schedule_reconnect()
+
+    def _on_messages_sent(self, chat, count):
+        # Results from an older connection are ignored: its unconfirmed messages are resent anyway.
+        if chat is not self.chat:
+            return
+        for _ in range(min(count, len(self.outbox))):
+            self.outbox.pop()
+
+    def _on_send_failed(self, chat, message_data, error):
+        # A message the sender cannot encode would fail again on every reconnect, so it leaves the outbox.
+        if message_data in self.outbox.messages:
+            self.outbox.remove(message_data)
+        recipient = message_data.get("recipient", "?") if isinstance(message_data, dict) else "?"
+        self._add_message_to_gui(f"ERROR: Message to {recipient} could not be sent: {error}", tag='white')
+        self._update_status("A message could not be sent.", "red")
+
+    def _probe_servers(self):
+        """Connects to every configured server in parallel and switches to the one that answers first."""
+        if not self.servers:
+            self._update_status("No servers configured. Please add a server to connect.", "orange")
+            return
+        self._update_status(f"Probing {len(self.servers)} servers...", "yellow")
+        self.probe_generation += 1
+        self.probe_servers_left = len(self.servers)
+        self.probe_chose_server = False
+        self.server_rtts = {}
+        for server in self.servers:
+            probe_thread = threading.Thread(target=self._probe_server_thread, args=(self.probe_generation, dict(server)))
+            probe_thread.daemon = True
+            probe_thread.start()
+
+    def _probe_server_thread(self, generation, server):
+        started = time.perf_counter()
         try:
-            self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.client_socket.connect((self.host, self.port))
-            self.connected = True
-            self._update_status(f"Connected to {self.host}:{self.port}", "green")
-
-            self.receiver_thread = threading.Thread(target=self.receiver)
-            self.receiver_thread.daemon = True
-            self.receiver_thread.start()
-
-        except socket.error as e:
-            self._add_message_to_gui(f"Connection error: {e}", tag='white')
-            self._update_status(f"Connection failed: {e}", "red")
-            self.connected = False
-            self.client_socket = None 
-        except Exception as e:
-            self._add_message_to_gui(f"Unexpected error during connection: {e}", tag='white')
-            self._update_status(f"Error: {e}", "red")
-            self.connected = False
-            self.client_socket = None
+            sock = socket.create_connection((server['host'], server['port']),
+                                            timeout=server.get('connect_timeout', self.CONNECT_TIMEOUT))
+            rtt = time.perf_counter() - started
+            sock.close()
+        except Exception:
+            rtt = None
+        self.root.after(0, self._on_probe_result, generation, server['name'], rtt)
+
+    def _on_probe_result(self, generation, name, rtt):
+        # Every answer updates the menu; the first server to answer is the fastest and gets the connection.
+        if generation != self.probe_generation:
+            return
+        self.server_rtts[name] = rtt
+        self.probe_servers_left -= 1
+        self._update_server_menu()
+
+        if rtt is None:
+            if self.probe_servers_left == 0 and not self.probe_chose_server:
+                self._update_status("No configured server answered.", "red")
+            return
+        if self.probe_chose_server:
+            return
+        self.probe_chose_server = True
+        for i, server in enumerate(self.servers):
+            if server['name'] == name:
+                # The trace connects unless this server is already connected or connecting.
+                self._select_server_by_name(name, i)
+                self._update_status(f"Fastest server: {name} ({rtt * 1000:.0f} ms).", "green")
+                return
 
     def _disconnect(self):
+        self._cancel_reconnect()
+        if self.connecting:
+            self.connecting = False
+            self.chat.close()
+            self.chat = None
+            self._update_status("Connection attempt cancelled.", "red")
+            return
         if not self.connected:
             self._update_status("Not connected.")
             return 
 
         self._update_status("Disconnecting...", "yellow")
         self.connected = False
-
-        if self.client_socket:
-            try:
-                self.client_socket.shutdown(socket.SHUT_RDWR)
-                self.client_socket.close()
-            except OSError as e:
-                self._add_message_to_gui(f"Error closing socket: {e}", tag='white')
-            finally:
-                self.client_socket = None
-
-        if self.receiver_thread and self.receiver_thread.is_alive():
-            self.receiver_thread.join(timeout=1)
-            if self.receiver_thread.is_alive():
-                self._add_message_to_gui("Receiver thread unresponsive to termination.", tag='white')
-        
+        self.chat.close()
+        self.chat = None
         self._update_status("Disconnected.", "red")
 
     def _send_message_from_entry(self, event=None):
@@ -806,10 +1139,6 @@ class Client:
             self._on_closing()
             return
 
-        if not self.connected or not self.client_socket:
-            self._update_status("Not connected to server. Connect first.", "orange")
-            return
-
         if self.current_contact_index == -1 or self.current_contact_index >= len(self.contacts):
             self._update_status("No contact selected to send message to.", "orange")
             return
@@ -832,7 +1161,6 @@ class Client:
                     "message": message
                 }
                 display_message = f"YOU (BROADCAST): {message}"
-                self._add_message_to_gui(display_message, tag='white')
             else:
                 message_data = {
                     "type": "DM",
@@ -840,128 +1168,103 @@ class Client:
                     "message": message
                 }
                 display_message = f"YOU ({recipient_name}): {message}"
-                self._add_message_to_gui(display_message, tag='white')
-            
-            self._save_message_to_contact_history(recipient_ip, display_message)
 
-            json_message = json.dumps(message_data)
-            self.client_socket.sendall(json_message.encode('utf-8'))
+            # A message the negotiated encoding cannot carry is reported by the sender thread through on_send_failed.
+            self._add_message_to_gui(display_message, tag='white')
+            self._save_message_to_contact_history(recipient_ip, display_message)
+            self._queue_message(message_data)
 
-        except socket.error as e:
-            self._add_message_to_gui(f"Error sending message: {e}", tag='white') 
-            self._disconnect() 
         except Exception as e:
             self._add_message_to_gui(f"Unexpected error during send: {e}", tag='white')
             self._disconnect()
 
-    def receiver(self):
-        while self.connected:
-            try:
-                data = self.client_socket.recv(1024)
-                if not data:
-                    self._add_message_to_gui("SERVER: Disconnected.", tag='white')
-                    break
-                
-                received_raw_message = data.decode('utf-8')
-                
-                try:
-                    parsed_message = json.loads(received_raw_message)
-                    
-                    msg_type = parsed_message.get("type", "UNKNOWN")
-                    sender_ip = parsed_message.get("sender_ip", "UNKNOWN")
-                    message_content = parsed_message.get("message", "No message content")
-
-                    if sender_ip in self.blocked_ips:
-                        print(f"Ignored message from blocked IP: {sender_ip}")
-                        continue
-
-                    display_target_ip = self.FIXED_SERVER_CONTACT_IP
-                    display_message = ""
-                    message_tag = 'white'
-                    
-                    if msg_type == "DM":
-                        sender_contact_name = "UNKNOWN"
-                        found_contact = False
-                        for contact in self.contacts:
-                            if contact['ip'] == sender_ip:
-                                sender_contact_name = contact['name']
-                                found_contact = True
-                                break
-                        
-                        if not found_contact and sender_ip != self.get_my_ip():
-                            new_contact_name = f"Unknown User [{sender_ip}]"
-                            new_contact = {'name': new_contact_name, 'ip': sender_ip}
-                            self.contacts.append(new_contact)
-                            self._save_contacts_automatically()
-                            self.root.after(0, self._populate_contacts_listbox)
-                            sender_contact_name = new_contact_name
-
-                        display_target_ip = sender_ip
-                        display_message = f"DM FROM {sender_contact_name} ({sender_ip}): {message_content}"
-
-                    elif msg_type == "BROADCAST":
-                        sender_contact_name = "UNKNOWN"
-                        found_contact = False
-                        for contact in self.contacts:
-                            if contact['ip'] == sender_ip:
-                                sender_contact_name = contact['name']
-                                found_contact = True
-                                break
-                        
-                        if not found_contact and sender_ip != self.get_my_ip():
-                            new_contact_name = f"Unknown User [{sender_ip}]"
-                            new_contact = {'name': new_contact_name, 'ip': sender_ip}
-                            self.contacts.append(new_contact)
-                            self._save_contacts_automatically()
-                            self.root.after(0, self._populate_contacts_listbox)
-                            sender_contact_name = new_contact_name
-
-                        display_target_ip = self.FIXED_SERVER_CONTACT_IP
-                        display_message = f"BROADCAST FROM {sender_contact_name} ({sender_ip}): {message_content}"
-
-                    elif msg_type == "SERVER_DM" or msg_type == "SERVER_BROADCAST":
-                        display_target_ip = self.FIXED_SERVER_CONTACT_IP
-                        display_message = f"SERVER: {message_content}"
-
-                    elif msg_type == "ERROR":
-                        display_target_ip = self.FIXED_SERVER_CONTACT_IP
-                        display_message = f"SERVER ERROR: {message_content}"
-                    else:
-                        display_target_ip = self.FIXED_SERVER_CONTACT_IP
-                        display_message = f"UNKNOWN MESSAGE TYPE: {received_raw_message}"
-
-                    self._save_message_to_contact_history(display_target_ip, display_message)
-
-                    current_selected_contact_ip = None
-                    if self.current_contact_index != -1 and self.current_contact_index < len(self.contacts):
-                        current_selected_contact_ip = self.contacts[self.current_contact_index]['ip']
-
-                    if current_selected_contact_ip == display_target_ip:
-                        self._add_message_to_gui(display_message, tag=message_tag)
-
-                except json.JSONDecodeError:
-                    display_message = f"RAW SERVER MESSAGE: {received_raw_message}"
-                    self._add_message_to_gui(display_message, tag='white')
-                    self._save_message_to_contact_history(self.FIXED_SERVER_CONTACT_IP, display_message)
-                except Exception as e:
-                    error_message = f"ERROR PROCESSING RECEIVED DATA: {e} | RAW: {received_raw_message}"
-                    self._add_message_to_gui(error_message, tag='white')
-                    self._save_message_to_contact_history(self.FIXED_SERVER_CONTACT_IP, error_message)
-
-            except socket.error as e:
-                if self.connected: 
-                    self._add_message_to_gui(f"RECEIVER ERROR: {e}", tag='white')
-                break 
-            except Exception as e:
-                self._add_message_to_gui(f"UNEXPECTED ERROR IN RECEIVER: {e}", tag='white')
-                break
-        
-        if self.connected: 
-            self.connected = False 
-            self._update_status("RECEIVER ERROR, DISCONNECTED.", "red")
-        print("RECEIVER THREAD TERMINATED.")
+    def _queue_message(self, message_data):
+        # The outbox keeps every message until the sender thread has written it to a socket.
+        if not self.outbox.put(message_data):
+            self._update_status(f"Outbox full ({self.OUTBOX_MAX_MESSAGES} messages). Message not sent.", "red")
+            return
+        if self.connected:
+            self.chat.send(message_data)
+            return
+        self._update_status(f"Not connected. Message queued ({len(self.outbox)} waiting).", "orange")
+        if not self.connecting and self.reconnect_after_id is None and self.current_server_index != -1:
+            self.auto_reconnect = True
+            self._schedule_reconnect()
+
+    def _process_message(self, parsed_message):
+        # Called on the ChatClient receiver thread for every decoded message.
+        try:
+            msg_type = parsed_message.get("type", "UNKNOWN")
+            sender_ip = parsed_message.get("sender_ip", "UNKNOWN")
+            message_content = parsed_message.get("message", "No message content")
+
+            if sender_ip in self.blocked_ips:
+                print(f"Ignored message from blocked IP: {sender_ip}")
+                return
+
+            display_target_ip = self.FIXED_SERVER_CONTACT_IP
+            display_message = ""
+            message_tag = 'white'
+            
+            if msg_type == "DM":
+                sender_contact_name = self._resolve_sender_name(sender_ip)
+                display_target_ip = sender_ip
+                display_message = f"DM FROM {sender_contact_name} ({sender_ip}): {message_content}"
+
+            elif msg_type == "BROADCAST":
+                sender_contact_name = self._resolve_sender_name(sender_ip)
+                display_target_ip = self.FIXED_SERVER_CONTACT_IP
+                display_message = f"BROADCAST FROM {sender_contact_name} ({sender_ip}): {message_content}"
+
+            elif msg_type == "SERVER_DM" or msg_type == "SERVER_BROADCAST":
+                display_target_ip = self.FIXED_SERVER_CONTACT_IP
+                display_message = f"SERVER: {message_content}"
+
+            elif msg_type == "ERROR":
+                display_target_ip = self.FIXED_SERVER_CONTACT_IP
+                display_message = f"SERVER ERROR: {message_content}"
+            else:
+                display_target_ip = self.FIXED_SERVER_CONTACT_IP
+                display_message = f"UNKNOWN MESSAGE TYPE: {parsed_message}"
+
+            self._save_message_to_contact_history(display_target_ip, display_message)
+
+            current_selected_contact_ip = None
+            if self.current_contact_index != -1 and self.current_contact_index < len(self.contacts):
+                current_selected_contact_ip = self.contacts[self.current_contact_index]['ip']
+
+            if current_selected_contact_ip == display_target_ip:
+                self._add_message_to_gui(display_message, tag=message_tag)
+
+        except Exception as e:
+            error_message = f"ERROR PROCESSING RECEIVED DATA: {e} | MESSAGE: {parsed_message}"
+            self._add_message_to_gui(error_message, tag='white')
+            self._save_message_to_contact_history(self.FIXED_SERVER_CONTACT_IP, error_message)
+
+    def _process_invalid_frame(self, frame, error):
+        display_message = f"RAW SERVER MESSAGE: {frame.decode('utf-8', errors='replace')}"
+        self._add_message_to_gui(display_message, tag='white')
+        self._save_message_to_contact_history(self.FIXED_SERVER_CONTACT_IP, display_message)
+
+    def _resolve_sender_name(self, sender_ip):
+        """Returns the contact name for sender_ip, adding unknown senders as new contacts."""
+        contact = self.contacts_by_ip.get(sender_ip)
+        if contact is not None:
+            return contact['name']
+        if sender_ip == self.get_my_ip():
+            return "UNKNOWN"
+
+        new_contact_name = f"Unknown User [{sender_ip}]"
+        self._add_contact({'name': new_contact_name, 'ip': sender_ip})
+        self._save_contacts_automatically()
+        self._schedule_contact_entries_update()
+        return new_contact_name
+
+    def get_my_ip(self, refresh=False):
+        # Resolved once and cached; _connect refreshes it since a new connection may use another interface.
+        if self.local_ip is not None and not refresh:
+            return self.local_ip
 
-    def get_my_ip(self):
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         try:
             s.connect(('192.254.254.254', 1)) 
@@ -970,6 +1273,7 @@ class Client:
             IP = '127.0.0.1'
         finally:
             s.close()
+        self.local_ip = IP
         return IP
 
     def _add_message_to_gui(self, message, tag='white'):
@@ -977,20 +1281,51 @@ class Client:
             self.gui_message_buffer.append((message + "\n", tag))
             if not self.gui_update_scheduled:
                 self.gui_update_scheduled = True
-                self.root.after(10, self.__perform_gui_update)
+                self.root.after(self.GUI_FLUSH_INTERVAL_MS, self.__perform_gui_update)
 
     def __perform_gui_update(self):
+        deadline = time.perf_counter() + self.GUI_FRAME_BUDGET_MS / 1000
+        buffer = self.gui_message_buffer
         self.text_area.config(state=tk.NORMAL)
-        for text, tag in self.gui_message_buffer:
-            self.text_area.insert(tk.END, text, tag)
-        self.gui_message_buffer.clear()
+
+        if len(buffer) > self.SCROLLBACK_LINES:
+            # Everything shown now and the oldest buffered lines would be trimmed anyway.
+            for _ in range(len(buffer) - self.SCROLLBACK_LINES):
+                buffer.popleft()
+            self.text_area.delete(1.0, tk.END)
+            self.history_cursor = 0
+            self.history_unshown = []
+
+        # One insert per run of lines with the same tag, until this frame's budget is spent.
+        while buffer and time.perf_counter() < deadline:
+            text, tag = buffer.popleft()
+            run = [text]
+            while buffer and buffer[0][1] == tag and len(run) < 500:
+                run.append(buffer.popleft()[0])
+            self.text_area.insert(tk.END, "".join(run), tag)
+
+        self._trim_scrollback()
         self.text_area.see(tk.END)
         self.text_area.config(state=tk.DISABLED)
-        self.gui_update_scheduled = False
+
+        if buffer:
+            self.root.after(self.GUI_FLUSH_INTERVAL_MS, self.__perform_gui_update)
+        else:
+            self.gui_update_scheduled = False
+
+    def _trim_scrollback(self):
+        line_count = int(self.text_area.index("end-1c").split(".")[0])
+        excess = line_count - self.SCROLLBACK_LINES
+        if excess > 0:
+            self.text_area.delete(1.0, f"{excess + 1}.0")
+            # The trimmed lines are gone from the view, so paging back would leave a gap.
+            self.history_cursor = 0
+            self.history_unshown = []
 
     def _on_closing(self):
         self._update_status("CLIENT SHUTDOWN INITIATED...")
         self._disconnect() 
+        self.persistence.stop()
         
         if self.root.winfo_exists():
             self.root.destroy()
@@ -1112,9 +1447,10 @@ class ContactConfigDialog(simpledialog.Dialog):
             messagebox.showwarning("Input Error", "All fields must be filled.", parent=self)
             return False
         
+        # inet_aton would also accept shorthand such as "10.1", which cannot be sent in binary frames.
         try:
-            socket.inet_aton(ip)
-        except socket.error:
+            protocol.pack_ip(ip)
+        except protocol.ProtocolError:
             messagebox.showwarning("Input Error", "Invalid IP Address format.", parent=self)
             return False
         
@@ -0,0 +1,511 @@
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import config
+import log_pipeline
+import metrics
+import outbound
+import protocol
+
+# Peer links are control traffic between processes on one host: never drop, wait briefly when full.
+PEER_QUEUE_SIZE = 65536
+PEER_BLOCK_TIMEOUT = 5.0
+PEER_RECONNECT_INTERVAL = 1.0
+# Workers only start accepting clients once their links to every peer are up, or after this long.
+PEER_STARTUP_TIMEOUT = 10.0
+PEER_STARTUP_POLL_INTERVAL = 0.05
+ADMIN_REQUEST_TIMEOUT = 2.0
+# Seconds a worker waits for another worker to confirm it wrote a batch of queued DMs to the recipient.
+OFFLINE_BATCH_TIMEOUT = 30.0
+
+
+def worker_socket_path(socket_dir, worker_id):
+    return os.path.join(socket_dir, f"worker-{worker_id}.sock")
+
+
+def _send_op(sock, op):
+    sock.sendall(protocol.encode_json_frame(op))
+
+
+def _read_ops(sock, decoder):
+    data = sock.recv(65536)
+    if not data:
+        return None
+    return [json.loads(frame) for frame in decoder.feed(data)]
+
+
+def _request(path, op, timeout):
+    """Sends op on a new connection to a worker's socket and returns its reply, or None if it closed first."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path)
+        _send_op(sock, op)
+        decoder = protocol.FrameDecoder()
+        while True:
+            ops = _read_ops(sock, decoder)
+            if ops is None:
+                return None
+            if ops:
+                return ops[0]
+    finally:
+        sock.close()
+
+
+class PeerLink:
+    """Outgoing link to another worker's Unix socket, (re)connected lazily."""
+
+    def __init__(self, node, worker_id, path):
+        self.node = node
+        self.worker_id = worker_id
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = None
+        self.last_attempt = 0.0
+        self.dropped_relays = 0
+
+    def send(self, op):
+        connection = self._get_connection()
+        if connection is None:
+            return False
+        try:
+            connection.sendall(protocol.encode_json_frame(op))
+            return True
+        except OSError as e:
+            self._on_error(connection, e)
+            return False
+
+    def relay(self, op):
+        """Sends a broadcast relay op; counts it as dropped if the link is down."""
+        if self.send(op):
+            return True
+        with self.lock:
+            self.dropped_relays += 1
+        self.node.count_dropped_relay()
+        return False
+
+    def _get_connection(self, retry_interval=PEER_RECONNECT_INTERVAL):
+        with self.lock:
+            if self.connection is not None:
+                return self.connection
+            now = time.monotonic()
+            if now - self.last_attempt < retry_interval:
+                return None
+            self.last_attempt = now
+
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.path)
+            except OSError:
+                sock.close()
+                return None
+
+            connection = self.connection = outbound.ClientConnection(
+                sock, (f"worker-{self.worker_id}", 0), PEER_QUEUE_SIZE, outbound.POLICY_BLOCK, PEER_BLOCK_TIMEOUT, self._on_error)
+            # A fresh link starts with who we are and which IPs we currently serve.
+            connection.sendall(protocol.encode_json_frame({"op": "hello", "worker_id": self.node.worker_id}))
+            connection.sendall(protocol.encode_json_frame({"op": "ip_snapshot", "ips": self.node.local_ips()}))
+            dropped, self.dropped_relays = self.dropped_relays, 0
+        if dropped:
+            self.node.log(f"{dropped} broadcast(s) could not be relayed to worker {self.worker_id} while its link was down.",
+                          log_pipeline.WARNING)
+        return connection
+
+    def _on_error(self, connection, error):
+        with self.lock:
+            if self.connection is connection:
+                self.connection = None
+        try:
+            connection.close()
+        except OSError:
+            pass
+        self.node.log(f"Link to worker {self.worker_id} lost: {error}", log_pipeline.WARNING)
+
+    def close(self):
+        with self.lock:
+            connection, self.connection = self.connection, None
+        if connection is not None:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+                connection.close()
+            except OSError:
+                pass
+
+
+class ClusterNode:
+    """Routing layer of one worker process.
+
+    Every worker listens on a Unix socket. Workers tell each other which client IPs they
+    serve, so a DM for a client on another worker is forwarded straight to that worker and
+    broadcasts are forwarded once to every peer, which fans them out locally. The same socket
+    answers admin requests from the supervisor.
+    """
+
+    def __init__(self, worker_id, worker_count, socket_dir):
+        self.worker_id = worker_id
+        self.socket_dir = socket_dir
+        self.server = None
+        self.gui = None
+
+        self.lock = threading.Lock()
+        self.local_ip_counts = {}
+        self.remote_ips = {}
+
+        self.peers = {
+            peer_id: PeerLink(self, peer_id, worker_socket_path(socket_dir, peer_id))
+            for peer_id in range(worker_count) if peer_id != worker_id
+        }
+        self.listen_socket = None
+        self.running = False
+
+    def start(self, gui, server):
+        self.gui = gui
+        self.server = server
+        self.running = True
+
+        path = worker_socket_path(self.socket_dir, self.worker_id)
+        if os.path.exists(path):
+            os.remove(path)
+        self.listen_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listen_socket.bind(path)
+        self.listen_socket.listen(len(self.peers) + 4)
+
+        listener_thread = threading.Thread(target=self._listener_thread)
+        listener_thread.daemon = True
+        listener_thread.start()
+
+        link_thread = threading.Thread(target=self._link_maintenance_thread)
+        link_thread.daemon = True
+        link_thread.start()
+
+    def stop(self):
+        self.running = False
+        for peer in self.peers.values():
+            peer.close()
+        if self.listen_socket is not None:
+            self.listen_socket.close()
+            self.listen_socket = None
+
+    def wait_for_peers(self, timeout=PEER_STARTUP_TIMEOUT):
+        """Blocks until there is a link to every peer, so no early broadcast misses a worker."""
+        deadline = time.monotonic() + timeout
+        while True:
+            missing = [peer.worker_id for peer in self.peers.values()
+                       if peer._get_connection(PEER_STARTUP_POLL_INTERVAL) is None]
+            if not missing:
+                return True
+            if time.monotonic() >= deadline:
+                self.log(f"No link to worker(s) {', '.join(map(str, missing))} after {timeout:.0f} s, accepting clients anyway.",
+                         log_pipeline.WARNING)
+                return False
+            time.sleep(PEER_STARTUP_POLL_INTERVAL)
+
+    def count_dropped_relay(self):
+        if self.server is not None:
+            self.server.metrics.relays_dropped.inc()
+
+    def log(self, message, level=log_pipeline.INFO):
+        if self.gui is not None:
+            self.gui.log_output(message, level)
+
+    def local_ips(self):
+        with self.lock:
+            return list(self.local_ip_counts)
+
+    # Called by Server whenever a client connects or disconnects on this worker.
+    def on_local_connect(self, addr):
+        with self.lock:
+            count = self.local_ip_counts.get(addr[0], 0)
+            self.local_ip_counts[addr[0]] = count + 1
+        if count == 0:
+            self._send_to_peers({"op": "ip_up", "ip": addr[0]})
+
+    def on_local_disconnect(self, addr):
+        with self.lock:
+            count = self.local_ip_counts.get(addr[0], 0) - 1
+            if count > 0:
+                self.local_ip_counts[addr[0]] = count
+            else:
+                self.local_ip_counts.pop(addr[0], None)
+        if count <= 0:
+            self._send_to_peers({"op": "ip_down", "ip": addr[0]})
+
+    def serves_remotely(self, ip):
+        with self.lock:
+            return any(ip in ips for ips in self.remote_ips.values())
+
+    def forward_dm(self, relay):
+        """Sends a DM to the worker serving its recipient. Returns False if no worker does."""
+        with self.lock:
+            owners = [worker_id for worker_id, ips in self.remote_ips.items() if relay.recipient in ips]
+        for worker_id in owners:
+            if self.peers[worker_id].send(self._relay_op(relay)):
+                return True
+        return False
+
+    def deliver_offline_batch(self, recipient, relays):
+        """Hands queued DMs to the worker serving recipient. Returns True once it wrote them to the recipient.
+
+        Each batch is a request of its own, answered only after the owning worker's writer has
+        written it, so a batch is never committed while it may still be lost.
+        """
+        with self.lock:
+            owners = [worker_id for worker_id, ips in self.remote_ips.items() if recipient in ips]
+        op = {"op": "offline_batch", "recipient": recipient,
+              "messages": [{"sender_ip": relay.sender_ip, "message": relay.message} for relay in relays]}
+        for worker_id in owners:
+            try:
+                reply = _request(worker_socket_path(self.socket_dir, worker_id), op, OFFLINE_BATCH_TIMEOUT)
+            except (OSError, ValueError) as e:
+                self.log(f"Worker {worker_id} did not confirm queued DMs for {recipient}: {e}", log_pipeline.WARNING)
+                continue
+            if reply is not None and reply.get("delivered"):
+                return True
+        return False
+
+    def forward_broadcast(self, relay):
+        op = self._relay_op(relay)
+        for peer in self.peers.values():
+            peer.relay(op)
+
+    def _relay_op(self, relay):
+        return {"op": "relay", "type": relay.msg_type, "recipient": relay.recipient,
+                "sender_ip": relay.sender_ip, "message": relay.message}
+
+    def _send_to_peers(self, op):
+        for peer in self.peers.values():
+            peer.send(op)
+
+    def _link_maintenance_thread(self):
+        # Peers start in any order and may restart; keep (re)connecting so each one gets our snapshot.
+        while self.running:
+            for peer in self.peers.values():
+                peer._get_connection()
+            time.sleep(PEER_RECONNECT_INTERVAL)
+
+    def _listener_thread(self):
+        while self.running:
+            try:
+                conn, _ = self.listen_socket.accept()
+            except OSError:
+                break
+            session_thread = threading.Thread(target=self._session_thread, args=(conn,))
+            session_thread.daemon = True
+            session_thread.start()
+
+    def _session_thread(self, conn):
+        decoder = protocol.FrameDecoder()
+        peer_id = None
+        try:
+            while self.running:
+                ops = _read_ops(conn, decoder)
+                if ops is None:
+                    break
+                for op in ops:
+                    if op.get("op") == "hello":
+                        peer_id = op.get("worker_id")
+                    else:
+                        self._handle_op(conn, peer_id, op)
+        except (OSError, ValueError) as e:
+            self.log(f"Cluster session error: {e}", log_pipeline.WARNING)
+        finally:
+            conn.close()
+            if peer_id is not None:
+                with self.lock:
+                    self.remote_ips.pop(peer_id, None)
+
+    def _handle_op(self, conn, peer_id, op):
+        name = op.get("op")
+        if name == "ip_snapshot":
+            with self.lock:
+                self.remote_ips[peer_id] = set(op.get("ips", []))
+            for ip in op.get("ips", []):
+                self.server.deliver_offline(ip)
+        elif name == "ip_up":
+            with self.lock:
+                self.remote_ips.setdefault(peer_id, set()).add(op["ip"])
+            self.server.deliver_offline(op["ip"])
+        elif name == "ip_down":
+            with self.lock:
+                self.remote_ips.setdefault(peer_id, set()).discard(op["ip"])
+        elif name == "relay":
+            relay = protocol.RelayMessage(op["type"], op.get("recipient"), op.get("sender_ip"), json_message=op.get("message"))
+            if relay.msg_type == "DM":
+                self.server.run_in_server_context(self.server._route_dm, relay)
+            elif relay.msg_type == "BROADCAST":
+                self.server.run_in_server_context(self.server._route_broadcast, relay)
+        elif name == "offline_batch":
+            recipient = op["recipient"]
+            relays = [protocol.RelayMessage("DM", recipient, message["sender_ip"], json_message=message["message"])
+                      for message in op["messages"]]
+            connections = self.server.get_connections_by_ip(recipient)
+            delivered = bool(connections) and self.server._send_offline_batch(connections[0][1], relays)
+            _send_op(conn, {"op": "offline_batch_done", "delivered": delivered})
+        elif name == "list_connections":
+            addrs = [list(addr) for addr in list(self.server.connections.keys())]
+            _send_op(conn, {"op": "connections", "worker_id": self.worker_id, "connections": addrs})
+        elif name == "disconnect":
+            addr = tuple(op["addr"])
+            found = addr in self.server.connections
+            if found:
+                self.server._cleanup_disconnected_client(addr)
+            _send_op(conn, {"op": "disconnected", "found": found})
+        elif name == "metrics":
+            _send_op(conn, {"op": "metrics", "worker_id": self.worker_id, "snapshot": self.server.metrics_snapshot()})
+        elif name == "shutdown":
+            self.gui.request_shutdown()
+
+
+class ClusterView:
+    """Supervisor-side stand-in for Server so the admin commands see every worker's clients."""
+
+    def __init__(self, gui, supervisor):
+        self.gui = gui
+        self.supervisor = supervisor
+        self.metrics_endpoint = None
+        if config.METRICS_PORT is not None:
+            try:
+                self.metrics_endpoint = metrics.MetricsEndpoint(config.METRICS_HOST, config.METRICS_PORT, self.metrics_snapshot)
+                self.gui.log_output(f"Metrics endpoint on http://{config.METRICS_HOST}:{config.METRICS_PORT}/metrics")
+            except OSError as e:
+                self.gui.log_output(f"Could not start metrics endpoint on port {config.METRICS_PORT}: {e}", log_pipeline.ERROR)
+
+    def _request(self, worker_id, op):
+        try:
+            return _request(worker_socket_path(self.supervisor.socket_dir, worker_id), op, ADMIN_REQUEST_TIMEOUT)
+        except (OSError, ValueError) as e:
+            self.gui.log_output(f"Worker {worker_id} did not answer: {e}", log_pipeline.WARNING)
+            return None
+
+    def connection_owners(self):
+        owners = {}
+        for worker_id in range(self.supervisor.worker_count):
+            reply = self._request(worker_id, {"op": "list_connections"})
+            if reply is not None:
+                for addr in reply["connections"]:
+                    owners[tuple(addr)] = worker_id
+        return owners
+
+    @property
+    def connections(self):
+        return self.connection_owners()
+
+    def get_connections_by_ip(self, ip):
+        return [(addr, worker_id) for addr, worker_id in self.connection_owners().items() if addr[0] == ip]
+
+    def _cleanup_disconnected_client(self, addr):
+        owner = self.connection_owners().get(tuple(addr))
+        if owner is not None:
+            self._request(owner, {"op": "disconnect", "addr": list(addr)})
+
+    def metrics_snapshot(self):
+        """Merges the metrics of every worker that answers."""
+        snapshots = []
+        for worker_id in range(self.supervisor.worker_count):
+            reply = self._request(worker_id, {"op": "metrics"})
+            if reply is not None:
+                snapshots.append(reply["snapshot"])
+        return metrics.merge_snapshots(snapshots)
+
+    def stop_server(self):
+        if self.metrics_endpoint is not None:
+            self.metrics_endpoint.stop()
+            self.metrics_endpoint = None
+        self.supervisor.stop_workers()
+        self.gui.log_output("Server stopped.")
+
+
+class ClusterSupervisor:
+    """Starts worker processes that share SERVER_PORT through SO_REUSEPORT and serves the admin console."""
+
+    def __init__(self, worker_count, engine, use_stdin=True, admin_port=None):
+        self.worker_count = worker_count
+        self.engine = engine
+        self.use_stdin = use_stdin
+        self.admin_port = admin_port
+        self.socket_dir = config.CLUSTER_SOCKET_DIR or tempfile.mkdtemp(prefix="pychat-cluster-")
+        os.makedirs(self.socket_dir, exist_ok=True)
+        self.processes = []
+
+    def run(self):
+        from headless import HeadlessServer
+
+        context = multiprocessing.get_context("spawn")
+        for worker_id in range(self.worker_count):
+            process = context.Process(target=run_worker, name=f"pychat-worker-{worker_id}",
+                                      args=(worker_id, self.worker_count, self.engine, self.socket_dir, config.SERVER_PORT))
+            process.start()
+            self.processes.append(process)
+
+        console = HeadlessServer(use_stdin=self.use_stdin, admin_port=self.admin_port,
+                                 server_factory=lambda gui: ClusterView(gui, self))
+        console.log_output(f"Started {self.worker_count} worker processes ({self.engine} engine) on port {config.SERVER_PORT}.")
+        signal.signal(signal.SIGTERM, lambda signum, frame: console.request_shutdown())
+        monitor_thread = threading.Thread(target=self._worker_monitor_thread, args=(console,))
+        monitor_thread.daemon = True
+        monitor_thread.start()
+        try:
+            console.run()
+        finally:
+            self.stop_workers()
+            if not config.CLUSTER_SOCKET_DIR:
+                shutil.rmtree(self.socket_dir, ignore_errors=True)
+
+    def _worker_monitor_thread(self, console):
+        # Without a worker its share of the port is gone, so a lost worker takes the whole cluster down.
+        while not console.shutdown_event.wait(PEER_RECONNECT_INTERVAL):
+            for process in list(self.processes):
+                if not process.is_alive():
+                    console.log_output(f"Worker process {process.name} exited with code {process.exitcode}, shutting down.",
+                                       log_pipeline.ERROR)
+                    console.request_shutdown()
+                    return
+
+    def stop_workers(self):
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+        for process in self.processes:
+            process.join(timeout=5)
+        self.processes = []
+
+
+def _parent_watchdog_thread(parent_pid, app):
+    # A worker must not outlive its supervisor and keep holding the shared port.
+    while not app.shutdown_event.wait(PEER_RECONNECT_INTERVAL):
+        if os.getppid() != parent_pid:
+            app.log_output("Supervisor exited, shutting down worker.", log_pipeline.WARNING)
+            app.request_shutdown()
+            return
+
+
+def run_worker(worker_id, worker_count, engine, socket_dir, port):
+    from headless import HeadlessServer
+
+    logging.basicConfig(level=logging.DEBUG, format=f"[%(asctime)s] [worker {worker_id}] %(message)s", datefmt="%H:%M:%S")
+    config.SERVER_ENGINE = engine
+    config.SERVER_PORT = port
+    config.SERVER_REUSE_PORT = True
+
+    node = ClusterNode(worker_id, worker_count, socket_dir)
+    app = HeadlessServer(use_stdin=False, cluster=node)
+    node.start(app, app.server)
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: app.request_shutdown())
+    watchdog_thread = threading.Thread(target=_parent_watchdog_thread, args=(os.getppid(), app))
+    watchdog_thread.daemon = True
+    watchdog_thread.start()
+    try:
+        app.run()
+    finally:
+        node.stop()
+    sys.exit(0)
@@ -18,3 +18,20 @@ def load_commands(command_folder="commands"):
                     cmd_instance = attr()
                     commands[cmd_instance.name] = cmd_instance
     return commands
+
+def execute_command(gui, commands, command_line):
+    if not command_line.strip():
+        return None
+
+    parts = command_line.strip().split(maxsplit=1)
+    cmd_name = parts[0].lower()
+    args = parts[1].split() if len(parts) > 1 else []
+
+    cmd = commands.get(cmd_name)
+    if cmd:
+        try:
+            return cmd.execute(gui, args)
+        except Exception as e:
+            return f"Error executing command '{cmd_name}': {e}"
+    else:
+        return f"Unknown command: {cmd_name}"
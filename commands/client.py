@@ -81,13 +81,12 @@ class ClientCommand:
         found_client = False
         client_to_disconnect_addr = None
 
-        # Find the full address tuple for the given IP
-        for addr_tuple in self.gui.server.connections.keys():
-            if addr_tuple[0] == target_ip:
-                client_to_disconnect_addr = addr_tuple
-                found_client = True
-                break
-        
+        # Look up the full address tuple for the given IP
+        ip_connections = self.gui.server.get_connections_by_ip(target_ip)
+        if ip_connections:
+            client_to_disconnect_addr = ip_connections[0][0]
+            found_client = True
+
         if found_client:
             self.gui._terminal_println(f"Attempting to disconnect client {target_ip}...")
             # Call the server's internal cleanup method
@@ -103,17 +102,14 @@ class ClientCommand:
             return
 
         target_ip = sub_args[0]
-        found_client = False
-        
-        for addr_tuple in self.gui.server.connections.keys():
-            if addr_tuple[0] == target_ip:
-                self.gui._terminal_println(f"Information for client {target_ip}:")
+        ip_connections = self.gui.server.get_connections_by_ip(target_ip)
+
+        if ip_connections:
+            self.gui._terminal_println(f"Information for client {target_ip}:")
+            for addr_tuple, _ in ip_connections:
                 self.gui._terminal_println(f"  - Full Address: {addr_tuple[0]}:{addr_tuple[1]}")
                 # You could add more info here if the server stored it, e.g.,
                 # self.gui._terminal_println(f"  - Messages Received: {len(self.gui.server.client_messages.get(addr_tuple, []))}")
                 # self.gui._terminal_println(f"  - Handler Thread Alive: {self.gui.server.client_threads.get(addr_tuple).is_alive()}")
-                found_client = True
-                break
-        
-        if not found_client:
+        else:
             self.gui._terminal_println(f"Error: Client with IP '{target_ip}' not found or is not connected.")
\ No newline at end of file
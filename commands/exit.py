@@ -3,6 +3,6 @@ class ExitCommand:
 
     def execute(self, gui, args):
         gui.log_output("Shutting down server...")
-        gui.root.after(100, gui._on_closing)
+        gui.request_shutdown()
         return None
     
\ No newline at end of file
@@ -0,0 +1,18 @@
+import log_pipeline
+
+
+class LogLevelCommand:
+    name = "loglevel"
+
+    def execute(self, gui, args):
+        if not args:
+            current = log_pipeline.LEVEL_NAMES[gui.log_pipeline.level].lower()
+            return f"Current log level: {current} (options: {', '.join(log_pipeline.LEVELS_BY_NAME)})"
+
+        try:
+            level = log_pipeline.parse_level(args[0])
+        except ValueError as e:
+            return f"Error: {e}"
+
+        gui.log_pipeline.set_level(level)
+        return f"Log level set to {log_pipeline.LEVEL_NAMES[level].lower()}."
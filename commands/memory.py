@@ -0,0 +1,62 @@
+import tracemalloc
+
+import profiling
+
+
+class MemoryCommand:
+    name = "memory"
+
+    TOP_ENTRIES = 30
+
+    def __init__(self):
+        self.baseline = None
+
+    def execute(self, gui, args):
+        subcommand = args[0] if args else "status"
+        if subcommand == "start":
+            frames = int(args[1]) if len(args) > 1 and args[1].isdigit() else 1
+            if tracemalloc.is_tracing():
+                return "Memory tracing is already running."
+            tracemalloc.start(frames)
+            self.baseline = None
+            return f"Memory tracing started ({frames} frame(s) per allocation)."
+        if subcommand == "stop":
+            if not tracemalloc.is_tracing():
+                return "Memory tracing is not running."
+            tracemalloc.stop()
+            self.baseline = None
+            return "Memory tracing stopped."
+        if subcommand in ("snapshot", "diff"):
+            if not tracemalloc.is_tracing():
+                return "Memory tracing is not running. Start it with 'memory start'."
+            return self._write_report(subcommand)
+        if subcommand == "status":
+            if not tracemalloc.is_tracing():
+                return "Memory tracing is not running. Usage: memory start [frames] | snapshot | diff | stop"
+            current, peak = tracemalloc.get_traced_memory()
+            return f"Traced memory: {current / 1024:.0f} KiB (peak {peak / 1024:.0f} KiB)."
+        return "Usage: memory start [frames] | memory snapshot | memory diff | memory stop | memory status"
+
+    def _write_report(self, subcommand):
+        # Allocations made by tracemalloc itself would otherwise dominate the report.
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+        ))
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"Traced memory: {current / 1024:.0f} KiB (peak {peak / 1024:.0f} KiB)", ""]
+
+        if subcommand == "diff" and self.baseline is not None:
+            lines.append(f"Top {self.TOP_ENTRIES} changes since the previous snapshot:")
+            lines += [str(stat) for stat in snapshot.compare_to(self.baseline, "lineno")[:self.TOP_ENTRIES]]
+        else:
+            if subcommand == "diff":
+                lines.append("No previous snapshot to compare with; this one becomes the baseline.")
+            lines.append(f"Top {self.TOP_ENTRIES} allocation sites:")
+            lines += [str(stat) for stat in snapshot.statistics("lineno")[:self.TOP_ENTRIES]]
+        self.baseline = snapshot
+
+        path = profiling.report_path(f"memory-{subcommand}", ".txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        snapshot.dump(path[:-len(".txt")] + ".snapshot")
+        return f"Wrote {path}"
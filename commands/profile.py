@@ -0,0 +1,32 @@
+class ProfileCommand:
+    name = "profile"
+
+    SORT_KEYS = ("cumulative", "tottime", "calls")
+
+    def execute(self, gui, args):
+        profiler = getattr(gui.server, "profiler", None)
+        if profiler is None:
+            return "Profiling runs inside the server process and is not available on this console."
+
+        subcommand = args[0] if args else "status"
+        if subcommand == "start":
+            if not profiler.start():
+                return "Profiling is already running."
+            if profiler.serialised:
+                return ("Profiling started. This Python allows one profiler at a time, so frames are processed one "
+                        "at a time until 'profile stop'; a blocked send stalls every client handler meanwhile.")
+            return "Profiling started; each client handler thread is profiled separately until 'profile stop'."
+        if subcommand == "stop":
+            sort_by = args[1] if len(args) > 1 else "cumulative"
+            if sort_by not in self.SORT_KEYS:
+                return f"Error: sort key must be one of {', '.join(self.SORT_KEYS)}."
+            result = profiler.stop(sort_by)
+            if result is None:
+                return "Profiling is not running."
+            prof_path, text_path, frames = result
+            return f"Profiled {frames} frames. Report: {text_path} (raw stats: {prof_path})"
+        if subcommand == "status":
+            if profiler.active:
+                return f"Profiling is running ({profiler.calls} frames so far)."
+            return "Profiling is not running. Usage: profile start | profile stop [cumulative|tottime|calls]"
+        return "Usage: profile start | profile stop [cumulative|tottime|calls] | profile status"
@@ -0,0 +1,12 @@
+import profiling
+
+
+class StacksCommand:
+    name = "stacks"
+
+    def execute(self, gui, args):
+        thread_count, report = profiling.format_thread_stacks()
+        path = profiling.report_path("stacks", ".txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(report)
+        return f"Dumped the stacks of {thread_count} threads to {path}"
@@ -0,0 +1,59 @@
+import json
+
+import metrics
+
+
+class StatsCommand:
+    name = "stats"
+
+    def execute(self, gui, args):
+        snapshot = gui.server.metrics_snapshot()
+        if args and args[0] == "json":
+            gui._terminal_println(json.dumps(snapshot, indent=2))
+            return None
+        if args and args[0] == "prometheus":
+            gui._terminal_println(metrics.render_prometheus(snapshot).rstrip("\n"))
+            return None
+        if args:
+            return "Usage: stats [json|prometheus]"
+
+        def value(name, label=""):
+            return snapshot.get(name, {}).get("values", {}).get(label, 0)
+
+        def by_type(name):
+            return snapshot.get(name, {}).get("values", {})
+
+        gui._terminal_println(f"Uptime: {value('pychat_uptime_seconds'):.0f} s | "
+                              f"connections: {value('pychat_active_connections')} active, "
+                              f"{value('pychat_connections_accepted_total')} accepted "
+                              f"({value('pychat_accept_rate'):.2f}/s over the last minute)")
+        gui._terminal_println(f"DM misses: {value('pychat_dm_misses_total')} | "
+                              f"send errors: {value('pychat_send_errors_total')} | "
+                              f"outbound queues: {value('pychat_outbound_queue_messages')} frames "
+                              f"(longest {value('pychat_outbound_queue_max')})")
+        gui._terminal_println(f"Offline DMs: {value('pychat_offline_dms_stored_total')} queued, "
+                              f"{value('pychat_offline_dms_delivered_total')} delivered, "
+                              f"{value('pychat_offline_recipients')} recipient(s) waiting")
+
+        processing = snapshot.get("pychat_message_processing_seconds", {})
+        bounds = processing.get("bounds", [])
+        types = sorted(set(by_type("pychat_messages_in_total")) | set(by_type("pychat_messages_out_total")))
+        if not types:
+            gui._terminal_println("No messages yet.")
+            return None
+
+        gui._terminal_println(f"{'TYPE':<17}{'IN':>10}{'IN KiB':>10}{'OUT':>10}{'OUT KiB':>10}"
+                              f"{'p50 ms':>9}{'p99 ms':>9}")
+        for msg_type in types:
+            histogram = processing.get("values", {}).get(msg_type)
+            p50 = p99 = "-"
+            if histogram:
+                p50 = f"{metrics.histogram_quantile(bounds, histogram['buckets'], 0.50) * 1000:.3f}"
+                p99 = f"{metrics.histogram_quantile(bounds, histogram['buckets'], 0.99) * 1000:.3f}"
+            gui._terminal_println(f"{msg_type:<17}"
+                                  f"{by_type('pychat_messages_in_total').get(msg_type, 0):>10}"
+                                  f"{by_type('pychat_bytes_in_total').get(msg_type, 0) / 1024:>10.1f}"
+                                  f"{by_type('pychat_messages_out_total').get(msg_type, 0):>10}"
+                                  f"{by_type('pychat_bytes_out_total').get(msg_type, 0) / 1024:>10.1f}"
+                                  f"{p50:>9}{p99:>9}")
+        return None
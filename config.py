@@ -3,4 +3,61 @@ APP_VERSION = '1.0.0'
 APP_AUTHOR = 'Eelco Greidanus'
 
 SERVER_HOST = '0.0.0.0'
-SERVER_PORT = 8888
\ No newline at end of file
+SERVER_PORT = 8888
+SERVER_BACKLOG = 128
+SERVER_REUSE_PORT = False
+
+# Worker processes sharing SERVER_PORT through SO_REUSEPORT (1 = single process). Workers exchange
+# routed messages over Unix sockets in CLUSTER_SOCKET_DIR (None = a fresh temporary directory)
+SERVER_WORKERS = 1
+CLUSTER_SOCKET_DIR = None
+
+# Connection handling engine: 'threaded' (one thread per client) or 'asyncio' (single event loop)
+SERVER_ENGINE = 'threaded'
+
+# Wire encodings the server agrees to in the HELLO handshake, in order of preference
+SERVER_ENCODINGS = ['binary', 'json']
+
+# Per-client outbound queue (messages) and what to do when a client can't keep up:
+# 'drop_oldest', 'disconnect' or 'block' (wait up to SLOW_CONSUMER_BLOCK_TIMEOUT seconds, then disconnect)
+OUTBOUND_QUEUE_SIZE = 1024
+SLOW_CONSUMER_POLICY = 'drop_oldest'
+SLOW_CONSUMER_BLOCK_TIMEOUT = 5.0
+
+# Server log: minimum level shown ('debug' includes per-message traces), GUI flush tick and
+# batch size, and the window in which identical consecutive lines are collapsed
+LOG_LEVEL = 'info'
+LOG_FLUSH_INTERVAL_MS = 100
+LOG_FLUSH_BATCH_SIZE = 2000
+LOG_REPEAT_WINDOW = 1.0
+
+# Server GUI log view: lines kept in memory; older lines spill to a rotating file (None disables it)
+LOG_RETENTION_LINES = 10000
+LOG_ARCHIVE_FILE = 'server.log'
+LOG_ARCHIVE_MAX_BYTES = 10 * 1024 * 1024
+LOG_ARCHIVE_BACKUP_COUNT = 5
+
+# Headless mode: local admin console socket (None disables it; override with --admin-port)
+ADMIN_HOST = '127.0.0.1'
+ADMIN_PORT = None
+
+# Prometheus text endpoint serving the server metrics at http://METRICS_HOST:METRICS_PORT/metrics
+# (None disables it; in cluster mode the supervisor serves the merged metrics of all workers)
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = None
+
+# Store-and-forward of DMs to offline recipients: per-recipient queues of memory-mapped segment
+# files under OFFLINE_QUEUE_DIR (None disables it and such DMs are rejected). Queues are capped at
+# OFFLINE_MAX_BYTES_PER_RECIPIENT, all queues together (per worker) at OFFLINE_MAX_TOTAL_BYTES and
+# OFFLINE_MAX_RECIPIENTS, and messages older than OFFLINE_MESSAGE_TTL seconds are dropped (None keeps
+# them). Queued DMs are streamed to a reconnecting recipient in batches of OFFLINE_DELIVERY_BATCH_BYTES
+OFFLINE_QUEUE_DIR = 'offline_queue'
+OFFLINE_SEGMENT_SIZE = 1024 * 1024
+OFFLINE_MAX_BYTES_PER_RECIPIENT = 16 * 1024 * 1024
+OFFLINE_MAX_TOTAL_BYTES = 512 * 1024 * 1024
+OFFLINE_MAX_RECIPIENTS = 1000
+OFFLINE_MESSAGE_TTL = 7 * 24 * 3600
+OFFLINE_DELIVERY_BATCH_BYTES = 256 * 1024
+
+# Directory for the reports written by the profile, memory and stacks console commands
+PROFILE_REPORT_DIR = 'profiles'
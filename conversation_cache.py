@@ -0,0 +1,94 @@
+import collections
+import sys
+import threading
+
+DEFAULT_MAX_BYTES = 8 * 1024 * 1024
+
+
+class CachedConversation:
+    def __init__(self, messages, cursor):
+        self.messages = list(messages)
+        # Byte offset in the history file of the oldest cached message (see HistoryStore.read_page).
+        self.cursor = cursor
+        self.size = sum(sys.getsizeof(message) for message in self.messages)
+
+
+class ConversationCache:
+    """LRU cache of recently viewed conversations, bounded by the memory their messages use.
+
+    The receiver keeps cached conversations current through append(), so switching back to a
+    cached contact renders from memory without touching the disk.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, contact_ip):
+        """Returns (messages, cursor) for a cached conversation, or None."""
+        with self.lock:
+            entry = self.entries.get(contact_ip)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(contact_ip)
+            return list(entry.messages), entry.cursor
+
+    def put(self, contact_ip, messages, cursor):
+        with self.lock:
+            self._remove(contact_ip)
+            entry = CachedConversation(messages, cursor)
+            if entry.size > self.max_bytes:
+                return
+            self.entries[contact_ip] = entry
+            self.total_bytes += entry.size
+            self._evict()
+
+    def append(self, contact_ip, message):
+        """Adds a new message to a cached conversation; uncached conversations are left alone."""
+        with self.lock:
+            entry = self.entries.get(contact_ip)
+            if entry is None:
+                return
+            entry.messages.append(message)
+            message_size = sys.getsizeof(message)
+            entry.size += message_size
+            self.total_bytes += message_size
+            self._evict()
+
+    def prepend(self, contact_ip, messages, cursor):
+        """Adds an older page loaded from disk in front of a cached conversation."""
+        with self.lock:
+            entry = self.entries.get(contact_ip)
+            if entry is None:
+                return
+            entry.messages[:0] = messages
+            entry.cursor = cursor
+            page_size = sum(sys.getsizeof(message) for message in messages)
+            entry.size += page_size
+            self.total_bytes += page_size
+            self._evict()
+
+    def discard(self, contact_ip):
+        with self.lock:
+            self._remove(contact_ip)
+
+    def status(self):
+        with self.lock:
+            return (f"cache: {len(self.entries)} conversations, {self.total_bytes / 1024:.0f} KiB, "
+                    f"{self.hits} hits / {self.misses} misses")
+
+    def _remove(self, contact_ip):
+        entry = self.entries.pop(contact_ip, None)
+        if entry is not None:
+            self.total_bytes -= entry.size
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and self.entries:
+            _, entry = self.entries.popitem(last=False)
+            self.total_bytes -= entry.size
@@ -0,0 +1,161 @@
+import logging
+import os
+import socket
+import sys
+import threading
+
+import command_loader
+import config
+import log_pipeline
+import server
+
+
+class HeadlessServer:
+    """Runs the Server without tkinter.
+
+    Provides the same surface the commands/ plugins expect from ServerGUI. Log records are
+    written to the 'pychat.server' logger, and admin commands are read from stdin and/or a
+    line-based admin socket bound to ADMIN_HOST.
+    """
+
+    def __init__(self, use_stdin=True, admin_port=None, cluster=None, server_factory=server.create_server):
+        self.config = config
+        self.prompt = "> "
+        self.use_stdin = use_stdin
+        self.admin_port = admin_port
+        self.cluster = cluster
+
+        self.logger = logging.getLogger("pychat.server")
+        self.log_pipeline = log_pipeline.LogPipeline(
+            level=log_pipeline.parse_level(config.LOG_LEVEL),
+            repeat_window=config.LOG_REPEAT_WINDOW,
+        )
+
+        self.shutdown_event = threading.Event()
+        self.log_writer_stop = threading.Event()
+        self.command_lock = threading.Lock()
+        self.output = sys.stdout
+        self.admin_socket = None
+
+        self.log_writer_thread = threading.Thread(target=self._log_writer_thread)
+        self.log_writer_thread.daemon = True
+        self.log_writer_thread.start()
+
+        self.server = server_factory(self)
+
+        if os.getcwd() not in sys.path:
+            sys.path.append(os.getcwd())
+
+        self.commands = command_loader.load_commands("commands")
+
+    def run(self):
+        if self.admin_port is not None:
+            admin_thread = threading.Thread(target=self._admin_listener_thread)
+            admin_thread.daemon = True
+            admin_thread.start()
+
+        if self.use_stdin:
+            self._terminal_println(f"{config.APP_NAME} [Version: {config.APP_VERSION}]")
+            self._terminal_println(f"Made by {config.APP_AUTHOR}")
+            self._terminal_println("")
+            self._terminal_println("Enter help for a list of commands")
+            stdin_thread = threading.Thread(target=self._stdin_console_thread)
+            stdin_thread.daemon = True
+            stdin_thread.start()
+
+        try:
+            while not self.shutdown_event.wait(0.5):
+                pass
+        except KeyboardInterrupt:
+            self.log_output("Interrupted, shutting down server...")
+
+        self._on_closing()
+
+    def log_output(self, message, level=log_pipeline.INFO):
+        self.log_pipeline.log(message, level)
+
+    def log_enabled(self, level):
+        return self.log_pipeline.is_enabled(level)
+
+    def _log_writer_thread(self):
+        while True:
+            stopping = self.log_writer_stop.wait(self.config.LOG_FLUSH_INTERVAL_MS / 1000)
+            for timestamp, level, message in self.log_pipeline.drain():
+                self.logger.log(level, message)
+            if stopping and not self.log_pipeline.pending():
+                return
+
+    def _terminal_println(self, text):
+        self.output.write(text + "\n")
+        self.output.flush()
+
+    def clear_terminal(self):
+        self.output.write("\x1b[2J\x1b[H")
+        self.output.flush()
+
+    def request_shutdown(self):
+        self.shutdown_event.set()
+
+    def _process_command(self, command_line, output=None):
+        # Commands print through _terminal_println, so route it to the session that issued them.
+        with self.command_lock:
+            previous_output = self.output
+            self.output = output or sys.stdout
+            try:
+                result = command_loader.execute_command(self, self.commands, command_line)
+                if result is not None:
+                    self._terminal_println(str(result))
+            finally:
+                self.output = previous_output
+
+    def _stdin_console_thread(self):
+        while not self.shutdown_event.is_set():
+            sys.stdout.write(self.prompt)
+            sys.stdout.flush()
+            line = sys.stdin.readline()
+            if not line:
+                return
+            self._process_command(line)
+
+    def _admin_listener_thread(self):
+        try:
+            self.admin_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.admin_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.admin_socket.bind((self.config.ADMIN_HOST, self.admin_port))
+            self.admin_socket.listen(5)
+            self.log_output(f"Admin console listening on {self.config.ADMIN_HOST}:{self.admin_port}")
+
+            while not self.shutdown_event.is_set():
+                conn, addr = self.admin_socket.accept()
+                session_thread = threading.Thread(target=self._admin_session_thread, args=(conn, addr))
+                session_thread.daemon = True
+                session_thread.start()
+        except OSError as e:
+            if not self.shutdown_event.is_set():
+                self.log_output(f"Admin console error: {e}", log_pipeline.ERROR)
+
+    def _admin_session_thread(self, conn, addr):
+        self.log_output(f"Admin session opened from {addr[0]}:{addr[1]}")
+        try:
+            with conn, conn.makefile("r", encoding="utf-8") as reader, \
+                    conn.makefile("w", encoding="utf-8") as writer:
+                writer.write(self.prompt)
+                writer.flush()
+                for line in reader:
+                    self._process_command(line, output=writer)
+                    if self.shutdown_event.is_set():
+                        break
+                    writer.write(self.prompt)
+                    writer.flush()
+        except OSError as e:
+            self.log_output(f"Admin session error for {addr[0]}:{addr[1]}: {e}", log_pipeline.ERROR)
+        self.log_output(f"Admin session closed for {addr[0]}:{addr[1]}")
+
+    def _on_closing(self):
+        if self.server:
+            self.server.stop_server()
+        self.shutdown_event.set()
+        if self.admin_socket:
+            self.admin_socket.close()
+        self.log_writer_stop.set()
+        self.log_writer_thread.join(timeout=2)
@@ -0,0 +1,144 @@
+import glob
+import json
+import os
+import threading
+import time
+
+LEGACY_SUFFIX = ".json"
+HISTORY_SUFFIX = ".jsonl"
+READ_BLOCK_SIZE = 64 * 1024
+
+
+class HistoryStore:
+    """Per-contact chat history kept as append-only JSON Lines files.
+
+    Each line is one record {"ts": <unix time or null>, "message": <text>}, so saving a
+    message is a single append. A line cut short by a crash is skipped when reading.
+    Old chat_history_<ip>.json files (one JSON list per contact) are migrated on startup.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, contact_ip, suffix=HISTORY_SUFFIX):
+        safe_ip = contact_ip.replace('.', '_').replace(':', '-')
+        return os.path.join(self.directory, f"chat_history_{safe_ip}{suffix}")
+
+    def append(self, contact_ip, message, timestamp=None):
+        self.append_many(contact_ip, [(time.time() if timestamp is None else timestamp, message)])
+
+    def append_many(self, contact_ip, records):
+        """Appends (timestamp, message) records with a single write."""
+        data = "".join(json.dumps({"ts": ts, "message": message}, ensure_ascii=False) + "\n"
+                       for ts, message in records).encode('utf-8')
+        with self.lock:
+            with open(self.path(contact_ip), 'ab+') as f:
+                # Start on a fresh line if a crash left the last record unterminated.
+                if f.seek(0, os.SEEK_END) > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        data = b"\n" + data
+                f.write(data)
+
+    def read_page(self, contact_ip, before=None, limit=100):
+        """Returns (messages, start) for the last `limit` records that end at byte offset `before`.
+
+        The file is read backwards from `before` (default: end of file) in blocks, so a page
+        costs O(page size) however long the history is. `start` is the byte offset of the
+        first returned record: pass it as `before` to get the previous page. 0 means there is
+        nothing older. Raises FileNotFoundError if there is no history.
+        """
+        with self.lock:
+            with open(self.path(contact_ip), 'rb') as f:
+                end = f.seek(0, os.SEEK_END) if before is None else before
+                pos = end
+                buffer = b""
+                # limit full lines need limit + 1 newlines unless we reach the start of the file.
+                while pos > 0 and buffer.count(b"\n") <= limit:
+                    block_size = min(READ_BLOCK_SIZE, pos)
+                    pos -= block_size
+                    f.seek(pos)
+                    buffer = f.read(block_size) + buffer
+
+        lines = []
+        offset = pos
+        segments = buffer.split(b"\n")
+        if pos > 0:
+            # The first segment is the tail of a record that belongs to an older page.
+            offset += len(segments[0]) + 1
+            segments = segments[1:]
+        for segment in segments:
+            if segment:
+                lines.append((offset, segment))
+            offset += len(segment) + 1
+
+        lines = lines[-limit:]
+        if not lines:
+            return [], 0
+        records = self._parse_lines(line.decode('utf-8', errors='replace') for _, line in lines)
+        return [record["message"] for record in records], lines[0][0]
+
+    def exists(self, contact_ip):
+        return os.path.exists(self.path(contact_ip))
+
+    def delete(self, contact_ip):
+        with self.lock:
+            for suffix in (HISTORY_SUFFIX, LEGACY_SUFFIX):
+                file_path = self.path(contact_ip, suffix)
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+
+    def rename(self, old_ip, new_ip):
+        """Moves a history to a new IP. Returns False if there was nothing to move."""
+        with self.lock:
+            old_path = self.path(old_ip)
+            if not os.path.exists(old_path):
+                return False
+            os.replace(old_path, self.path(new_ip))
+            return True
+
+    def migrate_legacy_files(self):
+        """Converts every old JSON list history to JSON Lines.
+
+        Returns (migrated, failed): the number of files converted and the paths of old files
+        that could not be read, which are left untouched.
+
+        The new file is written under a temporary name and renamed into place before the old
+        file is removed. If the old file is still there next to its .jsonl, the migration was
+        interrupted after the rename and only the removal is left to do.
+        """
+        migrated = 0
+        failed = []
+        with self.lock:
+            for legacy_path in glob.glob(os.path.join(self.directory, f"chat_history_*{LEGACY_SUFFIX}")):
+                new_path = legacy_path[:-len(LEGACY_SUFFIX)] + HISTORY_SUFFIX
+                if not os.path.exists(new_path):
+                    try:
+                        with open(legacy_path, 'r', encoding='utf-8') as f:
+                            history = json.load(f)
+                    except (OSError, ValueError):
+                        failed.append(legacy_path)
+                        continue
+
+                    temp_path = new_path + ".tmp"
+                    with open(temp_path, 'w', encoding='utf-8') as f:
+                        for message in history:
+                            f.write(json.dumps({"ts": None, "message": message}, ensure_ascii=False) + "\n")
+                    os.replace(temp_path, new_path)
+                    migrated += 1
+                os.remove(legacy_path)
+        return migrated, failed
+
+    def _parse_lines(self, lines):
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(record, dict) and "message" in record:
+                yield record
@@ -0,0 +1,97 @@
+import collections
+import threading
+import time
+
+# Same numeric values as the logging module, so records can be handed to a logging.Logger as-is.
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+LEVELS_BY_NAME = {name.lower(): level for level, name in LEVEL_NAMES.items()}
+
+
+def parse_level(name):
+    level = LEVELS_BY_NAME.get(str(name).lower())
+    if level is None:
+        raise ValueError(f"Unknown log level '{name}'. Expected one of: {', '.join(LEVELS_BY_NAME)}")
+    return level
+
+
+class LogPipeline:
+    """Thread-safe log queue: any thread can log(), one consumer drains records in batches.
+
+    Records below the current level are discarded before formatting, identical consecutive
+    lines inside repeat_window seconds are collapsed into a single "repeated N times" record,
+    and the backlog is capped at max_backlog records (oldest dropped first).
+    """
+
+    def __init__(self, level=INFO, repeat_window=1.0, max_backlog=100000):
+        self.level = level
+        self.repeat_window = repeat_window
+        self.max_backlog = max_backlog
+
+        self.records = collections.deque()
+        self.lock = threading.Lock()
+        self.dropped = 0
+
+        self.last_message = None
+        self.last_message_level = INFO
+        self.last_message_time = 0.0
+        self.repeat_count = 0
+
+    def is_enabled(self, level):
+        return level >= self.level
+
+    def set_level(self, level):
+        self.level = level
+
+    def log(self, message, level=INFO):
+        if level < self.level:
+            return
+
+        now = time.time()
+        with self.lock:
+            if message == self.last_message and now - self.last_message_time < self.repeat_window:
+                self.repeat_count += 1
+                return
+
+            self._flush_repeats()
+            self.last_message = message
+            self.last_message_level = level
+            self.last_message_time = now
+            self._append((now, level, message))
+
+    def drain(self, max_records=None):
+        with self.lock:
+            if self.repeat_count and time.time() - self.last_message_time >= self.repeat_window:
+                self._flush_repeats()
+                self.last_message = None
+
+            batch = []
+            if self.dropped:
+                batch.append((time.time(), WARNING, f"Log backlog full, dropped {self.dropped} lines."))
+                self.dropped = 0
+            while self.records and (max_records is None or len(batch) < max_records):
+                batch.append(self.records.popleft())
+        return batch
+
+    def pending(self):
+        return len(self.records)
+
+    def _flush_repeats(self):
+        if self.repeat_count:
+            self._append((time.time(), self.last_message_level, f"(last message repeated {self.repeat_count} more times)"))
+            self.repeat_count = 0
+
+    def _append(self, record):
+        if len(self.records) >= self.max_backlog:
+            self.records.popleft()
+            self.dropped += 1
+        self.records.append(record)
+
+
+def format_record(record):
+    timestamp, level, message = record
+    return time.strftime("[%H:%M:%S] ", time.localtime(timestamp)) + message
@@ -0,0 +1,127 @@
+import collections
+import logging
+import logging.handlers
+import tkinter as tk
+import tkinter.font as tkfont
+
+
+def create_archive_logger(file_path, max_bytes, backup_count):
+    """Returns a logger that appends raw lines to a size-rotated file."""
+    archive_logger = logging.getLogger("pychat.server.archive")
+    archive_logger.propagate = False
+    archive_logger.setLevel(logging.INFO)
+    if not archive_logger.handlers:
+        handler = logging.handlers.RotatingFileHandler(file_path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        archive_logger.addHandler(handler)
+    return archive_logger
+
+
+class VirtualLogView:
+    """Read-only log widget that keeps at most `retention` lines and only renders the visible window.
+
+    Lines pushed out of the ring buffer are written to `archive_logger` (if given), so memory use
+    and the cost of each update stay constant however long the server runs.
+    """
+
+    def __init__(self, master, retention, archive_logger=None, **text_options):
+        self.lines = collections.deque()
+        self.retention = retention
+        self.archive_logger = archive_logger
+
+        self.offset = 0
+        self.visible_rows = 1
+        self.follow_tail = True
+
+        self.frame = tk.Frame(master)
+        self.frame.grid_rowconfigure(0, weight=1)
+        self.frame.grid_columnconfigure(0, weight=1)
+
+        self.text = tk.Text(self.frame, **text_options)
+        self.text.grid(row=0, column=0, sticky="nsew")
+        self.text.configure(state='disabled')
+
+        self.scrollbar = tk.Scrollbar(self.frame, orient=tk.VERTICAL, command=self._on_scrollbar)
+        self.scrollbar.grid(row=0, column=1, sticky="ns")
+
+        self.line_height = tkfont.Font(font=self.text.cget("font")).metrics("linespace") or 1
+
+        self.text.bind("<Configure>", self._on_resize)
+        self.text.bind("<MouseWheel>", self._on_mousewheel)
+        self.text.bind("<Button-4>", lambda event: self._scroll_by(-3))
+        self.text.bind("<Button-5>", lambda event: self._scroll_by(3))
+
+    def grid(self, **kwargs):
+        self.frame.grid(**kwargs)
+
+    def append_lines(self, new_lines):
+        evicted = []
+        for line in new_lines:
+            if len(self.lines) >= self.retention:
+                evicted.append(self.lines.popleft())
+            self.lines.append(line)
+
+        if evicted:
+            self._archive(evicted)
+            if not self.follow_tail:
+                self.offset = max(0, self.offset - len(evicted))
+
+        self._render()
+
+    def close(self):
+        # Keep the archive complete: whatever is still only in memory goes to disk too.
+        self._archive(self.lines)
+        self.lines.clear()
+
+    def _archive(self, lines):
+        if self.archive_logger is not None and lines:
+            self.archive_logger.info("\n".join(lines))
+
+    def _max_offset(self):
+        return max(0, len(self.lines) - self.visible_rows)
+
+    def _render(self):
+        if self.follow_tail:
+            self.offset = self._max_offset()
+        else:
+            self.offset = min(self.offset, self._max_offset())
+
+        start = self.offset
+        end = min(len(self.lines), start + self.visible_rows)
+        visible = [self.lines[i] for i in range(start, end)]
+
+        self.text.configure(state='normal')
+        self.text.delete("1.0", tk.END)
+        self.text.insert(tk.END, "\n".join(visible))
+        self.text.configure(state='disabled')
+        if self.follow_tail:
+            self.text.see(tk.END)
+
+        total = len(self.lines)
+        if total:
+            self.scrollbar.set(start / total, end / total)
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def _scroll_to(self, offset):
+        self.offset = max(0, min(offset, self._max_offset()))
+        self.follow_tail = self.offset >= self._max_offset()
+        self._render()
+
+    def _scroll_by(self, rows):
+        self._scroll_to(self.offset + rows)
+        return "break"
+
+    def _on_scrollbar(self, action, amount, unit=None):
+        if action == "moveto":
+            self._scroll_to(int(float(amount) * len(self.lines)))
+        elif action == "scroll":
+            step = int(amount) * (self.visible_rows if unit == "pages" else 1)
+            self._scroll_by(step)
+
+    def _on_mousewheel(self, event):
+        return self._scroll_by(-3 if event.delta > 0 else 3)
+
+    def _on_resize(self, event):
+        self.visible_rows = max(1, event.height // self.line_height)
+        self._render()
@@ -0,0 +1,302 @@
+import bisect
+import collections
+import http.server
+import threading
+import time
+
+PROCESSING_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1)
+
+# Message types used as label values; anything a client makes up is counted as OTHER so a
+# misbehaving client cannot create unbounded label sets.
+MESSAGE_TYPES = ("DM", "BROADCAST", "HELLO", "ERROR", "SERVER_DM", "SERVER_BROADCAST")
+OTHER_TYPE = "OTHER"
+
+
+def message_type_label(msg_type):
+    return msg_type if msg_type in MESSAGE_TYPES else OTHER_TYPE
+
+
+class Counter:
+    def __init__(self, name, help_text, label_name=None):
+        self.name = name
+        self.help_text = help_text
+        self.label_name = label_name
+        self.values = collections.defaultdict(int)
+        if label_name is None:
+            # Unlabelled counters are reported as 0 before their first increment.
+            self.values[""] = 0
+        self.lock = threading.Lock()
+
+    def inc(self, label="", amount=1):
+        with self.lock:
+            self.values[label] += amount
+
+    def collect(self):
+        with self.lock:
+            return dict(self.values)
+
+
+class Gauge:
+    """Value read from the server when collected; fn returns a number or a {label: number} dict."""
+
+    def __init__(self, name, help_text, fn, label_name=None, merge="sum"):
+        self.name = name
+        self.help_text = help_text
+        self.fn = fn
+        self.label_name = label_name
+        self.merge = merge
+
+    def collect(self):
+        value = self.fn()
+        return dict(value) if isinstance(value, dict) else {"": value}
+
+
+class Histogram:
+    def __init__(self, name, help_text, bounds, label_name=None):
+        self.name = name
+        self.help_text = help_text
+        self.bounds = list(bounds)
+        self.label_name = label_name
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, label=""):
+        index = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            entry = self.values.get(label)
+            if entry is None:
+                entry = self.values[label] = {"buckets": [0] * (len(self.bounds) + 1), "sum": 0.0, "count": 0}
+            entry["buckets"][index] += 1
+            entry["sum"] += value
+            entry["count"] += 1
+
+    def collect(self):
+        with self.lock:
+            return {label: {"buckets": list(entry["buckets"]), "sum": entry["sum"], "count": entry["count"]}
+                    for label, entry in self.values.items()}
+
+
+class RateMeter:
+    """Events per second over the last window seconds, kept in one-second buckets."""
+
+    def __init__(self, window=60):
+        self.window = window
+        self.buckets = collections.deque()
+        self.lock = threading.Lock()
+
+    def mark(self):
+        second = int(time.monotonic())
+        with self.lock:
+            if self.buckets and self.buckets[-1][0] == second:
+                self.buckets[-1][1] += 1
+            else:
+                self.buckets.append([second, 1])
+            self._expire(second)
+
+    def rate(self):
+        second = int(time.monotonic())
+        with self.lock:
+            self._expire(second)
+            return sum(count for _, count in self.buckets) / self.window
+
+    def _expire(self, second):
+        while self.buckets and self.buckets[0][0] <= second - self.window:
+            self.buckets.popleft()
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help_text, label_name=None):
+        return self._register(Counter(name, help_text, label_name))
+
+    def gauge(self, name, help_text, fn, label_name=None, merge="sum"):
+        return self._register(Gauge(name, help_text, fn, label_name, merge))
+
+    def histogram(self, name, help_text, bounds, label_name=None):
+        return self._register(Histogram(name, help_text, bounds, label_name))
+
+    def _register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def snapshot(self):
+        """Returns every metric as plain JSON-serialisable data, keyed by metric name."""
+        snapshot = {}
+        for metric in self.metrics:
+            entry = {"help": metric.help_text, "label": metric.label_name, "values": metric.collect()}
+            if isinstance(metric, Counter):
+                entry["type"] = "counter"
+            elif isinstance(metric, Gauge):
+                entry["type"] = "gauge"
+                entry["merge"] = metric.merge
+            else:
+                entry["type"] = "histogram"
+                entry["bounds"] = metric.bounds
+            snapshot[metric.name] = entry
+        return snapshot
+
+
+def merge_snapshots(snapshots):
+    """Combines the snapshots of several workers into one, e.g. for the cluster supervisor."""
+    merged = {}
+    for snapshot in snapshots:
+        for name, entry in snapshot.items():
+            target = merged.get(name)
+            if target is None:
+                merged[name] = {key: value for key, value in entry.items() if key != "values"}
+                merged[name]["values"] = {}
+                target = merged[name]
+            for label, value in entry["values"].items():
+                current = target["values"].get(label)
+                if current is None:
+                    target["values"][label] = value
+                elif entry["type"] == "histogram":
+                    current["buckets"] = [a + b for a, b in zip(current["buckets"], value["buckets"])]
+                    current["sum"] += value["sum"]
+                    current["count"] += value["count"]
+                elif entry.get("merge") == "max":
+                    target["values"][label] = max(current, value)
+                else:
+                    target["values"][label] = current + value
+    return merged
+
+
+def histogram_quantile(bounds, buckets, quantile):
+    """Estimates a quantile from bucket counts, interpolating inside the bucket it falls in."""
+    total = sum(buckets)
+    if not total:
+        return None
+    rank = quantile * total
+    seen = 0
+    for index, count in enumerate(buckets):
+        if seen + count >= rank and count:
+            lower = bounds[index - 1] if index > 0 else 0.0
+            if index >= len(bounds):
+                return lower
+            return lower + (bounds[index] - lower) * (rank - seen) / count
+        seen += count
+    return bounds[-1]
+
+
+def _prometheus_labels(label_name, label, extra=None):
+    pairs = []
+    if label_name and label != "":
+        pairs.append(f'{label_name}="{label}"')
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def render_prometheus(snapshot):
+    lines = []
+    for name, entry in snapshot.items():
+        label_name = entry["label"]
+        lines.append(f"# HELP {name} {entry['help']}")
+        lines.append(f"# TYPE {name} {entry['type']}")
+        for label, value in sorted(entry["values"].items()):
+            if entry["type"] != "histogram":
+                lines.append(f"{name}{_prometheus_labels(label_name, label)} {value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(entry["bounds"] + ["+Inf"], value["buckets"]):
+                cumulative += count
+                bucket_label = f'le="{bound}"'
+                lines.append(f"{name}_bucket{_prometheus_labels(label_name, label, bucket_label)} {cumulative}")
+            lines.append(f"{name}_sum{_prometheus_labels(label_name, label)} {value['sum']}")
+            lines.append(f"{name}_count{_prometheus_labels(label_name, label)} {value['count']}")
+    return "\n".join(lines) + "\n"
+
+
+class ServerMetrics:
+    """The metrics one Server keeps; routing code calls the count_*/observe_* methods."""
+
+    def __init__(self, server):
+        self.server = server
+        self.started = time.monotonic()
+        self.accept_meter = RateMeter()
+        self.registry = MetricsRegistry()
+        registry = self.registry
+
+        self.messages_in = registry.counter("pychat_messages_in_total", "Frames received from clients.", "type")
+        self.bytes_in = registry.counter("pychat_bytes_in_total", "Frame payload bytes received from clients.", "type")
+        self.messages_out = registry.counter("pychat_messages_out_total", "Frames queued to clients.", "type")
+        self.bytes_out = registry.counter("pychat_bytes_out_total", "Frame bytes queued to clients.", "type")
+        self.dm_misses = registry.counter("pychat_dm_misses_total", "DMs whose recipient was not connected.")
+        self.send_errors = registry.counter("pychat_send_errors_total", "Failed sends to clients.")
+        self.accepted = registry.counter("pychat_connections_accepted_total", "Accepted client connections.")
+        self.relays_dropped = registry.counter("pychat_cluster_relays_dropped_total",
+                                               "Broadcasts that could not be relayed to another worker.")
+        self.offline_stored = registry.counter("pychat_offline_dms_stored_total", "DMs queued for offline recipients.")
+        self.offline_delivered = registry.counter("pychat_offline_dms_delivered_total", "Queued DMs delivered after the recipient connected.")
+        self.processing = registry.histogram("pychat_message_processing_seconds",
+                                             "Time spent routing one received frame.", PROCESSING_BUCKETS, "type")
+        registry.gauge("pychat_active_connections", "Currently connected clients.",
+                       lambda: len(self.server.connections))
+        registry.gauge("pychat_accept_rate", "Accepted connections per second over the last minute.",
+                       self.accept_meter.rate)
+        registry.gauge("pychat_outbound_queue_messages", "Frames waiting in all outbound queues.",
+                       lambda: sum(self._queue_depths()))
+        registry.gauge("pychat_outbound_queue_max", "Longest outbound queue of a single client.",
+                       lambda: max(self._queue_depths(), default=0), merge="max")
+        registry.gauge("pychat_offline_recipients", "Recipients with queued offline DMs.",
+                       lambda: self.server.offline.pending_count() if self.server.offline is not None else 0)
+        registry.gauge("pychat_uptime_seconds", "Seconds since the server started.",
+                       lambda: time.monotonic() - self.started, merge="max")
+
+    def _queue_depths(self):
+        return [conn.queue_depth() for conn in list(self.server.connections.values())]
+
+    def count_accept(self):
+        self.accepted.inc()
+        self.accept_meter.mark()
+
+    def count_in(self, msg_type, size):
+        label = message_type_label(msg_type)
+        self.messages_in.inc(label)
+        self.bytes_in.inc(label, size)
+
+    def count_out(self, msg_type, size):
+        label = message_type_label(msg_type)
+        self.messages_out.inc(label)
+        self.bytes_out.inc(label, size)
+
+    def observe_processing(self, msg_type, seconds):
+        self.processing.observe(seconds, message_type_label(msg_type))
+
+    def snapshot(self):
+        return self.registry.snapshot()
+
+
+class MetricsEndpoint:
+    """Serves snapshot_fn() in the Prometheus text format on http://host:port/metrics."""
+
+    def __init__(self, host, port, snapshot_fn):
+        endpoint = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = render_prometheus(endpoint.snapshot_fn()).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.snapshot_fn = snapshot_fn
+        self.httpd = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="metrics")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
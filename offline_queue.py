@@ -0,0 +1,354 @@
+import collections
+import ipaddress
+import json
+import mmap
+import os
+import shutil
+import struct
+import threading
+import time
+
+RECORD_HEADER = struct.Struct("!I")
+SEGMENT_SUFFIX = ".seg"
+CURSOR_FILE = "cursor"
+# Recipient queues keep up to two segments mapped; only this many queues stay open at once.
+MAX_OPEN_QUEUES = 64
+
+
+class OfflineQueueFull(Exception):
+    pass
+
+
+class Segment:
+    """One preallocated, memory-mapped segment file of length-prefixed records.
+
+    The preallocated space is zero, so a zero length marks the end of the records. A record's
+    body is written before its length, so a record torn by a crash is never seen.
+    """
+
+    def __init__(self, path, size=None):
+        self.path = path
+        if size is not None:
+            with open(path, "w+b") as f:
+                f.truncate(size)
+        with open(path, "r+b") as f:
+            self.map = mmap.mmap(f.fileno(), 0)
+        self.size = len(self.map)
+        self.write_offset = 0
+        self.last_offset = None
+        while self.write_offset + RECORD_HEADER.size <= self.size:
+            (length,) = RECORD_HEADER.unpack_from(self.map, self.write_offset)
+            if length == 0 or self.write_offset + RECORD_HEADER.size + length > self.size:
+                break
+            self.last_offset = self.write_offset
+            self.write_offset += RECORD_HEADER.size + length
+
+    def append(self, payload):
+        end = self.write_offset + RECORD_HEADER.size + len(payload)
+        if end > self.size:
+            return False
+        self.map[self.write_offset + RECORD_HEADER.size:end] = payload
+        RECORD_HEADER.pack_into(self.map, self.write_offset, len(payload))
+        self.last_offset = self.write_offset
+        self.write_offset = end
+        return True
+
+    def last_record(self):
+        if self.last_offset is None:
+            return None
+        (length,) = RECORD_HEADER.unpack_from(self.map, self.last_offset)
+        start = self.last_offset + RECORD_HEADER.size
+        return self.map[start:start + length]
+
+    def read(self, offset, max_bytes):
+        """Returns (payloads, next_offset) for the records from offset on, at least one if any."""
+        payloads = []
+        total = 0
+        while offset < self.write_offset and (not payloads or total < max_bytes):
+            (length,) = RECORD_HEADER.unpack_from(self.map, offset)
+            start = offset + RECORD_HEADER.size
+            payloads.append(self.map[start:start + length])
+            total += length
+            offset = start + length
+        return payloads, offset
+
+    def close(self):
+        self.map.close()
+
+
+class RecipientQueue:
+    """Append-only FIFO of one recipient, stored as numbered segment files plus a read cursor.
+
+    Segments the cursor has moved past are deleted (compaction), and once everything is read
+    the whole directory is removed. At most the tail (writer) and head (reader) segments are
+    mapped, whatever the size of the backlog.
+    """
+
+    def __init__(self, directory, segment_size, max_segments):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        os.makedirs(directory, exist_ok=True)
+
+        self.segment_ids = sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(directory)
+                                  if name.endswith(SEGMENT_SUFFIX))
+        self.tail = None
+        self.head = None
+        self.cursor = self._load_cursor()
+
+    def _segment_path(self, segment_id):
+        return os.path.join(self.directory, f"{segment_id:08d}{SEGMENT_SUFFIX}")
+
+    def _load_cursor(self):
+        first = (self.segment_ids[0], 0) if self.segment_ids else (1, 0)
+        try:
+            with open(os.path.join(self.directory, CURSOR_FILE), "r", encoding="utf-8") as f:
+                data = json.load(f)
+            cursor = (int(data["segment"]), int(data["offset"]))
+        except (OSError, ValueError, KeyError, TypeError):
+            return first
+        return cursor if cursor >= first else first
+
+    def _save_cursor(self):
+        path = os.path.join(self.directory, CURSOR_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"segment": self.cursor[0], "offset": self.cursor[1]}, f)
+        os.replace(path + ".tmp", path)
+
+    def _tail_segment(self):
+        if self.tail is None and self.segment_ids:
+            self.tail = self._open(self.segment_ids[-1])
+        return self.tail
+
+    def _open(self, segment_id):
+        if self.head is not None and self.head.path == self._segment_path(segment_id):
+            return self.head
+        if self.tail is not None and self.tail.path == self._segment_path(segment_id):
+            return self.tail
+        return Segment(self._segment_path(segment_id))
+
+    def append(self, payload, may_add_segment=True):
+        if RECORD_HEADER.size + len(payload) > self.segment_size:
+            raise OfflineQueueFull("Message is larger than an offline queue segment.")
+        tail = self._tail_segment()
+        if tail is not None and tail.append(payload):
+            return
+        if len(self.segment_ids) >= self.max_segments:
+            raise OfflineQueueFull("Offline queue for this recipient is full.")
+        if not may_add_segment:
+            raise OfflineQueueFull("Offline queue storage is full.")
+        segment_id = self.segment_ids[-1] + 1 if self.segment_ids else self.cursor[0]
+        if tail is not None and tail is not self.head:
+            tail.close()
+        self.tail = Segment(self._segment_path(segment_id), self.segment_size)
+        self.segment_ids.append(segment_id)
+        self.tail.append(payload)
+
+    def newest(self):
+        """Returns the payload of the most recently appended record, or None."""
+        tail = self._tail_segment()
+        return tail.last_record() if tail is not None else None
+
+    def is_empty(self):
+        if not self.segment_ids:
+            return True
+        tail = self._tail_segment()
+        return self.cursor >= (self.segment_ids[-1], tail.write_offset)
+
+    def read(self, max_bytes):
+        """Returns (payloads, position) without consuming them; pass position to commit()."""
+        segment_id, offset = self.cursor
+        while segment_id in self.segment_ids:
+            if self.head is None or self.head.path != self._segment_path(segment_id):
+                if self.head is not None and self.head is not self.tail:
+                    self.head.close()
+                self.head = self._open(segment_id)
+            payloads, next_offset = self.head.read(offset, max_bytes)
+            if payloads:
+                return payloads, (segment_id, next_offset)
+            if segment_id == self.segment_ids[-1]:
+                break
+            # This segment is exhausted; continue at the start of the next one.
+            segment_id, offset = self.segment_ids[self.segment_ids.index(segment_id) + 1], 0
+        return [], (segment_id, offset)
+
+    def commit(self, position):
+        """Marks everything before position as delivered and drops segments no longer needed."""
+        self.cursor = position
+        if self.is_empty():
+            self.delete()
+            return
+        while self.segment_ids and self.segment_ids[0] < position[0]:
+            segment_id = self.segment_ids.pop(0)
+            for segment in (self.head, self.tail):
+                if segment is not None and segment.path == self._segment_path(segment_id):
+                    segment.close()
+            if self.head is not None and self.head.path == self._segment_path(segment_id):
+                self.head = None
+            os.remove(self._segment_path(segment_id))
+        self._save_cursor()
+
+    def close(self):
+        for segment in {id(s): s for s in (self.head, self.tail) if s is not None}.values():
+            segment.close()
+        self.head = self.tail = None
+
+    def delete(self):
+        self.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.segment_ids = []
+        self.cursor = (1, 0)
+
+
+class OfflineQueue:
+    """Undelivered DMs of every offline recipient, persisted under directory.
+
+    store() appends to the recipient's queue; a delivery thread reads it back in batches with
+    read() and confirms with commit(). begin_delivery()/end_delivery() make sure only one
+    delivery runs per recipient. Memory and disk stay bounded: at most max_recipients queues
+    of whole segments, max_total_bytes of segments altogether, and messages older than ttl
+    seconds are dropped by expire() or skipped on delivery.
+    """
+
+    def __init__(self, directory, segment_size, max_bytes_per_recipient, max_total_bytes=None,
+                 max_recipients=None, ttl=None):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_segments = max(1, max_bytes_per_recipient // segment_size)
+        self.max_total_segments = max(1, max_total_bytes // segment_size) if max_total_bytes is not None else None
+        self.max_recipients = max_recipients
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.open_queues = collections.OrderedDict()
+        self.delivering = set()
+        self.closed = False
+
+        os.makedirs(directory, exist_ok=True)
+        self.pending = set()
+        self.total_segments = 0
+        for name in os.listdir(directory):
+            recipient = self._recipient_from_name(name)
+            path = os.path.join(directory, name)
+            if recipient is not None and os.path.isdir(path):
+                self.pending.add(recipient)
+                self.total_segments += sum(1 for entry in os.listdir(path) if entry.endswith(SEGMENT_SUFFIX))
+
+    def _queue_name(self, recipient):
+        return recipient.replace(":", "_")
+
+    def _recipient_from_name(self, name):
+        try:
+            return str(ipaddress.ip_address(name.replace("_", ":")))
+        except ValueError:
+            return None
+
+    def _queue(self, recipient):
+        queue = self.open_queues.get(recipient)
+        if queue is not None:
+            self.open_queues.move_to_end(recipient)
+            return queue
+        queue = RecipientQueue(os.path.join(self.directory, self._queue_name(recipient)),
+                               self.segment_size, self.max_segments)
+        self.open_queues[recipient] = queue
+        while len(self.open_queues) > MAX_OPEN_QUEUES:
+            _, evicted = self.open_queues.popitem(last=False)
+            evicted.close()
+        return queue
+
+    def _drop(self, recipient):
+        queue = self._queue(recipient)
+        self.total_segments -= len(queue.segment_ids)
+        queue.delete()
+        self.open_queues.pop(recipient, None)
+        self.pending.discard(recipient)
+
+    def store(self, recipient, sender_ip, message):
+        """Queues a DM for recipient and returns True if it starts a new backlog.
+
+        Raises OfflineQueueFull or ValueError (invalid recipient).
+        """
+        recipient = str(ipaddress.ip_address(recipient))
+        payload = json.dumps({"sender_ip": sender_ip, "message": message, "queued_at": time.time()}).encode("utf-8")
+        with self.lock:
+            new_backlog = recipient not in self.pending
+            if new_backlog and self.max_recipients is not None and len(self.pending) >= self.max_recipients:
+                raise OfflineQueueFull("Too many recipients have queued offline DMs.")
+            queue = self._queue(recipient)
+            segments = len(queue.segment_ids)
+            may_add_segment = self.max_total_segments is None or self.total_segments < self.max_total_segments
+            try:
+                queue.append(payload, may_add_segment)
+            except OfflineQueueFull:
+                if new_backlog:
+                    self._drop(recipient)
+                raise
+            self.total_segments += len(queue.segment_ids) - segments
+            self.pending.add(recipient)
+        return new_backlog
+
+    def is_expired(self, message):
+        return self.ttl is not None and message.get("queued_at", 0) < time.time() - self.ttl
+
+    def expire(self):
+        """Deletes the queues whose newest message is older than the TTL. Returns how many were deleted."""
+        if self.ttl is None:
+            return 0
+        expired = 0
+        for recipient in list(self.pending):
+            with self.lock:
+                if self.closed:
+                    break
+                if recipient not in self.pending or recipient in self.delivering:
+                    continue
+                newest = self._queue(recipient).newest()
+                if newest is not None and not self.is_expired(json.loads(bytes(newest))):
+                    continue
+                self._drop(recipient)
+                expired += 1
+        return expired
+
+    def has_pending(self, recipient):
+        return recipient in self.pending
+
+    def pending_count(self):
+        return len(self.pending)
+
+    def read(self, recipient, max_bytes):
+        """Returns (messages, position); messages are dicts with sender_ip, message and queued_at."""
+        with self.lock:
+            if recipient not in self.pending:
+                return [], None
+            queue = self._queue(recipient)
+            payloads, position = queue.read(max_bytes)
+            if not payloads and queue.is_empty():
+                # e.g. a queue directory left without segments by an interrupted cleanup
+                self._drop(recipient)
+        return [json.loads(bytes(payload)) for payload in payloads], position
+
+    def commit(self, recipient, position):
+        with self.lock:
+            queue = self._queue(recipient)
+            segments = len(queue.segment_ids)
+            queue.commit(position)
+            self.total_segments -= segments - len(queue.segment_ids)
+            if queue.is_empty():
+                self.pending.discard(recipient)
+                self.open_queues.pop(recipient, None)
+
+    def begin_delivery(self, recipient):
+        with self.lock:
+            if recipient in self.delivering or recipient not in self.pending:
+                return False
+            self.delivering.add(recipient)
+            return True
+
+    def end_delivery(self, recipient):
+        with self.lock:
+            self.delivering.discard(recipient)
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            for queue in self.open_queues.values():
+                queue.close()
+            self.open_queues.clear()
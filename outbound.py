@@ -0,0 +1,137 @@
+import collections
+import threading
+import time
+
+import protocol
+
+POLICY_DROP_OLDEST = "drop_oldest"
+POLICY_DISCONNECT = "disconnect"
+POLICY_BLOCK = "block"
+SLOW_CONSUMER_POLICIES = (POLICY_DROP_OLDEST, POLICY_DISCONNECT, POLICY_BLOCK)
+
+# Upper bound for a single coalesced sendall() issued by a writer.
+MAX_WRITE_BATCH_BYTES = 256 * 1024
+
+
+class SlowConsumerError(OSError):
+    """Raised when a client's outbound queue is full and the slow-consumer policy disconnects it."""
+    pass
+
+
+def drop_oldest_unconfirmed(queue):
+    """Removes the oldest (data, on_written) entry that has no on_written callback. Returns False if there is none."""
+    for index, (_, on_written) in enumerate(queue):
+        if on_written is None:
+            del queue[index]
+            return True
+    return False
+
+
+def notify_written(entries, written):
+    for _, on_written in entries:
+        if on_written is not None:
+            on_written(written)
+
+
+class ClientConnection:
+    """Socket wrapper with a bounded outbound queue drained by a dedicated writer thread.
+
+    Routing code calls sendall() exactly like on a socket, but the call only enqueues the
+    frame, so one client with a full receive window can no longer stall the sender. An entry
+    given an on_written callback is never dropped by POLICY_DROP_OLDEST; the callback gets
+    True once the entry was written to the socket and False if it never will be.
+    """
+
+    def __init__(self, sock, addr, max_queue, policy, block_timeout, on_error):
+        self.sock = sock
+        self.addr = addr
+        self.max_queue = max_queue
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.on_error = on_error
+
+        self.encoding = protocol.ENCODING_JSON
+        self.queue = collections.deque()
+        self.cond = threading.Condition()
+        self.closed = False
+        self.dropped_messages = 0
+
+        self.writer_thread = threading.Thread(target=self._writer_loop)
+        self.writer_thread.daemon = True
+        self.writer_thread.start()
+
+    def sendall(self, data, on_written=None):
+        with self.cond:
+            if self.closed:
+                raise SlowConsumerError(f"Connection to {self.addr[0]} is closed.")
+
+            if len(self.queue) >= self.max_queue:
+                if self.policy == POLICY_DROP_OLDEST:
+                    if drop_oldest_unconfirmed(self.queue):
+                        self.dropped_messages += 1
+                elif self.policy == POLICY_BLOCK:
+                    deadline = time.monotonic() + self.block_timeout
+                    while len(self.queue) >= self.max_queue and not self.closed:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise SlowConsumerError(f"Outbound queue for {self.addr[0]} stayed full for {self.block_timeout}s.")
+                        self.cond.wait(remaining)
+                    if self.closed:
+                        raise SlowConsumerError(f"Connection to {self.addr[0]} is closed.")
+                else:
+                    raise SlowConsumerError(f"Outbound queue for {self.addr[0]} is full ({self.max_queue} messages).")
+
+            self.queue.append((data, on_written))
+            self.cond.notify_all()
+
+    def queue_depth(self):
+        return len(self.queue)
+
+    def _writer_loop(self):
+        while True:
+            with self.cond:
+                while not self.queue and not self.closed:
+                    self.cond.wait()
+                if self.closed:
+                    notify_written(self.queue, False)
+                    self.queue.clear()
+                    return
+
+                batch = []
+                batch_size = 0
+                while self.queue and batch_size < MAX_WRITE_BATCH_BYTES:
+                    entry = self.queue.popleft()
+                    batch.append(entry)
+                    batch_size += len(entry[0])
+                self.cond.notify_all()
+
+            try:
+                self.sock.sendall(b"".join(data for data, _ in batch))
+            except OSError as e:
+                notify_written(batch, False)
+                if not self.closed:
+                    self.on_error(self, e)
+                return
+            notify_written(batch, True)
+
+    def shutdown(self, how):
+        with self.cond:
+            self.closed = True
+            notify_written(self.queue, False)
+            self.queue.clear()
+            self.cond.notify_all()
+        self.sock.shutdown(how)
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self.sock.close()
+
+    # recv() stays on the handler thread and goes straight to the socket.
+    def recv(self, bufsize):
+        return self.sock.recv(bufsize)
+
+    def fileno(self):
+        return self.sock.fileno()
+
@@ -0,0 +1,47 @@
+import collections
+import json
+import os
+
+
+class Outbox:
+    """Bounded FIFO of messages sent while offline, kept on disk through the persistence worker.
+
+    Messages are flushed in order once the connection is back; put() refuses new messages
+    when max_messages are already waiting.
+    """
+
+    def __init__(self, file_path, persistence, max_messages=500):
+        self.file_path = file_path
+        self.persistence = persistence
+        self.max_messages = max_messages
+        self.messages = collections.deque()
+
+    def load(self):
+        if os.path.exists(self.file_path):
+            with open(self.file_path, "r", encoding="utf-8") as f:
+                self.messages = collections.deque(json.load(f)[-self.max_messages:])
+
+    def put(self, message_data):
+        if len(self.messages) >= self.max_messages:
+            return False
+        self.messages.append(message_data)
+        self._save()
+        return True
+
+    def peek(self):
+        return self.messages[0]
+
+    def pop(self):
+        message_data = self.messages.popleft()
+        self._save()
+        return message_data
+
+    def remove(self, message_data):
+        self.messages.remove(message_data)
+        self._save()
+
+    def __len__(self):
+        return len(self.messages)
+
+    def _save(self):
+        self.persistence.save_json(self.file_path, list(self.messages))
@@ -0,0 +1,208 @@
+import collections
+import json
+import os
+import queue
+import threading
+import time
+
+COALESCE_WINDOW = 0.25
+
+
+def write_atomic(file_path, text):
+    """Writes text to a temporary file next to file_path and renames it into place."""
+    temp_path = file_path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, file_path)
+
+
+class PersistenceWorker:
+    """Background thread that performs the client's disk writes.
+
+    Callers only enqueue write intents and never wait for the disk. History appends are
+    batched per contact, repeated saves of the same JSON file within coalesce_window seconds
+    collapse into one atomic write of the latest snapshot, and history deletes/renames are
+    applied in order with the appends around them. Failures are reported through on_error.
+
+    on_history_appended(contact_ip, messages) and on_history_removed(contact_ip) run right
+    after the file changes, under history_lock; hold that lock while reading a history to
+    mirror it elsewhere and the copy cannot miss or repeat a write. pending_messages() and
+    has_pending_change() read under the same lock tell what is queued but not yet written.
+    """
+
+    def __init__(self, history, coalesce_window=COALESCE_WINDOW, on_error=None,
+                 on_history_appended=None, on_history_removed=None):
+        self.history = history
+        self.coalesce_window = coalesce_window
+        self.on_error = on_error
+        self.on_history_appended = on_history_appended
+        self.on_history_removed = on_history_removed
+        self.history_lock = threading.Lock()
+
+        self.queue = queue.Queue()
+        self.pending_saves = {}
+        self.pending_history = collections.Counter()
+        # Messages of queued appends, per contact, in the order they will be written.
+        self.pending_appends = {}
+        self.pending_lock = threading.Lock()
+
+        self.thread = threading.Thread(target=self._run, name="persistence")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def append_history(self, contact_ip, message):
+        self._put_history(("append", contact_ip, (time.time(), message)), contact_ip)
+
+    def delete_history(self, contact_ip):
+        self._put_history(("delete", contact_ip, None), contact_ip)
+
+    def rename_history(self, old_ip, new_ip):
+        self._put_history(("rename", old_ip, new_ip), old_ip, new_ip)
+
+    def save_json(self, file_path, data):
+        """Schedules an atomic write of data. Pass a snapshot (e.g. list(items)), not a live object."""
+        self.queue.put(("save", file_path, data))
+
+    def pending_messages(self, contact_ip):
+        """Returns the messages queued for a history that are not written yet, oldest first."""
+        with self.pending_lock:
+            return list(self.pending_appends.get(contact_ip, ()))
+
+    def has_pending_change(self, contact_ip):
+        """True while a delete or rename of the history is queued."""
+        with self.pending_lock:
+            return self.pending_history[contact_ip] > len(self.pending_appends.get(contact_ip, ()))
+
+    def call_when_written(self, callback):
+        """Runs callback on the worker thread once everything queued so far is on disk."""
+        self.queue.put(("call", None, callback))
+
+    def flush(self, timeout=None):
+        """Waits until everything queued so far is on disk. Returns False on timeout."""
+        done = threading.Event()
+        self.queue.put(("flush", None, done))
+        return done.wait(timeout)
+
+    def stop(self, timeout=5):
+        done = threading.Event()
+        self.queue.put(("stop", None, done))
+        done.wait(timeout)
+
+    def _put_history(self, intent, *contact_ips):
+        with self.pending_lock:
+            for contact_ip in contact_ips:
+                self.pending_history[contact_ip] += 1
+            if intent[0] == "append":
+                self.pending_appends.setdefault(intent[1], collections.deque()).append(intent[2][1])
+            # Queued under the lock so pending_appends stays in the order the appends are written.
+            self.queue.put(intent + (contact_ips,))
+
+    def _run(self):
+        while True:
+            timeout = None
+            if self.pending_saves:
+                timeout = max(0.0, min(deadline for deadline, _ in self.pending_saves.values()) - time.monotonic())
+            try:
+                batch = [self.queue.get(timeout=timeout)]
+            except queue.Empty:
+                batch = []
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            waiters = []
+            callbacks = []
+            stopping = False
+            appends = collections.OrderedDict()
+            for intent in batch:
+                kind = intent[0]
+                if kind == "append":
+                    appends.setdefault(intent[1], []).append((intent[2], intent[3]))
+                elif kind in ("delete", "rename"):
+                    # Appends queued before a delete/rename must hit the file first.
+                    self._write_appends(appends, intent[3])
+                    self._apply_history_change(intent)
+                elif kind == "save":
+                    _, file_path, data = intent
+                    deadline = self.pending_saves.get(file_path, (time.monotonic() + self.coalesce_window, None))[0]
+                    self.pending_saves[file_path] = (deadline, data)
+                elif kind == "call":
+                    callbacks.append(intent[2])
+                else:
+                    waiters.append(intent[2])
+                    stopping = stopping or kind == "stop"
+
+            self._write_appends(appends)
+            self._write_saves(force=bool(waiters))
+            for done in waiters:
+                done.set()
+            for callback in callbacks:
+                callback()
+            if stopping:
+                return
+
+    def _write_appends(self, appends, contact_ips=None):
+        for contact_ip in list(appends):
+            if contact_ips is not None and contact_ip not in contact_ips:
+                continue
+            entries = appends.pop(contact_ip)
+            records = [record for record, _ in entries]
+            with self.history_lock:
+                try:
+                    self.history.append_many(contact_ip, records)
+                    if self.on_history_appended is not None:
+                        self.on_history_appended(contact_ip, [message for _, message in records])
+                except Exception as e:
+                    self._report(f"Error saving chat history for {contact_ip}: {e}")
+                self._done_appends(contact_ip, len(records))
+            self._done_history(entry_ips for _, entry_ips in entries)
+
+    def _apply_history_change(self, intent):
+        kind, contact_ip, new_ip, contact_ips = intent
+        with self.history_lock:
+            try:
+                if kind == "delete":
+                    self.history.delete(contact_ip)
+                else:
+                    self.history.rename(contact_ip, new_ip)
+            except Exception as e:
+                self._report(f"Error updating chat history file for {contact_ip}: {e}")
+            if self.on_history_removed is not None:
+                for changed_ip in contact_ips:
+                    self.on_history_removed(changed_ip)
+        self._done_history([contact_ips])
+
+    def _done_appends(self, contact_ip, count):
+        with self.pending_lock:
+            pending = self.pending_appends[contact_ip]
+            for _ in range(count):
+                pending.popleft()
+            if not pending:
+                del self.pending_appends[contact_ip]
+
+    def _done_history(self, ip_groups):
+        with self.pending_lock:
+            for contact_ips in ip_groups:
+                for contact_ip in contact_ips:
+                    self.pending_history[contact_ip] -= 1
+                    if self.pending_history[contact_ip] <= 0:
+                        del self.pending_history[contact_ip]
+
+    def _write_saves(self, force=False):
+        now = time.monotonic()
+        for file_path, (deadline, data) in list(self.pending_saves.items()):
+            if not force and deadline > now:
+                continue
+            del self.pending_saves[file_path]
+            try:
+                write_atomic(file_path, json.dumps(data, indent=4))
+            except Exception as e:
+                self._report(f"Error saving {file_path}: {e}")
+
+    def _report(self, message):
+        if self.on_error is not None:
+            self.on_error(message)
@@ -0,0 +1,146 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import traceback
+
+import config
+
+REPORT_TOP_ENTRIES = 40
+
+
+def report_path(prefix, extension):
+    """Returns a fresh timestamped path in config.PROFILE_REPORT_DIR, creating the directory."""
+    os.makedirs(config.PROFILE_REPORT_DIR, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(config.PROFILE_REPORT_DIR, f"{prefix}-{stamp}-{os.getpid()}{extension}")
+    counter = 1
+    while os.path.exists(path):
+        path = os.path.join(config.PROFILE_REPORT_DIR, f"{prefix}-{stamp}-{os.getpid()}-{counter}{extension}")
+        counter += 1
+    return path
+
+
+# Python 3.12 moved cProfile onto sys.monitoring, which allows only one enabled profiler at a time.
+PER_THREAD_PROFILES = sys.version_info < (3, 12)
+
+
+class FrameProfiler:
+    """cProfile over the processing of received frames, on whatever thread handles them.
+
+    cProfile only sees the thread that enabled it, so instead of one global profile the
+    handler loops pass each frame through runcall() while profiling is active. Before
+    Python 3.12 every handler thread gets its own profile and stop() merges them. On 3.12+
+    one profile is shared behind a lock, which serialises frame processing (including any
+    blocking send) for as long as profiling runs.
+    """
+
+    def __init__(self):
+        self.active = False
+        self.serialised = not PER_THREAD_PROFILES
+        self.profiles = []
+        self.started = None
+        self.calls = 0
+        self.running = 0
+        self.session = 0
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        self.shared_lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.active:
+                return False
+            self.profiles = []
+            self.session += 1
+            self.started = time.time()
+            self.calls = 0
+            self.active = True
+            return True
+
+    def runcall(self, fn, *args):
+        with self.lock:
+            if not self.active:
+                profile = None
+            elif self.serialised:
+                if not self.profiles:
+                    self.profiles.append(cProfile.Profile())
+                profile = self.profiles[0]
+            elif getattr(self.local, "session", None) == self.session:
+                profile = self.local.profile
+            else:
+                profile = self.local.profile = cProfile.Profile()
+                self.local.session = self.session
+                self.profiles.append(profile)
+            if profile is not None:
+                self.calls += 1
+                self.running += 1
+        if profile is None:
+            return fn(*args)
+        try:
+            if self.serialised:
+                with self.shared_lock:
+                    return profile.runcall(fn, *args)
+            return profile.runcall(fn, *args)
+        finally:
+            with self.lock:
+                self.running -= 1
+                if not self.running:
+                    self.idle.notify_all()
+
+    def stop(self, sort_by="cumulative"):
+        """Stops profiling and writes a .prof file and a text summary. Returns (prof_path, text_path, frames)."""
+        with self.lock:
+            if not self.active:
+                return None
+            self.active = False
+            # Profiles still inside runcall() cannot be read yet; new frames are no longer profiled.
+            while self.running:
+                self.idle.wait()
+            profiles, self.profiles = self.profiles, []
+
+        prof_path = report_path("profile", ".prof")
+        text_path = prof_path[:-len(".prof")] + ".txt"
+        output = io.StringIO()
+        output.write(f"Frames profiled: {self.calls} in {time.time() - self.started:.1f} s "
+                     f"on {len(profiles)} thread(s)\n\n")
+        stats = None
+        for profile in profiles:
+            try:
+                if stats is None:
+                    stats = pstats.Stats(profile, stream=output)
+                else:
+                    stats.add(profile)
+            except TypeError:
+                # A profile that never recorded a call has no stats.
+                continue
+        if stats is None:
+            output.write("No frames were processed while profiling.\n")
+            cProfile.Profile().dump_stats(prof_path)
+        else:
+            stats.dump_stats(prof_path)
+            stats.sort_stats(sort_by).print_stats(REPORT_TOP_ENTRIES)
+        with open(text_path, "w", encoding="utf-8") as f:
+            f.write(output.getvalue())
+        return prof_path, text_path, self.calls
+
+
+def format_thread_stacks():
+    """Returns (thread_count, report) with threads that share an identical stack grouped together."""
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    groups = {}
+    frames = sys._current_frames()
+    for ident, frame in frames.items():
+        stack = "".join(traceback.format_stack(frame))
+        groups.setdefault(stack, []).append(names.get(ident, f"thread {ident}"))
+
+    lines = [f"{len(frames)} threads in process {os.getpid()} at {time.strftime('%Y-%m-%d %H:%M:%S')}", ""]
+    for stack, thread_names in sorted(groups.items(), key=lambda item: -len(item[1])):
+        shown = ", ".join(sorted(thread_names)[:10]) + (", ..." if len(thread_names) > 10 else "")
+        lines.append(f"--- {len(thread_names)} thread(s): {shown}")
+        lines.append(stack)
+    return len(frames), "\n".join(lines)
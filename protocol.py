@@ -0,0 +1,220 @@
+import json
+import socket
+import struct
+
+# Every message on the wire is a 4 byte big-endian length followed by the payload.
+FRAME_HEADER = struct.Struct("!I")
+MAX_FRAME_SIZE = 1024 * 1024
+
+# Payload encodings. JSON is always understood; a client asks for binary with a HELLO
+# message right after connecting and the server answers with the encoding it will send.
+ENCODING_JSON = "json"
+ENCODING_BINARY = "binary"
+SUPPORTED_ENCODINGS = (ENCODING_BINARY, ENCODING_JSON)
+
+# Binary payload: type code, recipient address length, sender address length (0, 4 or 16),
+# then the packed addresses and the UTF-8 message body up to the end of the frame.
+# Type codes stay below 0x09 so a binary payload can never be confused with JSON text.
+BINARY_HEADER = struct.Struct("!BBB")
+BINARY_TYPES = {"DM": 1, "BROADCAST": 2, "SERVER_DM": 3, "SERVER_BROADCAST": 4, "ERROR": 5}
+BINARY_TYPE_NAMES = {code: name for name, code in BINARY_TYPES.items()}
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def encode_frame(payload):
+    if len(payload) > MAX_FRAME_SIZE:
+        raise ProtocolError(f"Frame of {len(payload)} bytes exceeds limit of {MAX_FRAME_SIZE} bytes.")
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+def encode_json_frame(json_data):
+    return encode_frame(json.dumps(json_data).encode('utf-8'))
+
+
+def add_envelope_field(payload, key, value):
+    """Adds key/value to a JSON object payload by splicing bytes instead of re-serializing the body.
+
+    The field is appended last, so it overrides any value the sender put in the body itself.
+    """
+    body = payload.rstrip()
+    if not body.endswith(b"}"):
+        raise ProtocolError("Payload is not a JSON object.")
+
+    field = json.dumps(key).encode('utf-8') + b": " + json.dumps(value).encode('utf-8')
+    head = body[:-1].rstrip()
+    if head.endswith(b"{"):
+        return head + field + b"}"
+    return head + b", " + field + b"}"
+
+
+def pack_ip(ip):
+    for family in (socket.AF_INET, socket.AF_INET6):
+        try:
+            return socket.inet_pton(family, ip)
+        except (OSError, TypeError):
+            continue
+    raise ProtocolError(f"'{ip}' is not an IPv4 or IPv6 address.")
+
+
+def unpack_ip(packed):
+    if len(packed) == 4:
+        return socket.inet_ntop(socket.AF_INET, packed)
+    return socket.inet_ntop(socket.AF_INET6, packed)
+
+
+def is_binary_payload(payload):
+    return len(payload) > 0 and payload[0] in BINARY_TYPE_NAMES
+
+
+def encode_binary_header(msg_type, recipient=None, sender_ip=None):
+    type_code = BINARY_TYPES.get(msg_type)
+    if type_code is None:
+        raise ProtocolError(f"Message type '{msg_type}' has no binary encoding.")
+    # Only DMs are addressed; whatever recipient a client put on other types is not forwarded.
+    recipient_bytes = pack_ip(recipient) if msg_type == "DM" and recipient else b""
+    sender_bytes = pack_ip(sender_ip) if sender_ip else b""
+    return BINARY_HEADER.pack(type_code, len(recipient_bytes), len(sender_bytes)) + recipient_bytes + sender_bytes
+
+
+def encode_binary_message(msg_type, message="", recipient=None, sender_ip=None):
+    return encode_binary_header(msg_type, recipient, sender_ip) + str(message).encode('utf-8')
+
+
+def decode_binary_header(payload):
+    """Returns (msg_type, recipient, sender_ip, body_offset) without touching the message body."""
+    if len(payload) < BINARY_HEADER.size:
+        raise ProtocolError("Binary payload is shorter than its header.")
+    type_code, recipient_len, sender_len = BINARY_HEADER.unpack_from(payload)
+    if recipient_len not in (0, 4, 16) or sender_len not in (0, 4, 16):
+        raise ProtocolError("Binary payload has an invalid address length.")
+    body_offset = BINARY_HEADER.size + recipient_len + sender_len
+    if len(payload) < body_offset:
+        raise ProtocolError("Binary payload is shorter than its header.")
+
+    msg_type = BINARY_TYPE_NAMES[type_code]
+    offset = BINARY_HEADER.size
+    recipient = unpack_ip(payload[offset:offset + recipient_len]) if recipient_len else None
+    offset += recipient_len
+    sender_ip = unpack_ip(payload[offset:offset + sender_len]) if sender_len else None
+    if recipient is None and msg_type == "BROADCAST":
+        recipient = "ALL"
+    return msg_type, recipient, sender_ip, body_offset
+
+
+def decode_binary_message(payload):
+    msg_type, recipient, sender_ip, body_offset = decode_binary_header(payload)
+    message = {"type": msg_type, "message": bytes(payload[body_offset:]).decode('utf-8', errors='replace')}
+    if recipient is not None:
+        message["recipient"] = recipient
+    if sender_ip is not None:
+        message["sender_ip"] = sender_ip
+    return message
+
+
+def encode_message(json_data, encoding=ENCODING_JSON):
+    if encoding == ENCODING_BINARY:
+        return encode_binary_message(json_data.get("type"), json_data.get("message", ""),
+                                     json_data.get("recipient"), json_data.get("sender_ip"))
+    return json.dumps(json_data).encode('utf-8')
+
+
+def encode_message_frame(json_data, encoding=ENCODING_JSON):
+    return encode_frame(encode_message(json_data, encoding))
+
+
+def decode_message(payload):
+    """Decodes a JSON or binary payload into the message dict both sides work with."""
+    if is_binary_payload(payload):
+        return decode_binary_message(payload)
+    return json.loads(payload)
+
+
+def choose_encoding(offered, supported=SUPPORTED_ENCODINGS):
+    for encoding in offered or ():
+        if encoding in supported:
+            return encoding
+    return ENCODING_JSON
+
+
+class RelayMessage:
+    """A client message being forwarded by the server.
+
+    The outgoing frame is built at most once per wire encoding and shared by every recipient.
+    JSON input is forwarded with sender_ip spliced into the original bytes and binary input
+    keeps its original body bytes, so the body is only re-encoded when the encodings differ.
+    """
+
+    def __init__(self, msg_type, recipient, sender_ip, json_payload=None, json_message=None, binary_body=None):
+        self.msg_type = msg_type
+        self.recipient = recipient
+        self.sender_ip = sender_ip
+        self.json_payload = json_payload
+        self.json_message = json_message
+        self.binary_body = binary_body
+        self.frames = {}
+
+    @property
+    def message(self):
+        if self.binary_body is not None:
+            return bytes(self.binary_body).decode('utf-8', errors='replace')
+        return self.json_message
+
+    def frame(self, encoding):
+        cached = self.frames.get(encoding)
+        if cached is not None:
+            return cached
+
+        if encoding == ENCODING_BINARY:
+            header = encode_binary_header(self.msg_type, self.recipient, self.sender_ip)
+            if self.binary_body is not None:
+                payload = header + self.binary_body
+            else:
+                payload = header + str(self.json_message if self.json_message is not None else "").encode('utf-8')
+        elif self.json_payload is not None:
+            payload = add_envelope_field(self.json_payload, "sender_ip", self.sender_ip)
+        else:
+            payload = json.dumps({"type": self.msg_type, "recipient": self.recipient,
+                                  "message": self.message, "sender_ip": self.sender_ip}).encode('utf-8')
+
+        cached = self.frames[encoding] = encode_frame(payload)
+        return cached
+
+
+class FrameDecoder:
+    """Incremental decoder that turns a stream of received bytes into complete frames.
+
+    Partial frames (including split UTF-8 sequences) are kept until the next feed().
+    """
+
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        self.max_frame_size = max_frame_size
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        self.buffer += data
+        frames = []
+        offset = 0
+        buffer_len = len(self.buffer)
+
+        while buffer_len - offset >= FRAME_HEADER.size:
+            (frame_len,) = FRAME_HEADER.unpack_from(self.buffer, offset)
+            if frame_len > self.max_frame_size:
+                self.buffer.clear()
+                raise ProtocolError(f"Frame of {frame_len} bytes exceeds limit of {self.max_frame_size} bytes.")
+
+            frame_end = offset + FRAME_HEADER.size + frame_len
+            if frame_end > buffer_len:
+                break
+
+            frames.append(bytes(self.buffer[offset + FRAME_HEADER.size:frame_end]))
+            offset = frame_end
+
+        if offset:
+            del self.buffer[:offset]
+        return frames
+
+    def pending(self):
+        return len(self.buffer)
@@ -1,13 +1,25 @@
+import argparse
+import logging
+import os
 import socket
 import threading
 import time
-import sys
-import tkinter as tk
-from tkinter import scrolledtext, messagebox, END
 import config
 import json
-import command_loader
-import os
+import log_pipeline
+import metrics
+import offline_queue
+import outbound
+import profiling
+import protocol
+
+# Results of Server._route_dm.
+DM_DELIVERED = "delivered"
+DM_NO_RECIPIENT = "no_recipient"
+DM_UNENCODABLE = "unencodable"
+# Seconds between sweeps for offline DM queues whose messages are all past OFFLINE_MESSAGE_TTL.
+OFFLINE_EXPIRY_INTERVAL = 600
+
 
 class Server:
     def __init__(self, gui):
@@ -16,12 +28,30 @@ class Server:
 
         self.running = False
         self.connections = {}
+        self.connections_by_ip = {}
+        self.connections_lock = threading.Lock()
         self.client_threads = {}
         self.client_messages = {}
         self.next_client_id = 1
 
+        self.outbound_queue_size = self.gui.config.OUTBOUND_QUEUE_SIZE
+        self.slow_consumer_block_timeout = self.gui.config.SLOW_CONSUMER_BLOCK_TIMEOUT
+        self.slow_consumer_policy = self.gui.config.SLOW_CONSUMER_POLICY
+        if self.slow_consumer_policy not in outbound.SLOW_CONSUMER_POLICIES:
+            self.gui.log_output(f"Unknown slow consumer policy '{self.slow_consumer_policy}', using '{outbound.POLICY_DROP_OLDEST}'.", log_pipeline.WARNING)
+            self.slow_consumer_policy = outbound.POLICY_DROP_OLDEST
+
+        # Set when this server is one worker of a multi-process cluster (see cluster.py).
+        self.cluster = getattr(self.gui, "cluster", None)
+
         self.server_socket = None
 
+        self.metrics = metrics.ServerMetrics(self)
+        self.metrics_endpoint = None
+        self.profiler = profiling.FrameProfiler()
+        self.offline_expiry_stop = threading.Event()
+        self.offline = self._create_offline_queue()
+
         self.setup()
 
     def setup(self):
@@ -30,19 +60,31 @@ class Server:
             return
 
         self.running = True
+        # Cluster workers report to the supervisor, which serves the endpoint for all of them.
+        if self.cluster is None:
+            self._start_metrics_endpoint(self.metrics_snapshot)
 
         self.server_thread = threading.Thread(target=self._server_listener_thread)
         self.server_thread.daemon = True
         self.server_thread.start()
 
+        if self.offline is not None and self.offline.ttl is not None:
+            expiry_thread = threading.Thread(target=self._offline_expiry_thread)
+            expiry_thread.daemon = True
+            expiry_thread.start()
+
         self.gui.log_output("Server listener thread started.")
 
     def _server_listener_thread(self):
+        if self.cluster is not None:
+            self.cluster.wait_for_peers()
         try:
             self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self.gui.config.SERVER_REUSE_PORT:
+                self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
             self.server_socket.bind((self.gui.config.SERVER_HOST, self.gui.config.SERVER_PORT))
-            self.server_socket.listen(5)
+            self.server_socket.listen(self.gui.config.SERVER_BACKLOG)
 
             self.gui.log_output(f"Server listening on {self.gui.config.SERVER_HOST}:{self.gui.config.SERVER_PORT}")
 
@@ -53,7 +95,10 @@ class Server:
                     self.next_client_id += 1
                     client_info = f"Client {client_id} ({addr[0]}:{addr[1]})"
 
-                    self.connections[addr] = conn
+                    conn = outbound.ClientConnection(conn, addr, self.outbound_queue_size, self.slow_consumer_policy,
+                                                     self.slow_consumer_block_timeout, self._on_outbound_error)
+                    self._register_connection(addr, conn)
+                    self.metrics.count_accept()
                     self.client_messages[addr] = []
                     self.gui.log_output(f"{client_info} connected.")
 
@@ -63,16 +108,16 @@ class Server:
                     self.client_threads[addr] = client_handler_thread
                 except OSError as e:
                     if self.running:
-                        self.gui.log_output(f"Accept error: {e}")
+                        self.gui.log_output(f"Accept error: {e}", log_pipeline.ERROR)
                     break
                 except Exception as e:
-                    self.gui.log_output(f"Unexpected error in accept loop: {e}")
+                    self.gui.log_output(f"Unexpected error in accept loop: {e}", log_pipeline.ERROR)
                     break
         except socket.error as e:
-            self.gui.log_output(f"Server setup error: {e}")
+            self.gui.log_output(f"Server setup error: {e}", log_pipeline.ERROR)
             self.running = False
         except Exception as e:
-            self.gui.log_output(f"General Server Error: {e}")
+            self.gui.log_output(f"General Server Error: {e}", log_pipeline.ERROR)
             self.running = False
         finally:
             if self.server_socket:
@@ -82,6 +127,7 @@ class Server:
             self.gui.log_output("Server listener stopped.")
 
     def _handle_client_thread(self, client_socket, addr, client_info):
+        decoder = protocol.FrameDecoder()
         try:
             while self.running and addr in self.connections:
                 data = client_socket.recv(8192)
@@ -89,355 +135,438 @@ class Server:
                     self.gui.log_output(f"{client_info} disconnected.")
                     break
 
-                received_raw_message = data.decode('utf-8')
-                self.gui.log_output(f"Received from {client_info}: {received_raw_message}")
-
-                sender_ip = addr[0]
-
-                try:
-                    parsed_message = json.loads(received_raw_message)
-
-                    msg_type = parsed_message.get("type")
-                    message_content = parsed_message.get("message")
-                    recipient_ip = parsed_message.get("recipient")
-
-                    parsed_message["sender_ip"] = sender_ip
-
-                    if msg_type == "DM":
-                        found_recipient = False
-                        for client_addr_tuple, client_conn_socket in list(self.connections.items()):
-                            if client_addr_tuple[0] == recipient_ip:
-                                try:
-                                    forward_json = json.dumps(parsed_message)
-                                    client_conn_socket.sendall(forward_json.encode('utf-8'))
-                                    self.gui.log_output(f"DM from {sender_ip} to {recipient_ip}: {message_content}")
-                                    found_recipient = True
-                                    break
-                                except socket.error as send_e:
-                                    self.gui.log_output(f"Error sending DM to {recipient_ip}: {send_e}")
-                                    self._cleanup_disconnected_client(client_addr_tuple)
-                        if not found_recipient:
-                            error_msg = {"type": "ERROR", "message": f"Recipient {recipient_ip} not found or offline."}
-                            self._send_json_to_client(client_socket, error_msg)
-                            self.gui.log_output(f"Recipient {recipient_ip} not found for DM from {sender_ip}")
-
-                    elif msg_type == "BROADCAST":
-                        forward_json = json.dumps(parsed_message)
-                        failed_sends = []
-                        for client_addr_tuple, client_conn_socket in list(self.connections.items()):
-                            if client_addr_tuple[0] != sender_ip:
-                                try:
-                                    client_conn_socket.sendall(forward_json.encode('utf-8'))
-                                    self.gui.log_output(f"Broadcast from {sender_ip} to {client_addr_tuple[0]}: {message_content}")
-                                except socket.error as send_e:
-                                    self.gui.log_output(f"Error broadcasting to {client_addr_tuple[0]}: {send_e}")
-                                    failed_sends.append(client_addr_tuple)
-                        for failed_addr in failed_sends:
-                            self._cleanup_disconnected_client(failed_addr)
-                        self.gui.log_output(f"Broadcast from {sender_ip}: {message_content}")
+                for frame in decoder.feed(data):
+                    if self.profiler.active:
+                        self.profiler.runcall(self._process_frame, client_socket, addr, client_info, frame)
                     else:
-                        self.gui.log_output(f"Unknown JSON type from {sender_ip}: {msg_type}")
-                        error_msg = {"type": "ERROR", "message": f"Unknown message type: {msg_type}"}
-                        self._send_json_to_client(client_socket, error_msg)
-
-                except json.JSONDecodeError:
-                    self.gui.log_output(f"Non-JSON message from {addr[0]}: {received_raw_message}")
-                    error_msg = {"type": "ERROR", "message": "Server expects JSON messages."}
-                    self._send_json_to_client(client_socket, error_msg)
-                except Exception as e:
-                    self.gui.log_output(f"Error processing message from {addr[0]}: {e}")
-                    error_msg = {"type": "ERROR", "message": "Server processing error."}
-                    self._send_json_to_client(client_socket, error_msg)
+                        self._process_frame(client_socket, addr, client_info, frame)
 
+        except protocol.ProtocolError as e:
+            self.gui.log_output(f"Protocol error from {client_info}: {e}", log_pipeline.WARNING)
         except socket.error as e:
-            self.gui.log_output(f"Client handler error for {client_info}: {e}")
+            self.gui.log_output(f"Client handler error for {client_info}: {e}", log_pipeline.ERROR)
         except Exception as e:
-            self.gui.log_output(f"Unexpected client handler error for {client_info}: {e}")
+            self.gui.log_output(f"Unexpected client handler error for {client_info}: {e}", log_pipeline.ERROR)
         finally:
             self._cleanup_disconnected_client(addr)
             self.gui.log_output(f"Handler for {client_info} terminated.")
 
+    def _process_frame(self, client_socket, addr, client_info, frame):
+        trace_enabled = self.gui.log_enabled(log_pipeline.DEBUG)
+        if trace_enabled:
+            self.gui.log_output(f"Received from {client_info}: {frame.decode('utf-8', errors='replace')}", log_pipeline.DEBUG)
+
+        sender_ip = addr[0]
+        started = time.perf_counter()
+        msg_type = None
+
+        try:
+            if protocol.is_binary_payload(frame):
+                # Binary frames: only the fixed header is parsed, the body bytes are forwarded untouched.
+                msg_type, recipient_ip, _, body_offset = protocol.decode_binary_header(frame)
+                relay = protocol.RelayMessage(msg_type, recipient_ip, sender_ip, binary_body=frame[body_offset:])
+            else:
+                parsed_message = json.loads(frame)
+                msg_type = parsed_message.get("type")
+                recipient_ip = parsed_message.get("recipient")
+
+                if msg_type == "HELLO":
+                    self._negotiate_encoding(client_socket, client_info, parsed_message)
+                    return
+
+                relay = protocol.RelayMessage(msg_type, recipient_ip, sender_ip, json_payload=frame,
+                                              json_message=parsed_message.get("message"))
+
+            if msg_type == "DM":
+                # While older DMs for the recipient are still queued, new ones queue behind them to keep the order.
+                queue_behind = self.offline is not None and self.offline.has_pending(recipient_ip)
+                status = DM_NO_RECIPIENT
+                if not queue_behind:
+                    status = self._route_dm(relay)
+                    if status == DM_NO_RECIPIENT and self.cluster is not None and self.cluster.forward_dm(relay):
+                        status = DM_DELIVERED
+                        if trace_enabled:
+                            self.gui.log_output(f"DM from {sender_ip} to {recipient_ip} forwarded to another worker: {relay.message}", log_pipeline.DEBUG)
+                    if status == DM_NO_RECIPIENT:
+                        self.metrics.dm_misses.inc()
+                if status == DM_UNENCODABLE:
+                    # The recipient is connected here, so forwarding or queueing the DM would fail the same way.
+                    error_msg = {"type": "ERROR", "message": f"Message cannot be encoded for {recipient_ip}."}
+                    self._send_json_to_client(client_socket, error_msg)
+                elif status == DM_NO_RECIPIENT and not self._store_offline_dm(client_socket, relay):
+                    error_msg = {"type": "ERROR", "message": f"Recipient {recipient_ip} not found or offline."}
+                    self._send_json_to_client(client_socket, error_msg)
+                    self.gui.log_output(f"Recipient {recipient_ip} not found for DM from {sender_ip}", log_pipeline.WARNING)
+
+            elif msg_type == "BROADCAST":
+                self._route_broadcast(relay, trace_enabled)
+                if self.cluster is not None:
+                    self.cluster.forward_broadcast(relay)
+                if trace_enabled:
+                    self.gui.log_output(f"Broadcast from {sender_ip}: {relay.message}", log_pipeline.DEBUG)
+            else:
+                self.gui.log_output(f"Unknown JSON type from {sender_ip}: {msg_type}", log_pipeline.WARNING)
+                error_msg = {"type": "ERROR", "message": f"Unknown message type: {msg_type}"}
+                self._send_json_to_client(client_socket, error_msg)
+
+        except protocol.ProtocolError as e:
+            self.gui.log_output(f"Invalid message from {addr[0]}: {e}", log_pipeline.WARNING)
+            error_msg = {"type": "ERROR", "message": f"Invalid message: {e}"}
+            self._send_json_to_client(client_socket, error_msg)
+        except json.JSONDecodeError:
+            self.gui.log_output(f"Non-JSON message from {addr[0]}: {frame.decode('utf-8', errors='replace')}", log_pipeline.WARNING)
+            error_msg = {"type": "ERROR", "message": "Server expects JSON messages."}
+            self._send_json_to_client(client_socket, error_msg)
+        except Exception as e:
+            self.gui.log_output(f"Error processing message from {addr[0]}: {e}", log_pipeline.ERROR)
+            error_msg = {"type": "ERROR", "message": "Server processing error."}
+            self._send_json_to_client(client_socket, error_msg)
+        finally:
+            # Frames that fail to parse are counted as type OTHER.
+            self.metrics.count_in(msg_type, len(frame))
+            self.metrics.observe_processing(msg_type, time.perf_counter() - started)
+
+    def _route_dm(self, relay):
+        """Delivers a DM to a locally connected recipient. Returns one of the DM_* results."""
+        status = DM_NO_RECIPIENT
+        for client_addr_tuple, client_conn_socket in self.get_connections_by_ip(relay.recipient):
+            try:
+                data = relay.frame(client_conn_socket.encoding)
+                client_conn_socket.sendall(data)
+                self.metrics.count_out("DM", len(data))
+                if self.gui.log_enabled(log_pipeline.DEBUG):
+                    self.gui.log_output(f"DM from {relay.sender_ip} to {relay.recipient}: {relay.message}", log_pipeline.DEBUG)
+                return DM_DELIVERED
+            except protocol.ProtocolError as e:
+                # Another connection of the recipient may use an encoding the message fits.
+                self.metrics.send_errors.inc()
+                self.gui.log_output(f"Cannot encode DM from {relay.sender_ip} for {client_addr_tuple[0]}: {e}", log_pipeline.WARNING)
+                status = DM_UNENCODABLE
+            except socket.error as send_e:
+                self.metrics.send_errors.inc()
+                self.gui.log_output(f"Error sending DM to {relay.recipient}: {send_e}", log_pipeline.ERROR)
+                self._cleanup_disconnected_client(client_addr_tuple)
+        return status
+
+    def _route_broadcast(self, relay, trace_enabled=False):
+        """Delivers a broadcast to every locally connected client except the sender's IP."""
+        failed_sends = []
+        for client_addr_tuple, client_conn_socket in list(self.connections.items()):
+            if client_addr_tuple[0] != relay.sender_ip:
+                try:
+                    data = relay.frame(client_conn_socket.encoding)
+                    client_conn_socket.sendall(data)
+                    self.metrics.count_out("BROADCAST", len(data))
+                    if trace_enabled:
+                        self.gui.log_output(f"Broadcast from {relay.sender_ip} to {client_addr_tuple[0]}: {relay.message}", log_pipeline.DEBUG)
+                except protocol.ProtocolError as e:
+                    # Skip only this recipient so one bad encode cannot stop the fan-out.
+                    self.metrics.send_errors.inc()
+                    self.gui.log_output(f"Cannot encode broadcast from {relay.sender_ip} for {client_addr_tuple[0]}: {e}", log_pipeline.WARNING)
+                except socket.error as send_e:
+                    self.metrics.send_errors.inc()
+                    self.gui.log_output(f"Error broadcasting to {client_addr_tuple[0]}: {send_e}", log_pipeline.ERROR)
+                    failed_sends.append(client_addr_tuple)
+        for failed_addr in failed_sends:
+            self._cleanup_disconnected_client(failed_addr)
+
+    def _create_offline_queue(self):
+        directory = self.gui.config.OFFLINE_QUEUE_DIR
+        if not directory:
+            return None
+        if self.cluster is not None:
+            # Each worker keeps its own queues and hands them to the worker the recipient connects to.
+            directory = os.path.join(directory, f"worker-{self.cluster.worker_id}")
+        try:
+            offline = offline_queue.OfflineQueue(directory, self.gui.config.OFFLINE_SEGMENT_SIZE,
+                                                 self.gui.config.OFFLINE_MAX_BYTES_PER_RECIPIENT,
+                                                 self.gui.config.OFFLINE_MAX_TOTAL_BYTES,
+                                                 self.gui.config.OFFLINE_MAX_RECIPIENTS,
+                                                 self.gui.config.OFFLINE_MESSAGE_TTL)
+        except OSError as e:
+            self.gui.log_output(f"Offline DM queue disabled, cannot use {directory}: {e}", log_pipeline.ERROR)
+            return None
+        if offline.pending_count():
+            self.gui.log_output(f"Offline DM queue holds messages for {offline.pending_count()} recipient(s).")
+        return offline
+
+    def _store_offline_dm(self, client_socket, relay):
+        """Queues a DM for later delivery. Returns False if it cannot be queued."""
+        if self.offline is None:
+            return False
+        try:
+            new_backlog = self.offline.store(relay.recipient, relay.sender_ip, relay.message)
+        except (ValueError, offline_queue.OfflineQueueFull, OSError) as e:
+            self.gui.log_output(f"Could not queue DM for {relay.recipient}: {e}", log_pipeline.WARNING)
+            return False
+        self.metrics.offline_stored.inc()
+        # One notice per backlog; DMs queued behind it, or behind one being streamed to a
+        # connected recipient, need none.
+        if new_backlog and not self._recipient_reachable(relay.recipient):
+            notice = {"type": "SERVER_DM", "message": f"{relay.recipient} is offline; your messages will be delivered when they connect."}
+            self._send_json_to_client(client_socket, notice)
+            self.gui.log_output(f"DMs from {relay.sender_ip} to {relay.recipient} are queued for offline delivery.")
+        self.deliver_offline(relay.recipient)
+        return True
+
+    def _offline_expiry_thread(self):
+        while True:
+            try:
+                expired = self.offline.expire()
+            except OSError as e:
+                self.gui.log_output(f"Offline DM queue expiry failed: {e}", log_pipeline.ERROR)
+            else:
+                if expired:
+                    self.gui.log_output(f"Dropped expired offline DMs of {expired} recipient(s).")
+            if self.offline_expiry_stop.wait(OFFLINE_EXPIRY_INTERVAL):
+                return
+
+    def _close_offline_queue(self):
+        self.offline_expiry_stop.set()
+        if self.offline is not None:
+            self.offline.close()
+
+    def _recipient_reachable(self, ip):
+        return bool(self.get_connections_by_ip(ip)) or (self.cluster is not None and self.cluster.serves_remotely(ip))
+
+    def deliver_offline(self, ip):
+        """Starts streaming the DMs queued for ip once it is connected here or on another worker."""
+        if self.offline is None or not self.offline.has_pending(ip) or not self._recipient_reachable(ip):
+            return
+        if self.offline.begin_delivery(ip):
+            delivery_thread = threading.Thread(target=self._offline_delivery_thread, args=(ip,))
+            delivery_thread.daemon = True
+            delivery_thread.start()
+
+    def _offline_delivery_thread(self, ip):
+        while True:
+            try:
+                self._deliver_offline_backlog(ip)
+            except Exception as e:
+                self.gui.log_output(f"Offline delivery to {ip} failed: {e}", log_pipeline.ERROR)
+                self.offline.end_delivery(ip)
+                return
+            self.offline.end_delivery(ip)
+            # A DM queued, or the recipient reconnecting, just before end_delivery() saw this delivery still running.
+            if not (self.running and self.offline.has_pending(ip) and self._recipient_reachable(ip)):
+                return
+            if not self.offline.begin_delivery(ip):
+                return
+
+    def _deliver_offline_backlog(self, ip):
+        delivered = 0
+        expired = 0
+        while self.running:
+            messages, position = self.offline.read(ip, self.gui.config.OFFLINE_DELIVERY_BATCH_BYTES)
+            if not messages:
+                break
+            relays = [protocol.RelayMessage("DM", ip, message["sender_ip"], json_message=message["message"])
+                      for message in messages if not self.offline.is_expired(message)]
+            expired += len(messages) - len(relays)
+            if relays:
+                connections = self.get_connections_by_ip(ip)
+                if connections:
+                    sent = self._send_offline_batch(connections[0][1], relays)
+                else:
+                    sent = self.cluster is not None and self.cluster.deliver_offline_batch(ip, relays)
+                if not sent:
+                    break
+            # Delivery is at-least-once: a batch is only marked done once it was written to the recipient.
+            self.offline.commit(ip, position)
+            self.metrics.offline_delivered.inc(amount=len(relays))
+            delivered += len(relays)
+        if delivered:
+            self.gui.log_output(f"Delivered {delivered} queued DM(s) to {ip}.")
+        if expired:
+            self.gui.log_output(f"Dropped {expired} expired queued DM(s) for {ip}.")
+
+    def _send_offline_batch(self, conn, relays):
+        # The whole batch goes out as one outbound queue entry that the slow-consumer policy may
+        # not drop, and the next batch is read only after the writer has written this one.
+        data = b"".join(relay.frame(conn.encoding) for relay in relays)
+        written = threading.Event()
+        result = []
+
+        def on_written(ok):
+            result.append(ok)
+            written.set()
+
+        def enqueue():
+            try:
+                conn.sendall(data, on_written)
+                self.metrics.messages_out.inc("DM", len(relays))
+                self.metrics.bytes_out.inc("DM", len(data))
+            except socket.error as e:
+                self.metrics.send_errors.inc()
+                self.gui.log_output(f"Error sending queued DMs to {conn.addr[0]}: {e}", log_pipeline.ERROR)
+                on_written(False)
+
+        self.run_in_server_context(enqueue)
+        while not written.wait(0.5):
+            if not self.running:
+                return False
+        return result[0]
+
+    def run_in_server_context(self, callback, *args):
+        """Runs callback where connections may be touched; the threaded engine allows any thread."""
+        callback(*args)
+
+    def _negotiate_encoding(self, client_socket, client_info, hello_message):
+        encoding = protocol.choose_encoding(hello_message.get("encodings"), self.gui.config.SERVER_ENCODINGS)
+        # The reply still goes out in the old encoding; everything after it uses the new one.
+        self._send_json_to_client(client_socket, {"type": "HELLO", "encoding": encoding})
+        client_socket.encoding = encoding
+        self.gui.log_output(f"{client_info} negotiated {encoding} encoding.")
+
+    def _on_outbound_error(self, connection, error):
+        self.metrics.send_errors.inc()
+        self.gui.log_output(f"Error sending to {connection.addr[0]}: {error}", log_pipeline.ERROR)
+        self._cleanup_disconnected_client(connection.addr)
+
+    def _register_connection(self, addr, conn):
+        with self.connections_lock:
+            self.connections[addr] = conn
+            self.connections_by_ip.setdefault(addr[0], {})[addr] = conn
+        if self.cluster is not None:
+            self.cluster.on_local_connect(addr)
+        self.deliver_offline(addr[0])
+
+    def _unregister_connection(self, addr):
+        with self.connections_lock:
+            conn = self.connections.pop(addr, None)
+            ip_connections = self.connections_by_ip.get(addr[0])
+            if ip_connections is not None:
+                ip_connections.pop(addr, None)
+                if not ip_connections:
+                    del self.connections_by_ip[addr[0]]
+        if conn is not None and self.cluster is not None:
+            self.cluster.on_local_disconnect(addr)
+        return conn
+
+    def get_connections_by_ip(self, ip):
+        """Returns a list of (addr, connection) pairs for every client connected from the given IP."""
+        ip_connections = self.connections_by_ip.get(ip)
+        if not ip_connections:
+            return []
+        with self.connections_lock:
+            return list(ip_connections.items())
+
     def _cleanup_disconnected_client(self, addr):
-        if addr in self.connections:
+        conn = self._unregister_connection(addr)
+        if conn is not None:
             try:
-                self.connections[addr].shutdown(socket.SHUT_RDWR)
-                self.connections[addr].close()
+                conn.shutdown(socket.SHUT_RDWR)
+                conn.close()
             except OSError as e:
-                self.gui.log_output(f"Error closing socket for {addr}: {e}")
-            del self.connections[addr]
-        if addr in self.client_threads:
-            del self.client_threads[addr]
-        if addr in self.client_messages:
-            del self.client_messages[addr]
+                self.gui.log_output(f"Error closing socket for {addr}: {e}", log_pipeline.ERROR)
+        self.client_threads.pop(addr, None)
+        self.client_messages.pop(addr, None)
         self.gui.log_output(f"Client {addr} cleaned up.")
 
     def _send_json_to_client(self, client_socket, json_data):
         try:
-            json_message = json.dumps(json_data)
-            client_socket.sendall(json_message.encode('utf-8'))
+            data = protocol.encode_message_frame(json_data, client_socket.encoding)
+            client_socket.sendall(data)
+            self.metrics.count_out(json_data.get("type"), len(data))
         except socket.error as e:
-            self.gui.log_output(f"Send error to client: {e}")
+            self.metrics.send_errors.inc()
+            self.gui.log_output(f"Send error to client: {e}", log_pipeline.ERROR)
         except Exception as e:
-            self.gui.log_output(f"Unexpected send error to client: {e}")
+            self.metrics.send_errors.inc()
+            self.gui.log_output(f"Unexpected send error to client: {e}", log_pipeline.ERROR)
 
     def stop_server(self):
         self.running = False
-        if self.server_socket:
+        # The listener thread clears self.server_socket itself once unblocked, so keep a reference.
+        server_socket = self.server_socket
+        if server_socket:
             try:
                 temp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
                 temp_socket.connect((self.gui.config.SERVER_HOST, self.gui.config.SERVER_PORT))
                 temp_socket.close()
             except socket.error as e:
-                self.gui.log_output(f"Error unblocking server socket: {e}")
+                self.gui.log_output(f"Error unblocking server socket: {e}", log_pipeline.ERROR)
             finally:
-                self.server_socket.close()
+                try:
+                    # With SO_REUSEPORT the wake-up connect may land on another process; shutdown() wakes accept() here.
+                    server_socket.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                server_socket.close()
                 self.server_socket = None
 
         for addr, conn in list(self.connections.items()):
             self._cleanup_disconnected_client(addr)
+        self._stop_metrics_endpoint()
+        self._close_offline_queue()
         self.gui.log_output("Server stopped.")
 
+    def metrics_snapshot(self):
+        return self.metrics.snapshot()
 
-class ServerGUI:
-    def __init__(self):
-        self.config = config
-        self.root = tk.Tk()
-        self.term_area = None
-        self.log_area = None
-        self.prompt = "> "
-        self.command_history = []
-        self.history_index = -1
-        self._initial_enter_processed = False
-
-        self._setup_gui()
-        self.server = Server(self)
-
-        if os.getcwd() not in sys.path:
-            sys.path.append(os.getcwd())
-        
-        self.commands = command_loader.load_commands("commands")
-        
-        self._terminal_println(f"{config.APP_NAME} [Version: {config.APP_VERSION}]")
-        self._terminal_println(f"Made by {config.APP_AUTHOR}")
-        self._terminal_println(f"")
-        self._terminal_println(f"Enter help for a list of commands")
-        self._write_prompt()
-        
-    def _setup_gui(self):
-        self.root.title(f"{self.config.APP_NAME} - Server Manager")
-        self.root.protocol("WM_DELETE_WINDOW", self._on_closing)
-
-        self.root.grid_rowconfigure(0, weight=1)
-        self.root.grid_columnconfigure(0, weight=3)
-        self.root.grid_columnconfigure(1, weight=2)
-
-        self.log_area = scrolledtext.ScrolledText(self.root, bg="black", fg="white", font=("Consolas", 10), wrap=tk.WORD)
-        self.log_area.grid(row=0, column=0, sticky="nsew", padx=0, pady=0)
-        self.log_area.configure(state='disabled')
-
-        self.term_area = scrolledtext.ScrolledText(self.root, bg="#111", fg="#0f0", insertbackground="white", font=("Consolas", 10), wrap=tk.CHAR, insertofftime=0)
-        self.term_area.grid(row=0, column=1, sticky="nsew", padx=0, pady=0)
-        self.term_area.configure(state='normal')
-
-        self.term_area.bind("<Return>", self._on_enter)
-        self.term_area.bind("<BackSpace>", self._on_backspace, add="+")
-        self.term_area.bind("<Delete>", self._on_delete, add="+")
-        self.term_area.bind("<Button-1>", self._on_click_and_focus)
-        self.term_area.bind("<Up>", self._history_up)
-        self.term_area.bind("<Down>", self._history_down)
-        self.term_area.bind("<Key>", self._on_keypress, add="+")
-
-
-    def log_output(self, message):
-        timestamp = time.strftime("[%H:%M:%S] ")
-        self.log_area.configure(state='normal')
-        self.log_area.insert(tk.END, timestamp + message + "\n")
-        self.log_area.see(tk.END)
-        self.log_area.configure(state='disabled')
-
-    def _terminal_println(self, text):
-        self.term_area.mark_set(tk.INSERT, tk.END)
-        self.term_area.see(tk.END)
-        self.term_area.insert(tk.END, text + "\n")
-        self.term_area.focus_set()
-
-    def _write_prompt(self):
-        self.term_area.mark_set(tk.INSERT, tk.END)
-        self.term_area.see(tk.END)
-        self.term_area.insert(tk.END, self.prompt)
-        self.term_area.mark_set("cmd_start", tk.INSERT)
-        self.term_area.focus_set()
-    
-    def _on_keypress(self, event):
-        if event.keysym in ["Return", "BackSpace", "Delete", "Up", "Down", "Left", "Right", "Shift_L", "Shift_R", "Control_L", "Control_R", "Alt_L", "Alt_R", "Meta_L", "Meta_R", "Caps_Lock", "Num_Lock", "Scroll_Lock", "F1", "F2", "F3", "F4", "F5", "F6", "F7", "F8", "F9", "F10", "F11", "F12", "Home", "End", "Prior", "Next", "Insert", "Print", "Pause", "Menu"]:
-            return None 
-        
-        end_index = self.term_area.index("end-1c")
-        line_index = end_index.split('.')[0]
-
-        current_cursor_index = self.term_area.index(tk.INSERT)
-        cmd_start_index = f"{line_index}.{len(self.prompt)}"
-
-        if self.term_area.compare(current_cursor_index, "<", cmd_start_index):
-            self.term_area.mark_set(tk.INSERT, tk.END)
-            self.term_area.see(tk.END)
-            return "break"
-        
-        return None
-
-    def _on_enter(self, event):
-        end_index = self.term_area.index("end-1c")
-        line_index = end_index.split('.')[0]
-        full_line = self.term_area.get(f"{line_index}.0", f"{line_index}.end")
-        prompt_len = len(self.prompt)
-        command = full_line[prompt_len:].strip()
-        
-        if not self._initial_enter_processed and not command:
-            self._initial_enter_processed = True
-            self.term_area.delete("cmd_start", tk.END) 
-            self.term_area.insert(tk.END, "\n")
-            self._write_prompt()
-            return "break"
-        
-        self._initial_enter_processed = True
-
-        if command and (not self.command_history or self.command_history[-1] != command):
-            self.command_history.append(command)
-        self.history_index = len(self.command_history)
-        
-        self.term_area.delete("cmd_start", tk.END)
-
-        self.term_area.insert(tk.END, "\n")
-
-        output = None
-        if command:
-            output = self._process_command(command)
-        else:
-            pass
-
-        if output is not None:
-            self.term_area.insert(tk.END, f"{output}\n")
-        
-        self._write_prompt()
-        return "break"
-
-    def _on_backspace(self, event):
-        current_cursor_index = self.term_area.index(tk.INSERT)
-        cmd_start_index = self.term_area.index("cmd_start")
-        line_index = current_cursor_index.split('.')[0]
-
-        if self.term_area.compare(current_cursor_index, "<=", f"{line_index}.{len(self.prompt)}"):
-            return "break"
-
-        tag_ranges = self.term_area.tag_ranges(tk.SEL)
-        if tag_ranges:
-            sel_start, sel_end = tag_ranges
-            if self.term_area.compare(sel_start, "<", cmd_start_index):
-                sel_start = cmd_start_index
-            
-            if self.term_area.compare(sel_start, "<", sel_end):
-                self.term_area.delete(sel_start, sel_end)
-            return "break"
-
-        return None
-
-    def _on_delete(self, event):
-        current_cursor_index = self.term_area.index(tk.INSERT)
-        cmd_start_index = self.term_area.index("cmd_start")
-
-        if self.term_area.compare(current_cursor_index, "<", cmd_start_index):
-            return "break"
-
-        if self.term_area.tag_ranges(tk.SEL):
-            sel_start, sel_end = self.term_area.tag_ranges(tk.SEL)
-            if self.term_area.compare(sel_start, "<", cmd_start_index):
-                sel_start = cmd_start_index
-            
-            if self.term_area.compare(sel_start, "<", sel_end):
-                self.term_area.delete(sel_start, sel_end)
-            return "break"
-
-        if self.term_area.compare(current_cursor_index, ">=", cmd_start_index) and \
-           self.term_area.compare(current_cursor_index, "<", tk.END):
-            self.term_area.delete(current_cursor_index)
-
-        return "break"
-
-    def _on_click_and_focus(self, event):
-        self.term_area.focus_set()
-
-        if self.term_area.compare("@%d,%d" % (event.x, event.y), "<", "cmd_start"):
-            self.term_area.mark_set(tk.INSERT, tk.END)
-            self.term_area.see(tk.END)
-            return "break"
-        return None
-
-    def _history_up(self, event):
-        if self.command_history:
-            self.history_index -= 1
-            if self.history_index < 0:
-                self.history_index = 0
-            
-            self._display_history_command()
-        return "break"
-
-    def _history_down(self, event):
-        if self.command_history:
-            self.history_index += 1
-            if self.history_index >= len(self.command_history):
-                self.history_index = len(self.command_history)
-                self._clear_current_command_line()
-            else:
-                self._display_history_command()
-        return "break"
-
-    def _display_history_command(self):
-        current_cursor_index = self.term_area.index(tk.INSERT)
-        cmd_start_index = self.term_area.index("cmd_start")
-        line_index = current_cursor_index.split('.')[0]
-
-        self.term_area.delete(f"{line_index}.{len(self.prompt)}", tk.END)
-        
-        if 0 <= self.history_index < len(self.command_history):
-            command_to_display = self.command_history[self.history_index]
-            self.term_area.insert(tk.END, command_to_display)
-        
-        self.term_area.mark_set(tk.INSERT, tk.END)
-        self.term_area.see(tk.END)
-        self.term_area.focus_set()
-
-
-    def _clear_current_command_line(self):
-        self.term_area.delete("cmd_start", tk.END)
-        self.term_area.mark_set(tk.INSERT, tk.END)
-        self.term_area.see(tk.END)
-        self.term_area.focus_set()
-
-
-    def _process_command(self, command_line):
-        if not command_line.strip():
-            return None
-
-        parts = command_line.strip().split(maxsplit=1)
-        cmd_name = parts[0].lower()
-        args = parts[1].split() if len(parts) > 1 else []
-
-        cmd = self.commands.get(cmd_name)
-        if cmd:
-            try:
-                return cmd.execute(self, args)
-            except Exception as e:
-                return f"Error executing command '{cmd_name}': {e}"
-        else:
-            return f"Unknown command: {cmd_name}"
-
-    def _on_closing(self):
-        if self.server:
-            self.server.stop_server()
-        self.root.destroy()
-        sys.exit(0)
+    def _start_metrics_endpoint(self, snapshot_fn):
+        port = self.gui.config.METRICS_PORT
+        if port is None or self.metrics_endpoint is not None:
+            return
+        try:
+            self.metrics_endpoint = metrics.MetricsEndpoint(self.gui.config.METRICS_HOST, port, snapshot_fn)
+            self.gui.log_output(f"Metrics endpoint on http://{self.gui.config.METRICS_HOST}:{port}/metrics")
+        except OSError as e:
+            self.gui.log_output(f"Could not start metrics endpoint on port {port}: {e}", log_pipeline.ERROR)
+
+    def _stop_metrics_endpoint(self):
+        if self.metrics_endpoint is not None:
+            self.metrics_endpoint.stop()
+            self.metrics_endpoint = None
+
+
+def create_server(gui):
+    engine = gui.config.SERVER_ENGINE
+    if engine == "asyncio":
+        from async_server import AsyncServer
+        return AsyncServer(gui)
+    if engine != "threaded":
+        gui.log_output(f"Unknown server engine '{engine}', falling back to threaded.", log_pipeline.WARNING)
+    return Server(gui)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=f"{config.APP_NAME} server")
+    parser.add_argument("--engine", choices=["threaded", "asyncio"], default=config.SERVER_ENGINE,
+                        help="Connection handling engine (default: %(default)s)")
+    parser.add_argument("--port", type=int, default=config.SERVER_PORT,
+                        help="TCP port to listen on (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=config.SERVER_WORKERS,
+                        help="Number of worker processes sharing the port via SO_REUSEPORT (implies --headless)")
+    parser.add_argument("--headless", action="store_true",
+                        help="Run without the tkinter GUI; logs go to stderr")
+    parser.add_argument("--no-stdin", action="store_true",
+                        help="Headless only: don't read admin commands from stdin")
+    parser.add_argument("--admin-port", type=int, default=config.ADMIN_PORT,
+                        help=f"Headless only: serve admin commands on {config.ADMIN_HOST}:PORT")
+    cli_args = parser.parse_args()
+    config.SERVER_ENGINE = cli_args.engine
+    config.SERVER_PORT = cli_args.port
+
+    # Import the front-end lazily so headless mode never loads tkinter.
+    if cli_args.workers > 1:
+        if not hasattr(socket, "SO_REUSEPORT") or not hasattr(socket, "AF_UNIX"):
+            parser.error("--workers needs SO_REUSEPORT and Unix sockets, which this platform lacks")
+        logging.basicConfig(level=logging.DEBUG, format="[%(asctime)s] [supervisor] %(message)s", datefmt="%H:%M:%S")
+        from cluster import ClusterSupervisor
+        supervisor = ClusterSupervisor(cli_args.workers, cli_args.engine, use_stdin=not cli_args.no_stdin,
+                                       admin_port=cli_args.admin_port)
+        supervisor.run()
+    elif cli_args.headless:
+        logging.basicConfig(level=logging.DEBUG, format="[%(asctime)s] %(message)s", datefmt="%H:%M:%S")
+        from headless import HeadlessServer
+        app = HeadlessServer(use_stdin=not cli_args.no_stdin, admin_port=cli_args.admin_port)
+        app.run()
+    else:
+        from server_gui import ServerGUI
+        app = ServerGUI()
+        app.root.mainloop()
 
 
 if __name__ == '__main__':
-    app = ServerGUI()
-    app.root.mainloop()
+    main()
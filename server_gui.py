@@ -0,0 +1,262 @@
+import sys
+import tkinter as tk
+from tkinter import scrolledtext
+import config
+import command_loader
+import log_pipeline
+import log_view
+import server
+import os
+
+class ServerGUI:
+    def __init__(self):
+        self.config = config
+        self.root = tk.Tk()
+        self.term_area = None
+        self.log_area = None
+        self.prompt = "> "
+        self.command_history = []
+        self.history_index = -1
+        self._initial_enter_processed = False
+
+        self.log_pipeline = log_pipeline.LogPipeline(
+            level=log_pipeline.parse_level(config.LOG_LEVEL),
+            repeat_window=config.LOG_REPEAT_WINDOW,
+        )
+
+        self._setup_gui()
+        self.root.after(config.LOG_FLUSH_INTERVAL_MS, self._flush_log_output)
+        self.server = server.create_server(self)
+
+        if os.getcwd() not in sys.path:
+            sys.path.append(os.getcwd())
+        
+        self.commands = command_loader.load_commands("commands")
+        
+        self._terminal_println(f"{config.APP_NAME} [Version: {config.APP_VERSION}]")
+        self._terminal_println(f"Made by {config.APP_AUTHOR}")
+        self._terminal_println(f"")
+        self._terminal_println(f"Enter help for a list of commands")
+        self._write_prompt()
+        
+    def _setup_gui(self):
+        self.root.title(f"{self.config.APP_NAME} - Server Manager")
+        self.root.protocol("WM_DELETE_WINDOW", self._on_closing)
+
+        self.root.grid_rowconfigure(0, weight=1)
+        self.root.grid_columnconfigure(0, weight=3)
+        self.root.grid_columnconfigure(1, weight=2)
+
+        archive_logger = None
+        if self.config.LOG_ARCHIVE_FILE:
+            archive_logger = log_view.create_archive_logger(self.config.LOG_ARCHIVE_FILE, self.config.LOG_ARCHIVE_MAX_BYTES,
+                                                            self.config.LOG_ARCHIVE_BACKUP_COUNT)
+        self.log_view = log_view.VirtualLogView(self.root, self.config.LOG_RETENTION_LINES, archive_logger,
+                                                bg="black", fg="white", font=("Consolas", 10), wrap=tk.WORD)
+        self.log_view.grid(row=0, column=0, sticky="nsew", padx=0, pady=0)
+        self.log_area = self.log_view.text
+
+        self.term_area = scrolledtext.ScrolledText(self.root, bg="#111", fg="#0f0", insertbackground="white", font=("Consolas", 10), wrap=tk.CHAR, insertofftime=0)
+        self.term_area.grid(row=0, column=1, sticky="nsew", padx=0, pady=0)
+        self.term_area.configure(state='normal')
+
+        self.term_area.bind("<Return>", self._on_enter)
+        self.term_area.bind("<BackSpace>", self._on_backspace, add="+")
+        self.term_area.bind("<Delete>", self._on_delete, add="+")
+        self.term_area.bind("<Button-1>", self._on_click_and_focus)
+        self.term_area.bind("<Up>", self._history_up)
+        self.term_area.bind("<Down>", self._history_down)
+        self.term_area.bind("<Key>", self._on_keypress, add="+")
+
+
+    def log_output(self, message, level=log_pipeline.INFO):
+        # Safe from any thread: records are queued and written to the widget by _flush_log_output.
+        self.log_pipeline.log(message, level)
+
+    def log_enabled(self, level):
+        return self.log_pipeline.is_enabled(level)
+
+    def _flush_log_output(self):
+        records = self.log_pipeline.drain(self.config.LOG_FLUSH_BATCH_SIZE)
+        if records:
+            self.log_view.append_lines([log_pipeline.format_record(record) for record in records])
+
+        # Catch up immediately when a backlog remains, otherwise wait for the next tick.
+        delay = 1 if self.log_pipeline.pending() else self.config.LOG_FLUSH_INTERVAL_MS
+        self.root.after(delay, self._flush_log_output)
+
+    def _terminal_println(self, text):
+        self.term_area.mark_set(tk.INSERT, tk.END)
+        self.term_area.see(tk.END)
+        self.term_area.insert(tk.END, text + "\n")
+        self.term_area.focus_set()
+
+    def _write_prompt(self):
+        self.term_area.mark_set(tk.INSERT, tk.END)
+        self.term_area.see(tk.END)
+        self.term_area.insert(tk.END, self.prompt)
+        self.term_area.mark_set("cmd_start", tk.INSERT)
+        self.term_area.focus_set()
+    
+    def _on_keypress(self, event):
+        if event.keysym in ["Return", "BackSpace", "Delete", "Up", "Down", "Left", "Right", "Shift_L", "Shift_R", "Control_L", "Control_R", "Alt_L", "Alt_R", "Meta_L", "Meta_R", "Caps_Lock", "Num_Lock", "Scroll_Lock", "F1", "F2", "F3", "F4", "F5", "F6", "F7", "F8", "F9", "F10", "F11", "F12", "Home", "End", "Prior", "Next", "Insert", "Print", "Pause", "Menu"]:
+            return None 
+        
+        end_index = self.term_area.index("end-1c")
+        line_index = end_index.split('.')[0]
+
+        current_cursor_index = self.term_area.index(tk.INSERT)
+        cmd_start_index = f"{line_index}.{len(self.prompt)}"
+
+        if self.term_area.compare(current_cursor_index, "<", cmd_start_index):
+            self.term_area.mark_set(tk.INSERT, tk.END)
+            self.term_area.see(tk.END)
+            return "break"
+        
+        return None
+
+    def _on_enter(self, event):
+        end_index = self.term_area.index("end-1c")
+        line_index = end_index.split('.')[0]
+        full_line = self.term_area.get(f"{line_index}.0", f"{line_index}.end")
+        prompt_len = len(self.prompt)
+        command = full_line[prompt_len:].strip()
+        
+        if not self._initial_enter_processed and not command:
+            self._initial_enter_processed = True
+            self.term_area.delete("cmd_start", tk.END) 
+            self.term_area.insert(tk.END, "\n")
+            self._write_prompt()
+            return "break"
+        
+        self._initial_enter_processed = True
+
+        if command and (not self.command_history or self.command_history[-1] != command):
+            self.command_history.append(command)
+        self.history_index = len(self.command_history)
+        
+        self.term_area.delete("cmd_start", tk.END)
+
+        self.term_area.insert(tk.END, "\n")
+
+        output = None
+        if command:
+            output = self._process_command(command)
+        else:
+            pass
+
+        if output is not None:
+            self.term_area.insert(tk.END, f"{output}\n")
+        
+        self._write_prompt()
+        return "break"
+
+    def _on_backspace(self, event):
+        current_cursor_index = self.term_area.index(tk.INSERT)
+        cmd_start_index = self.term_area.index("cmd_start")
+        line_index = current_cursor_index.split('.')[0]
+
+        if self.term_area.compare(current_cursor_index, "<=", f"{line_index}.{len(self.prompt)}"):
+            return "break"
+
+        tag_ranges = self.term_area.tag_ranges(tk.SEL)
+        if tag_ranges:
+            sel_start, sel_end = tag_ranges
+            if self.term_area.compare(sel_start, "<", cmd_start_index):
+                sel_start = cmd_start_index
+            
+            if self.term_area.compare(sel_start, "<", sel_end):
+                self.term_area.delete(sel_start, sel_end)
+            return "break"
+
+        return None
+
+    def _on_delete(self, event):
+        current_cursor_index = self.term_area.index(tk.INSERT)
+        cmd_start_index = self.term_area.index("cmd_start")
+
+        if self.term_area.compare(current_cursor_index, "<", cmd_start_index):
+            return "break"
+
+        if self.term_area.tag_ranges(tk.SEL):
+            sel_start, sel_end = self.term_area.tag_ranges(tk.SEL)
+            if self.term_area.compare(sel_start, "<", cmd_start_index):
+                sel_start = cmd_start_index
+            
+            if self.term_area.compare(sel_start, "<", sel_end):
+                self.term_area.delete(sel_start, sel_end)
+            return "break"
+
+        if self.term_area.compare(current_cursor_index, ">=", cmd_start_index) and \
+           self.term_area.compare(current_cursor_index, "<", tk.END):
+            self.term_area.delete(current_cursor_index)
+
+        return "break"
+
+    def _on_click_and_focus(self, event):
+        self.term_area.focus_set()
+
+        if self.term_area.compare("@%d,%d" % (event.x, event.y), "<", "cmd_start"):
+            self.term_area.mark_set(tk.INSERT, tk.END)
+            self.term_area.see(tk.END)
+            return "break"
+        return None
+
+    def _history_up(self, event):
+        if self.command_history:
+            self.history_index -= 1
+            if self.history_index < 0:
+                self.history_index = 0
+            
+            self._display_history_command()
+        return "break"
+
+    def _history_down(self, event):
+        if self.command_history:
+            self.history_index += 1
+            if self.history_index >= len(self.command_history):
+                self.history_index = len(self.command_history)
+                self._clear_current_command_line()
+            else:
+                self._display_history_command()
+        return "break"
+
+    def _display_history_command(self):
+        current_cursor_index = self.term_area.index(tk.INSERT)
+        cmd_start_index = self.term_area.index("cmd_start")
+        line_index = current_cursor_index.split('.')[0]
+
+        self.term_area.delete(f"{line_index}.{len(self.prompt)}", tk.END)
+        
+        if 0 <= self.history_index < len(self.command_history):
+            command_to_display = self.command_history[self.history_index]
+            self.term_area.insert(tk.END, command_to_display)
+        
+        self.term_area.mark_set(tk.INSERT, tk.END)
+        self.term_area.see(tk.END)
+        self.term_area.focus_set()
+
+
+    def _clear_current_command_line(self):
+        self.term_area.delete("cmd_start", tk.END)
+        self.term_area.mark_set(tk.INSERT, tk.END)
+        self.term_area.see(tk.END)
+        self.term_area.focus_set()
+
+
+    def _process_command(self, command_line):
+        return command_loader.execute_command(self, self.commands, command_line)
+
+    def clear_terminal(self):
+        self.term_area.configure(state='normal')
+        self.term_area.delete("1.0", "end")
+
+    def request_shutdown(self):
+        self.root.after(100, self._on_closing)
+
+    def _on_closing(self):
+        if self.server:
+            self.server.stop_server()
+        self.log_view.close()
+        self.root.destroy()
+        sys.exit(0)
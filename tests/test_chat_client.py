@@ -0,0 +1,71 @@
+import os
+import socket
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chat_client
+import protocol
+
+
+def _read_messages(conn, count, decoder):
+    messages = []
+    while len(messages) < count:
+        data = conn.recv(65536)
+        if not data:
+            break
+        messages.extend(protocol.decode_message(frame) for frame in decoder.feed(data))
+    return messages
+
+
+def _connected_client(server_encoding):
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+    client = chat_client.ChatClient()
+    failed = []
+    failed_event = threading.Event()
+    client.on_send_failed = lambda message, error: (failed.append((message, error)), failed_event.set())
+    client.connect("127.0.0.1", listener.getsockname()[1], timeout=5)
+    conn, _ = listener.accept()
+    listener.close()
+    conn.settimeout(5)
+
+    decoder = protocol.FrameDecoder()
+    hello = _read_messages(conn, 1, decoder)[0]
+    assert hello["type"] == "HELLO"
+    conn.sendall(protocol.encode_json_frame({"type": "HELLO", "encoding": server_encoding}))
+    # The client switches encodings on its receiver thread; make sure it has seen the reply.
+    client.send_broadcast("sync")
+    assert _read_messages(conn, 1, decoder)[0]["message"] == "sync"
+    return client, conn, decoder, failed, failed_event
+
+
+def test_oversize_message_is_skipped_and_later_messages_are_delivered():
+    client, conn, decoder, failed, failed_event = _connected_client(protocol.ENCODING_JSON)
+    try:
+        client.send_dm("127.0.0.2", "x" * (protocol.MAX_FRAME_SIZE + 1))
+        client.send_dm("127.0.0.2", "hello")
+        assert _read_messages(conn, 1, decoder) == [{"type": "DM", "recipient": "127.0.0.2", "message": "hello"}]
+        assert failed_event.wait(5)
+        assert len(failed[0][0]["message"]) == protocol.MAX_FRAME_SIZE + 1
+        assert isinstance(failed[0][1], protocol.ProtocolError)
+        assert client.connected
+    finally:
+        client.close()
+        conn.close()
+
+
+def test_unpackable_recipient_is_skipped_in_binary_encoding():
+    client, conn, decoder, failed, failed_event = _connected_client(protocol.ENCODING_BINARY)
+    try:
+        client.send_dm("10.1", "lost")
+        client.send_dm("127.0.0.2", "hello")
+        message = _read_messages(conn, 1, decoder)[0]
+        assert (message["type"], message["message"]) == ("DM", "hello")
+        assert failed_event.wait(5)
+        assert failed[0][0]["recipient"] == "10.1"
+    finally:
+        client.close()
+        conn.close()
@@ -0,0 +1,156 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import offline_queue
+
+SEGMENT_SIZE = 256
+
+
+def _segment_files(directory, recipient):
+    path = os.path.join(str(directory), recipient.replace(":", "_"))
+    if not os.path.isdir(path):
+        return []
+    return sorted(name for name in os.listdir(path) if name.endswith(offline_queue.SEGMENT_SUFFIX))
+
+
+def _read_all(queue, recipient, max_bytes=100):
+    messages = []
+    while True:
+        batch, position = queue.read(recipient, max_bytes)
+        if not batch:
+            return messages
+        messages.extend(message["message"] for message in batch)
+        queue.commit(recipient, position)
+
+
+def test_messages_roll_over_into_new_segments_and_come_back_in_order(tmp_path):
+    queue = offline_queue.OfflineQueue(str(tmp_path), SEGMENT_SIZE, 64 * SEGMENT_SIZE)
+    for i in range(20):
+        queue.store("10.0.0.2", "10.0.0.1", f"m{i:02d}")
+    assert len(_segment_files(tmp_path, "10.0.0.2")) > 1
+
+    assert _read_all(queue, "10.0.0.2") == [f"m{i:02d}" for i in range(20)]
+    assert not queue.has_pending("10.0.0.2")
+    assert not os.path.exists(os.path.join(str(tmp_path), "10.0.0.2"))
+    queue.close()
+
+
+def test_segments_behind_the_cursor_are_deleted(tmp_path):
+    queue = offline_queue.OfflineQueue(str(tmp_path), SEGMENT_SIZE, 64 * SEGMENT_SIZE)
+    for i in range(20):
+        queue.store("10.0.0.2", "10.0.0.1", f"m{i:02d}")
+    first_segment = _segment_files(tmp_path, "10.0.0.2")[0]
+
+    delivered = []
+    while first_segment in _segment_files(tmp_path, "10.0.0.2"):
+        batch, position = queue.read("10.0.0.2", 1)
+        delivered.extend(message["message"] for message in batch)
+        queue.commit("10.0.0.2", position)
+    assert 0 < len(delivered) < 20
+    assert queue.has_pending("10.0.0.2")
+    queue.close()
+
+
+def test_cursor_survives_a_restart_and_uncommitted_reads_are_redelivered(tmp_path):
+    queue = offline_queue.OfflineQueue(str(tmp_path), SEGMENT_SIZE, 64 * SEGMENT_SIZE)
+    for i in range(10):
+        queue.store("fe80::2", "10.0.0.1", f"m{i}")
+    batch, position = queue.read("fe80::2", 1)
+    queue.commit("fe80::2", position)
+    # Read but never committed, e.g. the server stopped before the recipient got it.
+    queue.read("fe80::2", 1)
+    queue.close()
+
+    reopened = offline_queue.OfflineQueue(str(tmp_path), SEGMENT_SIZE, 64 * SEGMENT_SIZE)
+    assert reopened.has_pending("fe80::2")
+    assert _read_all(reopened, "fe80::2") == [f"m{i}" for i in range(len(batch), 10)]
+    reopened.close()
+
+
+def test_recipient_queue_is_capped(tmp_path):
+    queue = offline_queue.OfflineQueue(str(tmp_path), SEGMENT_SIZE, 2 * SEGMENT_SIZE)
+    with pytest.raises(offline_queue.OfflineQueueFull):
+        for i in range(100):
+            queue.store("10.0.0.2", "10.0.0.1", f"m{i:02d}")
+    assert len(_segment_files(tmp_path, "10.0.0.2")) == 2
+    with pytest.raises(offline_queue.OfflineQueueFull):
+        queue.store("10.0.0.3", "10.0.0.1", "x" * SEGMENT_SIZE)
+    queue.close()
+
+
+def test_invalid_recipient_is_rejected(tmp_path):
+    queue = offline_queue.OfflineQueue(str(tmp_path), SEGMENT_SIZE, 2 * SEGMENT_SIZE)
+    with pytest.raises(ValueError):
+        queue.store("../outside", "10.0.0.1", "hi")
+    queue.close()
+
+
+def test_store_reports_new_backlogs(tmp_path):
+    queue = offline_queue.OfflineQueue(str(tmp_path), SEGMENT_SIZE, 64 * SEGMENT_SIZE)
+    assert queue.store("10.0.0.2", "10.0.0.1", "first") is True
+    assert queue.store("10.0.0.2", "10.0.0.1", "second") is False
+    _read_all(queue, "10.0.0.2")
+    assert queue.store("10.0.0.2", "10.0.0.1", "third") is True
+    queue.close()
+
+
+def test_number_of_recipients_is_capped(tmp_path):
+    queue = offline_queue.OfflineQueue(str(tmp_path), SEGMENT_SIZE, 64 * SEGMENT_SIZE, max_recipients=2)
+    queue.store("10.0.0.2", "10.0.0.1", "hi")
+    queue.store("10.0.0.3", "10.0.0.1", "hi")
+    with pytest.raises(offline_queue.OfflineQueueFull):
+        queue.store("10.0.0.4", "10.0.0.1", "hi")
+    # Recipients that already have a backlog can still be queued for.
+    queue.store("10.0.0.2", "10.0.0.1", "again")
+    assert queue.pending_count() == 2
+    queue.close()
+
+
+def test_total_size_is_capped_across_recipients(tmp_path):
+    queue = offline_queue.OfflineQueue(str(tmp_path), SEGMENT_SIZE, 64 * SEGMENT_SIZE, max_total_bytes=3 * SEGMENT_SIZE)
+    with pytest.raises(offline_queue.OfflineQueueFull):
+        for i in range(100):
+            queue.store(f"10.0.0.{i % 4 + 2}", "10.0.0.1", f"m{i:02d}")
+    assert sum(len(_segment_files(tmp_path, f"10.0.0.{i}")) for i in range(2, 6)) == 3
+
+    # Delivering a backlog frees its segments for new messages.
+    _read_all(queue, "10.0.0.2")
+    queue.store("10.0.0.9", "10.0.0.1", "fits again")
+    queue.close()
+
+
+def test_total_size_counts_queues_found_on_disk(tmp_path):
+    queue = offline_queue.OfflineQueue(str(tmp_path), SEGMENT_SIZE, 64 * SEGMENT_SIZE)
+    for i in range(20):
+        queue.store("10.0.0.2", "10.0.0.1", f"m{i:02d}")
+    segments = len(_segment_files(tmp_path, "10.0.0.2"))
+    queue.close()
+
+    reopened = offline_queue.OfflineQueue(str(tmp_path), SEGMENT_SIZE, 64 * SEGMENT_SIZE,
+                                          max_total_bytes=segments * SEGMENT_SIZE)
+    assert reopened.total_segments == segments
+    with pytest.raises(offline_queue.OfflineQueueFull):
+        reopened.store("10.0.0.3", "10.0.0.1", "no room")
+    reopened.close()
+
+
+def test_expired_queues_are_dropped(tmp_path, monkeypatch):
+    queue = offline_queue.OfflineQueue(str(tmp_path), SEGMENT_SIZE, 64 * SEGMENT_SIZE, ttl=60)
+    now = offline_queue.time.time()
+    monkeypatch.setattr(offline_queue.time, "time", lambda: now - 120)
+    queue.store("10.0.0.2", "10.0.0.1", "old")
+    queue.store("10.0.0.3", "10.0.0.1", "old")
+    monkeypatch.setattr(offline_queue.time, "time", lambda: now)
+    queue.store("10.0.0.3", "10.0.0.1", "new")
+
+    assert queue.expire() == 1
+    assert not queue.has_pending("10.0.0.2")
+    assert not os.path.exists(os.path.join(str(tmp_path), "10.0.0.2"))
+    # A queue with a fresh message is kept; its stale messages are skipped on delivery.
+    messages, _ = queue.read("10.0.0.3", 1024)
+    assert [queue.is_expired(message) for message in messages] == [True, False]
+    queue.close()
@@ -0,0 +1,132 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import outbound
+
+
+class GatedSocket:
+    """Socket stand-in whose sendall() waits until the gate opens, like a client that stopped reading."""
+
+    def __init__(self):
+        self.gate = threading.Event()
+        self.written = []
+        self.error = None
+
+    def sendall(self, data):
+        self.gate.wait(5)
+        if self.error is not None:
+            raise self.error
+        self.written.append(data)
+
+    def shutdown(self, how):
+        pass
+
+    def close(self):
+        self.gate.set()
+
+
+def _stalled_connection(max_queue, policy, block_timeout=5, on_error=None):
+    sock = GatedSocket()
+    conn = outbound.ClientConnection(sock, ("10.0.0.1", 1234), max_queue, policy, block_timeout,
+                                     on_error or (lambda connection, error: None))
+    # The writer takes this one and then waits on the gate, so later frames stay queued.
+    conn.sendall(b"first|")
+    _wait_for(lambda: conn.queue_depth() == 0)
+    return sock, conn
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def test_drop_oldest_keeps_the_newest_frames():
+    sock, conn = _stalled_connection(2, outbound.POLICY_DROP_OLDEST)
+    for data in (b"a|", b"b|", b"c|"):
+        conn.sendall(data)
+    assert conn.queue_depth() == 2
+    assert conn.dropped_messages == 1
+
+    sock.gate.set()
+    _wait_for(lambda: b"".join(sock.written) == b"first|b|c|")
+    conn.close()
+
+
+def test_disconnect_policy_raises_when_full():
+    sock, conn = _stalled_connection(1, outbound.POLICY_DISCONNECT)
+    conn.sendall(b"a|")
+    with pytest.raises(outbound.SlowConsumerError):
+        conn.sendall(b"b|")
+    conn.close()
+
+
+def test_block_policy_waits_for_space():
+    sock, conn = _stalled_connection(1, outbound.POLICY_BLOCK)
+    conn.sendall(b"a|")
+    sender = threading.Thread(target=conn.sendall, args=(b"b|",))
+    sender.start()
+    sender.join(0.1)
+    assert sender.is_alive()
+
+    sock.gate.set()
+    sender.join(5)
+    assert not sender.is_alive()
+    _wait_for(lambda: b"".join(sock.written) == b"first|a|b|")
+    conn.close()
+
+
+def test_block_policy_gives_up_after_the_timeout():
+    sock, conn = _stalled_connection(1, outbound.POLICY_BLOCK, block_timeout=0.05)
+    conn.sendall(b"a|")
+    with pytest.raises(outbound.SlowConsumerError):
+        conn.sendall(b"b|")
+    conn.close()
+
+
+def test_write_error_is_reported_once():
+    errors = []
+    sock, conn = _stalled_connection(4, outbound.POLICY_DROP_OLDEST,
+                                     on_error=lambda connection, error: errors.append((connection, error)))
+    sock.error = OSError("connection reset")
+    sock.gate.set()
+    _wait_for(lambda: errors)
+    assert errors == [(conn, sock.error)]
+
+
+def test_closed_connection_rejects_frames():
+    sock, conn = _stalled_connection(4, outbound.POLICY_DROP_OLDEST)
+    conn.close()
+    with pytest.raises(outbound.SlowConsumerError):
+        conn.sendall(b"late|")
+
+
+def test_confirmed_entries_survive_drop_oldest():
+    sock, conn = _stalled_connection(2, outbound.POLICY_DROP_OLDEST)
+    results = []
+    conn.sendall(b"batch|", results.append)
+    for data in (b"a|", b"b|", b"c|"):
+        conn.sendall(data)
+    assert conn.dropped_messages == 2
+
+    sock.gate.set()
+    _wait_for(lambda: results)
+    assert results == [True]
+    assert b"".join(sock.written) == b"first|batch|c|"
+    conn.close()
+
+
+def test_unwritten_entries_are_reported_on_shutdown():
+    sock, conn = _stalled_connection(2, outbound.POLICY_DROP_OLDEST)
+    results = []
+    conn.sendall(b"batch|", results.append)
+    conn.shutdown(None)
+    assert results == [False]
+    conn.close()
@@ -0,0 +1,107 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import protocol
+
+
+def test_frames_split_across_feeds_are_reassembled():
+    data = protocol.encode_json_frame({"message": "héllo"}) + protocol.encode_json_frame({"message": "second"})
+    decoder = protocol.FrameDecoder()
+    frames = []
+    for i in range(len(data)):
+        frames.extend(decoder.feed(data[i:i + 1]))
+    assert frames == [b'{"message": "h\\u00e9llo"}', b'{"message": "second"}']
+    assert decoder.pending() == 0
+
+
+def test_partial_frame_is_kept_until_complete():
+    frame = protocol.encode_frame("¡hola!".encode('utf-8'))
+    decoder = protocol.FrameDecoder()
+    # Split inside the two-byte UTF-8 sequence of the first character.
+    assert decoder.feed(frame[:5]) == []
+    assert decoder.pending() == 5
+    assert decoder.feed(frame[5:] + frame[:2]) == ["¡hola!".encode('utf-8')]
+    assert decoder.pending() == 2
+
+
+def test_oversized_frame_is_rejected():
+    decoder = protocol.FrameDecoder(max_frame_size=8)
+    assert decoder.feed(protocol.encode_frame(b"12345678")) == [b"12345678"]
+    with pytest.raises(protocol.ProtocolError):
+        decoder.feed(protocol.FRAME_HEADER.pack(9))
+    assert decoder.pending() == 0
+
+
+def test_encode_frame_rejects_payload_over_limit():
+    with pytest.raises(protocol.ProtocolError):
+        protocol.encode_frame(b"x" * (protocol.MAX_FRAME_SIZE + 1))
+
+
+def test_add_envelope_field_splices_into_the_object():
+    payload = b'{"type": "DM", "message": "hi"}'
+    spliced = protocol.add_envelope_field(payload, "sender_ip", "10.0.0.1")
+    assert spliced == b'{"type": "DM", "message": "hi", "sender_ip": "10.0.0.1"}'
+    assert json.loads(spliced)["sender_ip"] == "10.0.0.1"
+
+
+def test_add_envelope_field_overrides_the_senders_value():
+    spliced = protocol.add_envelope_field(b'{"sender_ip": "1.2.3.4"} \n', "sender_ip", "10.0.0.1")
+    assert json.loads(spliced) == {"sender_ip": "10.0.0.1"}
+
+
+def test_add_envelope_field_handles_an_empty_object():
+    assert json.loads(protocol.add_envelope_field(b"{ }", "k", [1])) == {"k": [1]}
+
+
+def test_add_envelope_field_rejects_non_objects():
+    with pytest.raises(protocol.ProtocolError):
+        protocol.add_envelope_field(b'["not", "an", "object"]', "k", "v")
+
+
+@pytest.mark.parametrize("message", [
+    {"type": "DM", "recipient": "10.0.0.2", "sender_ip": "10.0.0.1", "message": "hi ✓"},
+    {"type": "DM", "recipient": "::1", "message": ""},
+    {"type": "BROADCAST", "recipient": "ALL", "sender_ip": "fe80::1", "message": "all"},
+    {"type": "SERVER_DM", "message": "from the server"},
+    {"type": "ERROR", "message": "bad"},
+])
+def test_binary_round_trip(message):
+    payload = protocol.encode_message(message, protocol.ENCODING_BINARY)
+    assert protocol.is_binary_payload(payload)
+    assert protocol.decode_message(payload) == message
+
+
+def test_binary_and_json_frames_decode_to_the_same_message():
+    message = {"type": "DM", "recipient": "10.0.0.2", "message": "same"}
+    for encoding in protocol.SUPPORTED_ENCODINGS:
+        frames = protocol.FrameDecoder().feed(protocol.encode_message_frame(message, encoding))
+        assert [protocol.decode_message(frame) for frame in frames] == [message]
+
+
+def test_binary_encoding_rejects_unknown_types_and_addresses():
+    with pytest.raises(protocol.ProtocolError):
+        protocol.encode_message({"type": "HELLO"}, protocol.ENCODING_BINARY)
+    with pytest.raises(protocol.ProtocolError):
+        protocol.encode_message({"type": "DM", "recipient": "10.1", "message": "x"}, protocol.ENCODING_BINARY)
+
+
+def test_truncated_binary_header_is_rejected():
+    payload = protocol.encode_message({"type": "DM", "recipient": "10.0.0.2", "message": "x"}, protocol.ENCODING_BINARY)
+    with pytest.raises(protocol.ProtocolError):
+        protocol.decode_message(payload[:5])
+
+
+def test_relay_message_reuses_json_bytes_and_converts_to_binary():
+    payload = b'{"type": "DM", "recipient": "10.0.0.2", "message": "hi"}'
+    relay = protocol.RelayMessage("DM", "10.0.0.2", "10.0.0.1", json_payload=payload, json_message="hi")
+    json_frame = relay.frame(protocol.ENCODING_JSON)
+    assert relay.frame(protocol.ENCODING_JSON) is json_frame
+    expected = {"type": "DM", "recipient": "10.0.0.2", "message": "hi", "sender_ip": "10.0.0.1"}
+    for encoding in protocol.SUPPORTED_ENCODINGS:
+        frames = protocol.FrameDecoder().feed(relay.frame(encoding))
+        assert protocol.decode_message(frames[0]) == expected